@@ -1,11 +1,15 @@
+import asyncio
 import json
+import math
 import time
+import httpx
 import requests
 from functools import lru_cache
 from typing import Any, cast
 
 from api.logger import logger, logger_timeit
 from api.config import Settings, get_settings
+from models.beds import BatchRowResult
 
 
 def _admin_auth_headers(token: str) -> dict[str, str]:
@@ -272,6 +276,13 @@ def _get_table_dict(settings: Settings, auth_token: str, application_id: int) ->
     return table_dict
 
 
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception as e:
+        logger.warning(f"Could not close a replaced baserow client: {e}")
+
+
 class BaserowException(Exception):
     def __init__(self, message: str):
         super().__init__(message)
@@ -287,23 +298,81 @@ class BaserowDB:
     _admin_auth_headers = _admin_auth_headers
     _simple_auth_headers = _simple_auth_headers
 
+    # Baserow will not return more than 200 rows in a page
+    max_page_size = 200
+
     def __init__(
         self,
         settings: Settings,
         database_token: str,
         tables_dict: dict,
+        transport: httpx.AsyncBaseTransport | None = None,
     ) -> None:
         self.baserow_url = settings.baserow_url
         self.database_token = database_token
         self.tables_dict = tables_dict
 
+        # Reuse connections (keep-alive) across requests to baserow
+        self._session = requests.Session()
+        self._session.headers.update(_simple_auth_headers(database_token))
+
+        self._transport = transport
+        self._async_client: httpx.AsyncClient | None = None
+        self._async_client_loop: asyncio.AbstractEventLoop | None = None
+        # closes of replaced clients, referenced until they finish
+        self._closing: set[asyncio.Task] = set()
+
+    def _rows_url(self, table_name: str) -> str:
+        table_id = self.tables_dict.get(table_name, {}).get("id")
+        return f"{self.baserow_url}/api/database/rows/table/{table_id}/"
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Connection pooled client for the running event loop; pooled
+        connections cannot be shared between loops so a new client is made if
+        the loop changes
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._close_previous_async_client()
+            self._async_client = httpx.AsyncClient(
+                headers=_simple_auth_headers(self.database_token),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                transport=self._transport,
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    def _close_previous_async_client(self) -> None:
+        """
+        Close the client made for another event loop: on that loop if it is
+        still running, otherwise on this one (its connections are unusable
+        either way, this releases their sockets)
+        """
+        client, loop = self._async_client, self._async_client_loop
+        self._async_client = self._async_client_loop = None
+        if client is None:
+            return
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+        else:
+            task = asyncio.get_running_loop().create_task(_aclose_quietly(client))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def aclose(self) -> None:
+        """Close the async client, e.g. when the app shuts down"""
+        client, self._async_client = self._async_client, None
+        self._async_client_loop = None
+        if client is not None:
+            await client.aclose()
+
     @logger_timeit()
     def get_fields(self, table_name: str) -> dict[str, int]:
-        auth_token = self.database_token
         table_id = self.tables_dict.get(table_name, {}).get("id")
 
         url = f"{self.baserow_url}/api/database/fields/table/{table_id}/"
-        response = requests.get(url, headers=_simple_auth_headers(auth_token))
+        response = self._session.get(url)
 
         if response.status_code != 200:
             raise BaserowException(
@@ -324,19 +393,14 @@ class BaserowDB:
         through an
         endpoint until all rows are returned.
         """
-        # auth_token = self._get_user_auth_token()["access_token"]
-        auth_token = self.database_token
-        table_id = self.tables_dict.get(table_name, {}).get("id")
-        rows_url = f"{self.baserow_url}/api/database/rows/table/{table_id}/"
+        rows_url = self._rows_url(table_name)
 
         params["page"] = 0
 
         rows = []
         while True:
             params["page"] = params["page"] + 1
-            response = requests.get(
-                rows_url, headers=_simple_auth_headers(auth_token), params=params
-            )
+            response = self._session.get(rows_url, params=params)
 
             if response.status_code != 200:
                 raise BaserowException(
@@ -352,6 +416,69 @@ class BaserowDB:
 
         return rows
 
+    async def _get_page(
+        self, client: httpx.AsyncClient, url: str, params: dict, page: int
+    ) -> dict:
+        response = await client.get(url, params={**params, "page": page})
+
+        if response.status_code != 200:
+            raise BaserowException(
+                f"unexpected response {response.status_code}: "
+                f"{str(response.content)}"
+            )
+
+        return cast(dict, response.json())
+
+    async def get_rows_async(
+        self,
+        table_name: str,
+        params: dict,
+    ) -> list[dict]:
+        """
+        Fetch the first page to learn the total row count then fetch all of
+        the remaining pages concurrently
+        """
+        client = self._get_async_client()
+        rows_url = self._rows_url(table_name)
+        params = {"size": self.max_page_size, **params}
+
+        data = await self._get_page(client, rows_url, params, page=1)
+        rows = list(data["results"])
+
+        pages = math.ceil(data["count"] / int(params["size"]))
+        remaining = await asyncio.gather(
+            *(
+                self._get_page(client, rows_url, params, page=page)
+                for page in range(2, pages + 1)
+            )
+        )
+        for data in remaining:
+            rows.extend(data["results"])
+
+        return rows
+
+    async def get_rows_by_field(
+        self,
+        table_name: str,
+        params: dict,
+        field_name: str,
+        values: list[str],
+    ) -> list[dict]:
+        """
+        Rows where field_name equals any of the values; one filtered request
+        per value, all issued concurrently
+        """
+        field_id = self.tables_dict.get(table_name, {}).get("fields", {})[field_name]
+        results = await asyncio.gather(
+            *(
+                self.get_rows_async(
+                    table_name, {**params, f"filter__field_{field_id}__equal": value}
+                )
+                for value in values
+            )
+        )
+        return [row for rows in results for row in rows]
+
     @logger_timeit()
     def post_row(
         self,
@@ -359,13 +486,9 @@ class BaserowDB:
         params: dict,
         payload: dict,
     ) -> Any:
-        auth_token = self.database_token
-        table_id = self.tables_dict.get(table_name, {}).get("id")
-        url = f"{self.baserow_url}/api/database/rows/table/{table_id}/"
+        url = self._rows_url(table_name)
 
-        response = requests.post(
-            url, headers=_simple_auth_headers(auth_token), params=params, json=payload
-        )
+        response = self._session.post(url, params=params, json=payload)
 
         if response.status_code != 200:
             raise BaserowException(
@@ -376,6 +499,65 @@ class BaserowDB:
 
         return response.json()
 
+    def _batch_rows(
+        self,
+        method: str,
+        table_name: str,
+        params: dict,
+        items: list[dict],
+    ) -> list[tuple[dict | None, str | None]]:
+        """
+        Send rows to the baserow batch endpoint in chunks of at most
+        max_page_size rows. Baserow applies each chunk all-or-nothing so a
+        failure is reported against every row in that chunk.
+
+        Returns a (row, error) pair per item in the order given
+        """
+        url = f"{self._rows_url(table_name)}batch/"
+        results: list[tuple[dict | None, str | None]] = []
+
+        for start in range(0, len(items), self.max_page_size):
+            chunk = items[start : start + self.max_page_size]
+            response = self._session.request(
+                method, url, params=params, json={"items": chunk}
+            )
+
+            if response.status_code == 200:
+                results.extend((row, None) for row in response.json()["items"])
+            else:
+                error = (
+                    f"unexpected response {response.status_code}: "
+                    f"{str(response.content)}"
+                )
+                logger.error(f"Batch {method} to {table_name} failed: {error}")
+                results.extend((None, error) for _ in chunk)
+
+        return results
+
+    @logger_timeit()
+    def post_rows_batch(
+        self, table_name: str, params: dict, items: list[dict]
+    ) -> list[tuple[dict | None, str | None]]:
+        """Create rows using the batch endpoint"""
+        return self._batch_rows("POST", table_name, params, items)
+
+    @logger_timeit()
+    def patch_rows_batch(
+        self, table_name: str, params: dict, items: list[dict]
+    ) -> list[tuple[dict | None, str | None]]:
+        """Update rows (each item must include the row id) using the batch
+        endpoint"""
+        return self._batch_rows("PATCH", table_name, params, items)
+
+
+def to_batch_results(
+    results: list[tuple[dict | None, str | None]]
+) -> list[BatchRowResult]:
+    return [
+        BatchRowResult(index=index, ok=row is not None, row=row, error=error)
+        for index, (row, error) in enumerate(results)
+    ]
+
 
 @lru_cache()
 def get_baserow_db() -> BaserowDB:
@@ -0,0 +1,206 @@
+"""
+In-process mirror of the slowly changing baserow tables
+
+The beds, rooms and departments tables change a few times a day so rather
+than download them from baserow on every request we hold a copy here,
+indexed by the fields the routes filter on, and refresh it on a timer (or
+when baserow calls the webhook route). Writes go to baserow first and the
+row baserow returns is then written into the mirror.
+
+Each write is numbered (a per-table upsert generation) and kept until a
+refresh that started after it has loaded, so a refresh that downloaded the
+table before the write cannot overwrite it.
+"""
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from api.baserow import BaserowDB
+from api.config import get_settings
+from api.logger import logger
+
+# table name -> fields to index rows by
+MIRRORED_TABLES: dict[str, tuple[str, ...]] = {
+    "beds": ("location_string", "department", "hl7_room"),
+    "rooms": ("hl7_room", "department"),
+    "departments": ("department",),
+    "discharge_statuses": ("csn",),
+}
+
+# table name -> date field; only rows modified within the last
+# baserow_mirror_recent_hours are mirrored for these ever-growing tables
+RECENT_ONLY_TABLES: dict[str, str] = {
+    "discharge_statuses": "modified_at",
+}
+
+
+@dataclass(frozen=True)
+class _MirroredTable:
+    """Immutable copy of a table; swapped in whole on refresh"""
+
+    rows: dict[int, dict] = field(default_factory=dict)
+    indexes: dict[str, dict[object, tuple[int, ...]]] = field(default_factory=dict)
+    refreshed_at: datetime | None = None
+    # bumped only when the rows change so derived data can be keyed on it
+    version: int = 0
+
+
+def _build_table(
+    rows: Iterable[dict], index_fields: tuple[str, ...], previous: _MirroredTable
+) -> _MirroredTable:
+    rows_by_id = {row["id"]: row for row in rows}
+
+    indexes: dict[str, dict[object, tuple[int, ...]]] = {}
+    for index_field in index_fields:
+        index: dict[object, list[int]] = {}
+        for row_id, row in rows_by_id.items():
+            key = row.get(index_field)
+            if isinstance(key, (list, dict)):
+                # link/select fields are not hashable so cannot be indexed
+                continue
+            index.setdefault(key, []).append(row_id)
+        indexes[index_field] = {k: tuple(v) for k, v in index.items()}
+
+    changed = previous.refreshed_at is None or rows_by_id != previous.rows
+    return _MirroredTable(
+        rows=rows_by_id,
+        indexes=indexes,
+        refreshed_at=datetime.now(timezone.utc),
+        version=previous.version + 1 if changed else previous.version,
+    )
+
+
+class BaserowMirror:
+    """Copies of the MIRRORED_TABLES with an index per filter field"""
+
+    def __init__(self) -> None:
+        self._tables = {name: _MirroredTable() for name in MIRRORED_TABLES}
+        self._refresh_locks = {name: asyncio.Lock() for name in MIRRORED_TABLES}
+        # Writes may come from routes running in the threadpool
+        self._write_lock = threading.Lock()
+        # Upserts not yet seen by a completed refresh, as (generation, rows)
+        self._generations = {name: 0 for name in MIRRORED_TABLES}
+        self._upserts: dict[str, list[tuple[int, list[dict]]]] = {
+            name: [] for name in MIRRORED_TABLES
+        }
+
+    def refreshed_at(self, table_name: str) -> datetime | None:
+        return self._tables[table_name].refreshed_at
+
+    def version(self, table_name: str) -> int:
+        """Changes whenever the rows of the table change (0 until loaded)"""
+        return self._tables[table_name].version
+
+    def generation(self, table_name: str) -> int:
+        """Number of the latest upsert to the table (0 if none)"""
+        return self._generations[table_name]
+
+    def load(
+        self, table_name: str, rows: Iterable[dict], generation: int | None = None
+    ) -> None:
+        """
+        Replace the mirrored copy of a table
+
+        rows are as downloaded once the upsert generation had reached
+        generation; upserts made since then are applied on top of them. With
+        no generation the rows are taken to include every upsert so far.
+        """
+        with self._write_lock:
+            if generation is None:
+                generation = self._generations[table_name]
+            upserts = [
+                (upsert_generation, upserted)
+                for upsert_generation, upserted in self._upserts[table_name]
+                if upsert_generation > generation
+            ]
+            rows_by_id = {row["id"]: row for row in rows}
+            for _, upserted in upserts:
+                rows_by_id.update((row["id"], row) for row in upserted)
+
+            self._upserts[table_name] = upserts
+            self._tables[table_name] = _build_table(
+                rows_by_id.values(),
+                MIRRORED_TABLES[table_name],
+                self._tables[table_name],
+            )
+
+    async def refresh(self, baserow: BaserowDB, table_name: str) -> None:
+        params = {
+            "size": 200,  # The maximum size of a page.
+            "user_field_names": "true",
+        }
+        if table_name in RECENT_ONLY_TABLES:
+            params.update(
+                recent_rows_filter(
+                    baserow,
+                    table_name,
+                    timedelta(hours=get_settings().baserow_mirror_recent_hours),
+                )
+            )
+        async with self._refresh_locks[table_name]:
+            generation = self.generation(table_name)
+            rows = await baserow.get_rows_async(table_name, params)
+            self.load(table_name, rows, generation)
+        logger.info(f"Baserow mirror refreshed {table_name} ({len(rows)} rows)")
+
+    async def refresh_all(self, baserow: BaserowDB) -> None:
+        await asyncio.gather(
+            *(self.refresh(baserow, table_name) for table_name in MIRRORED_TABLES)
+        )
+
+    async def ensure(self, baserow: BaserowDB, table_name: str) -> None:
+        """Load a table on first use if the timer has not got to it yet"""
+        if self._tables[table_name].refreshed_at is None:
+            await self.refresh(baserow, table_name)
+
+    def rows(self, table_name: str) -> list[dict]:
+        """Copies of all rows (callers are free to modify them)"""
+        return [dict(row) for row in self._tables[table_name].rows.values()]
+
+    def filter(
+        self, table_name: str, field_name: str, values: Iterable[object]
+    ) -> list[dict]:
+        """Copies of rows where field_name equals any of the values"""
+        table = self._tables[table_name]
+        index = table.indexes[field_name]
+        return [
+            dict(table.rows[row_id])
+            for value in values
+            for row_id in index.get(value, ())
+        ]
+
+    def upsert(self, table_name: str, rows: Iterable[dict]) -> None:
+        """Write rows returned by baserow after a create/update"""
+        rows = list(rows)
+        with self._write_lock:
+            self._generations[table_name] += 1
+            self._upserts[table_name].append((self._generations[table_name], rows))
+
+            table = self._tables[table_name]
+            if table.refreshed_at is None:
+                # Not loaded yet; the first load will apply these rows
+                return
+            rows_by_id = dict(table.rows)
+            rows_by_id.update((row["id"], row) for row in rows)
+            self._tables[table_name] = _build_table(
+                rows_by_id.values(), MIRRORED_TABLES[table_name], table
+            )
+
+
+def recent_rows_filter(
+    baserow: BaserowDB, table_name: str, delta: timedelta
+) -> dict[str, str]:
+    """Baserow list rows filter for rows modified within delta of now"""
+    date_field = RECENT_ONLY_TABLES[table_name]
+    field_id = baserow.tables_dict.get(table_name, {}).get("fields", {})[date_field]
+    horizon = (datetime.utcnow() - delta).isoformat()
+    return {f"filter__field_{field_id}__date_after": horizon}
+
+
+_baserow_mirror = BaserowMirror()
+
+
+def get_baserow_mirror() -> BaserowMirror:
+    return _baserow_mirror
@@ -0,0 +1,165 @@
+"""
+Bed map layout for a campus or group of departments
+
+The sitrep and PERRT maps both need the open departments, the open rooms
+with beds and the beds in those rooms with a position on the map
+(floor_y_index: one row per department ordered by floor, floor_x_index: the
+bed's place along that row). The layout only depends on the baserow
+departments, rooms and beds tables so it is built once per set of filters
+and rebuilt only when one of those tables changes in the mirror.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable
+
+import orjson
+import pandas as pd
+
+from api.baserow_mirror import BaserowMirror
+from models.beds import Bed, Department, Room
+
+LAYOUT_TABLES = ("departments", "rooms", "beds")
+# layouts kept, least recently used dropped first; the department filters
+# come from the request so the set of keys is not bounded otherwise
+LAYOUTS_MAXSIZE = 64
+
+
+def _closed(df: pd.DataFrame) -> pd.Series:
+    return df["closed"].fillna(False).astype(bool)
+
+
+def _gen_floor_indices(df: pd.DataFrame) -> pd.DataFrame:
+    # now generate floor_y_index
+    df = df.sort_values(["floor", "floor_order", "department", "bed_number"])
+    floor_depts = df[["floor", "floor_order", "department"]].drop_duplicates()
+    floor_depts = floor_depts.sort_values(["floor", "floor_order"])
+    floor_depts["floor_y_index"] = floor_depts.reset_index().index + 1
+    df = df.merge(floor_depts, how="left")
+
+    # create a floor x_index by sorting and ranking within floor_y_index
+    df = df.sort_values(["floor_y_index", "bed_number"])
+    df["floor_x_index"] = df.groupby("floor_y_index")["bed_number"].rank(
+        method="first", na_option="keep"
+    )
+    return df.sort_values(["location_string"])
+
+
+def build_layout(
+    departments: Iterable[dict],
+    rooms: Iterable[dict],
+    beds: Iterable[dict],
+    location_name: str | None = None,
+    department_names: Iterable[str] = (),
+    include_closed_beds: bool = True,
+) -> dict[str, list[dict]]:
+    """
+    Departments at location_name or named in department_names (all if
+    neither are given) that are not permanently closed, their open rooms with
+    beds and the beds in those rooms with floor_y_index and floor_x_index
+
+    Closed beds are kept (for the sitrep map to show) unless
+    include_closed_beds is False; beds without a bed_number never are.
+    """
+    department_names = set(department_names)
+    depts = [
+        Department.parse_obj(row).dict()
+        for row in departments
+        if not row.get("closed_perm_01")
+        and (location_name is None or row.get("location_name") == location_name)
+        and (not department_names or row.get("department") in department_names)
+    ]
+    room_rows = [Room.parse_obj(row).dict() for row in rooms if row.get("has_beds")]
+    bed_rows = [Bed.parse_obj(row).dict() for row in beds]
+    if not depts or not room_rows or not bed_rows:
+        return {"departments": depts, "rooms": [], "beds": []}
+
+    dfdepts = pd.DataFrame.from_records(depts)
+    dfrooms = pd.DataFrame.from_records(room_rows)
+    bedsdf = pd.DataFrame.from_records(bed_rows)
+
+    # default inner join drops rooms not in the selected departments
+    dfrooms = dfrooms.merge(dfdepts[["department", "hl7_department"]], on="department")
+    # drop closed rooms
+    dfrooms = dfrooms.loc[~_closed(dfrooms), :]
+
+    # also close rooms (bays) where all the beds are closed
+    bedsdf["closed"] = _closed(bedsdf)
+    all_beds_closed = bedsdf.groupby("hl7_room")["closed"].all()
+    open_rooms = dfrooms.loc[
+        ~dfrooms["hl7_room"].map(all_beds_closed).fillna(True).astype(bool),
+        ["hl7_room", "is_sideroom"],
+    ]
+
+    # inner join to drop beds in closed rooms or rooms without beds
+    bedsdf = bedsdf.merge(open_rooms, on="hl7_room", how="inner")
+    # inner join to drop beds outside the selected departments
+    bedsdf = bedsdf.merge(
+        dfdepts[["department", "floor_order"]], on="department", how="inner"
+    )
+
+    bedsdf = bedsdf[bedsdf["bed_number"] != -1]
+    if not include_closed_beds:
+        bedsdf = bedsdf[~bedsdf["closed"]]
+
+    bedsdf = _gen_floor_indices(bedsdf)
+
+    # NaN (e.g. a department without a floor_order) is sent as null
+    bedsdf = bedsdf.astype(object).where(bedsdf.notna(), None)
+    return {
+        "departments": depts,
+        "rooms": dfrooms.to_dict(orient="records"),  # type: ignore
+        "beds": bedsdf.to_dict(orient="records"),  # type: ignore
+    }
+
+
+class BedLayoutCache:
+    """Serialised layouts keyed by their filters and the mirror versions"""
+
+    def __init__(self, maxsize: int = LAYOUTS_MAXSIZE) -> None:
+        self._maxsize = maxsize
+        self._layouts: OrderedDict[tuple, tuple[tuple[int, ...], bytes]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(
+        self,
+        mirror: BaserowMirror,
+        location_name: str | None = None,
+        department_names: Iterable[str] = (),
+        include_closed_beds: bool = True,
+    ) -> bytes:
+        """The layout (see build_layout) as JSON, rebuilt if baserow changed"""
+        key = (location_name, tuple(sorted(department_names)), include_closed_beds)
+        versions = tuple(mirror.version(table) for table in LAYOUT_TABLES)
+
+        cached = self._layouts.get(key)
+        if cached is not None and cached[0] == versions:
+            try:
+                self._layouts.move_to_end(key)
+            except KeyError:
+                pass  # dropped by another request meanwhile
+            return cached[1]
+
+        with self._lock:
+            # another request may have rebuilt it while we waited
+            cached = self._layouts.get(key)
+            if cached is not None and cached[0] == versions:
+                return cached[1]
+            layout = build_layout(
+                *(mirror.rows(table) for table in LAYOUT_TABLES),
+                location_name=location_name,
+                department_names=department_names,
+                include_closed_beds=include_closed_beds,
+            )
+            payload = orjson.dumps(layout, option=orjson.OPT_SERIALIZE_NUMPY)
+            self._layouts[key] = (versions, payload)
+            self._layouts.move_to_end(key)
+            while len(self._layouts) > self._maxsize:
+                self._layouts.popitem(last=False)
+        return payload
+
+
+_bed_layout_cache = BedLayoutCache()
+
+
+def get_bed_layout_cache() -> BedLayoutCache:
+    return _bed_layout_cache
@@ -1,16 +1,41 @@
+import hmac
 import json
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, Query
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
 from pathlib import Path
+from starlette.concurrency import run_in_threadpool
 
 from api.logger import logger, logger_timeit
-from api.baserow import BaserowDB, get_baserow_db
+from api.baserow import BaserowDB, get_baserow_db, to_batch_results
+from api.baserow_mirror import (
+    MIRRORED_TABLES,
+    BaserowMirror,
+    get_baserow_mirror,
+    recent_rows_filter,
+)
+from api.beds.layout import (
+    LAYOUT_TABLES,
+    BedLayoutCache,
+    build_layout,
+    get_bed_layout_cache,
+)
 from api.config import Settings, get_settings
+from api.convert import ResponseFormat, parse_to_columns
 from api.wards import (
     CAMPUSES,
     MISSING_DEPARTMENT_LOCATIONS,
 )
-from models.beds import Bed, Department, DischargeStatus, Room
+from models.beds import (
+    BatchRowResult,
+    Bed,
+    BedLayout,
+    BedUpdate,
+    Department,
+    DischargeStatus,
+    DischargeStatusUpdate,
+    Room,
+)
 
 router = APIRouter(
     prefix="/baserow",
@@ -30,18 +55,17 @@ def get_mock_departments() -> list[Department]:
 
 @router.get("/departments", response_model=list[Department])
 @logger_timeit()
-def get_departments(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Department]:
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    rows = baserow.get_rows("departments", params)
+async def get_departments(
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[Department]:
+    await mirror.ensure(baserow, "departments")
+    rows = mirror.rows("departments")
 
     # drop baserow id and order fields
     for row in rows:
         # row.pop("id")
-        row.pop("order")
+        row.pop("order", None)
 
     return [Department.parse_obj(row) for row in rows]
 
@@ -55,27 +79,38 @@ def get_mock_rooms() -> list[Room]:
 
 @router.get("/rooms", response_model=list[Room])
 @logger_timeit()
-def get_rooms(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Room]:
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
-
-    rows = baserow.get_rows("rooms", params)
+async def get_rooms(
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[Room]:
+    await mirror.ensure(baserow, "rooms")
+    rows = mirror.rows("rooms")
 
     # drop baserow id and order fields
     for row in rows:
         # row.pop("id")
-        row.pop("order")
+        row.pop("order", None)
 
     return [Room.parse_obj(row) for row in rows]
 
 
+def _beds_response(
+    rows: list[dict], response_format: ResponseFormat
+) -> list[Bed] | Response:
+    if response_format is ResponseFormat.columns:
+        # Returned as is so FastAPI skips re-validating against the response_model
+        return ORJSONResponse(parse_to_columns(rows, Bed))
+    return [Bed.parse_obj(row) for row in rows]
+
+
 @mock_router.get("/beds", response_model=list[Bed])
 def get_mock_beds(
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[Bed]:
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[Bed] | Response:
     with open(Path(__file__).parent / "bed_defaults.json", "r") as f:
         rows = json.load(f)
 
@@ -84,48 +119,51 @@ def get_mock_beds(
     if len(locations):
         rows = [row for row in rows if row.get("location_string") in locations]
 
-    return [Bed.parse_obj(row) for row in rows]
+    return _beds_response(rows, response_format)
 
 
-@router.get("/beds", response_model=list[Bed])
-@logger_timeit()
-def get_beds(
-    departments: list[str] = Query(default=[]),
-    locations: list[str] = Query(default=[]),
-    baserow: BaserowDB = Depends(get_baserow_db),
-) -> list[Bed]:
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
+async def _get_bed_rows(
+    baserow: BaserowDB,
+    mirror: BaserowMirror,
+    departments: list[str],
+    locations: list[str],
+) -> list[dict]:
+    """
+    Beds in any of the departments or locations (or all beds if neither are
+    given) looked up in the baserow mirror
+    """
+    await mirror.ensure(baserow, "beds")
 
     if len(departments) or len(locations):
-        rows = []
-        for department in departments:
-            department_field_id = field_ids["department"]
-            params[f"filter__field_{department_field_id}__equal"] = department
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{department_field_id}__equal")
-
-        for location in locations:
-            location_string_field_id = field_ids["location_string"]
-            params[f"filter__field_{location_string_field_id}__equal"] = location
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{location_string_field_id}__equal")
-
+        rows = mirror.filter("beds", "department", departments)
+        rows.extend(mirror.filter("beds", "location_string", locations))
     else:
         # get everything
-        rows = baserow.get_rows("beds", params)
+        rows = mirror.rows("beds")
 
     # drop baserow id and order fields
     for row in rows:
         # preserve bed id to use in patching
         # row.pop("id")
-        row.pop("order")
+        row.pop("order", None)
 
+    return rows
+
+
+@router.get("/beds", response_model=list[Bed])
+@logger_timeit()
+async def get_beds(
+    departments: list[str] = Query(default=[]),
+    locations: list[str] = Query(default=[]),
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[Bed] | Response:
+    rows = await _get_bed_rows(baserow, mirror, departments, locations)
     logger.info(f"Returning {len(rows)} beds")
-    return [Bed.parse_obj(row) for row in rows]
+    return _beds_response(rows, response_format)
 
 
 @mock_router.get("/campus", response_model=list[Bed])
@@ -157,9 +195,10 @@ def get_mock_campus(
 
 @router.get("/campus", response_model=list[Bed])
 @logger_timeit()
-def get_campus(
+async def get_campus(
     campuses: list[str] = Query(default=[]),
     baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
 ) -> list[Bed]:
     departments: list = []
     for campus in campuses:
@@ -170,36 +209,53 @@ def get_campus(
         if missing_locations := MISSING_DEPARTMENT_LOCATIONS.get(department):
             locations.extend(missing_locations)
 
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-    }
+    rows = await _get_bed_rows(baserow, mirror, departments, locations)
+    return [Bed.parse_obj(row) for row in rows]
 
-    if len(departments) or len(locations):
-        rows = []
-        for department in departments:
-            department_field_id = field_ids["department"]
-            params[f"filter__field_{department_field_id}__equal"] = department
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{department_field_id}__equal")
-
-        for location in locations:
-            location_string_field_id = field_ids["location_string"]
-            params[f"filter__field_{location_string_field_id}__equal"] = location
-            rows.extend(baserow.get_rows("beds", params))
-            params.pop(f"filter__field_{location_string_field_id}__equal")
 
-    else:
-        # get everything
-        rows = baserow.get_rows("beds", params)
+@mock_router.get("/layout", response_model=BedLayout)
+def get_mock_layout(
+    location_name: str | None = None,
+    departments: list[str] = Query(default=[]),
+    include_closed_beds: bool = True,
+) -> BedLayout:
+    tables = []
+    for defaults in ("department_defaults", "room_defaults", "bed_defaults"):
+        with open(Path(__file__).parent / f"{defaults}.json", "r") as f:
+            tables.append(json.load(f))
+
+    layout = build_layout(
+        *tables,
+        location_name=location_name,
+        department_names=departments,
+        include_closed_beds=include_closed_beds,
+    )
+    return BedLayout.parse_obj(layout)
 
-    # drop baserow id and order fields
-    for row in rows:
-        # row.pop("id")
-        row.pop("order")
 
-    return [Bed.parse_obj(row) for row in rows]
+@router.get("/layout", response_model=BedLayout)
+@logger_timeit()
+async def get_layout(
+    location_name: str | None = None,
+    departments: list[str] = Query(default=[]),
+    include_closed_beds: bool = True,
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+    layouts: BedLayoutCache = Depends(get_bed_layout_cache),
+) -> Response:
+    """
+    Open departments, rooms and beds with their map positions for a campus
+    (location_name) or list of departments; see api.beds.layout
+    """
+    for table_name in LAYOUT_TABLES:
+        await mirror.ensure(baserow, table_name)
+
+    # only (re)built when baserow has changed so usually a lookup
+    payload = await run_in_threadpool(
+        layouts.get, mirror, location_name, departments, include_closed_beds
+    )
+    # Returned as is so FastAPI skips re-validating against the response_model
+    return Response(content=payload, media_type="application/json")
 
 
 @mock_router.get("/closed/", response_model=list[Bed])
@@ -212,18 +268,12 @@ def get_mock_closed_beds() -> list[Bed]:
 
 @router.get("/closed/", response_model=list[Bed])
 @logger_timeit()
-def get_closed_beds(baserow: BaserowDB = Depends(get_baserow_db)) -> list[Bed]:
-    field_ids = baserow.tables_dict.get("beds").get("fields")  # type: ignore
-
-    closed_field_id = field_ids["closed"]
-
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-        f"filter__field_{closed_field_id}__boolean": True,
-    }
-
-    rows = baserow.get_rows("beds", params)
+async def get_closed_beds(
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[Bed]:
+    await mirror.ensure(baserow, "beds")
+    rows = [row for row in mirror.rows("beds") if row.get("closed")]
     return [Bed.parse_obj(row) for row in rows]
 
 
@@ -246,7 +296,10 @@ def post_mock_discharge_status(
 @router.post("/discharge_status/", response_model=DischargeStatus)
 @logger_timeit()
 def post_discharge_status(
-    csn: int, status: str, baserow: BaserowDB = Depends(get_baserow_db)
+    csn: int,
+    status: str,
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
 ) -> DischargeStatus:
     params = {"user_field_names": True}
 
@@ -262,10 +315,74 @@ def post_discharge_status(
         payload=payload,
     )
 
+    mirror.upsert("discharge_statuses", [result])
+
     output = DischargeStatus.parse_obj(result)  # type: DischargeStatus
     return output
 
 
+@mock_router.post("/discharge_status/batch", response_model=list[BatchRowResult])
+def post_mock_discharge_status_batch(
+    updates: list[DischargeStatusUpdate],
+) -> list[BatchRowResult]:
+    return [
+        BatchRowResult(
+            index=index,
+            ok=True,
+            row=dict(
+                id=index + 1,
+                order=index + 1,
+                csn=update.csn,
+                status=update.status,
+                modified_at=datetime.fromisoformat("2023-01-21t23:55:41"),
+            ),
+        )
+        for index, update in enumerate(updates)
+    ]
+
+
+@router.post("/discharge_status/batch", response_model=list[BatchRowResult])
+@logger_timeit()
+def post_discharge_status_batch(
+    updates: list[DischargeStatusUpdate],
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[BatchRowResult]:
+    """
+    Save many discharge statuses (e.g. at handover) using baserow's batch
+    rows API; the result for each row is returned in the order given
+    """
+    params = {"user_field_names": True}
+    modified_at = datetime.utcnow().isoformat()
+
+    items = [
+        {"csn": update.csn, "status": update.status, "modified_at": modified_at}
+        for update in updates
+    ]
+
+    results = baserow.post_rows_batch("discharge_statuses", params, items)
+    mirror.upsert("discharge_statuses", [row for row, _ in results if row])
+
+    return to_batch_results(results)
+
+
+@router.patch("/beds/batch", response_model=list[BatchRowResult])
+@logger_timeit()
+def patch_beds_batch(
+    updates: list[BedUpdate],
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[BatchRowResult]:
+    """Update many beds (e.g. bed closures) in baserow at once"""
+    params = {"user_field_names": True}
+    items = [update.dict(exclude_unset=True) for update in updates]
+
+    results = baserow.patch_rows_batch("beds", params, items)
+    mirror.upsert("beds", [row for row, _ in results if row])
+
+    return to_batch_results(results)
+
+
 @mock_router.get("/discharge_status/", response_model=list[DischargeStatus])
 def get_mock_discharge_status(
     delta_hours: int = 72,
@@ -292,20 +409,74 @@ def get_mock_discharge_status(
 
 @router.get("/discharge_status/", response_model=list[DischargeStatus])
 @logger_timeit()
-def get_discharge_status(
-    delta_hours: int = 72, baserow: BaserowDB = Depends(get_baserow_db)
+async def get_discharge_status(
+    delta_hours: int = 72,
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+    settings: Settings = Depends(get_settings),
 ) -> list[DischargeStatus]:
-    _table_dict = baserow.tables_dict.get("discharge_statuses")
+    delta = timedelta(hours=float(delta_hours))
+    if delta_hours > settings.baserow_mirror_recent_hours:
+        # Older than the mirror holds so filter in baserow
+        params = {
+            "size": 200,  # The maximum size of a page.
+            "user_field_names": "true",
+            **recent_rows_filter(baserow, "discharge_statuses", delta),
+        }
+        rows = await baserow.get_rows_async("discharge_statuses", params)
+    else:
+        await mirror.ensure(baserow, "discharge_statuses")
+        rows = mirror.rows("discharge_statuses")
 
-    modified_at_field_id = _table_dict.get("fields").get("modified_at")  # type: ignore
-    horizon = (datetime.utcnow() - timedelta(hours=float(delta_hours))).isoformat()
+    horizon = datetime.now(timezone.utc) - delta
+    statuses = [DischargeStatus.parse_obj(row) for row in rows]
+    return [status for status in statuses if _as_utc(status.modified_at) > horizon]
 
-    params = {
-        "size": 200,
-        # The maximum size of a page.
-        "user_field_names": "true",
-        f"filter__field_{modified_at_field_id}__date_after": horizon,
-    }
 
-    rows = baserow.get_rows(_table_dict.get("name"), params)  # type: ignore
-    return [DischargeStatus.parse_obj(row) for row in rows]
+def _as_utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+WEBHOOK_SECRET_HEADER = "X-Webhook-Secret"
+
+
+def _verify_webhook_secret(
+    secret: str = Header(default="", alias=WEBHOOK_SECRET_HEADER),
+    settings: Settings = Depends(get_settings),
+) -> None:
+    """The webhook is refused unless it sends the configured shared secret"""
+    expected = settings.baserow_webhook_secret
+    if expected is None or not expected.get_secret_value():
+        raise HTTPException(status_code=404)
+    if not hmac.compare_digest(secret.encode(), expected.get_secret_value().encode()):
+        raise HTTPException(status_code=403)
+
+
+@router.post("/webhook", dependencies=[Depends(_verify_webhook_secret)])
+async def post_webhook(
+    payload: dict = Body(...),
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> dict:
+    """
+    Target for baserow row webhooks: refresh the mirrored copy of whichever
+    table changed
+
+    Baserow must send API_BASEROW_WEBHOOK_SECRET in the X-Webhook-Secret
+    header; without the setting the route is disabled and the mirror relies
+    on its timed refresh
+    """
+    table_id = payload.get("table_id")
+    table_name = next(
+        (
+            name
+            for name, table in baserow.tables_dict.items()
+            if table.get("id") == table_id
+        ),
+        None,
+    )
+    if table_name not in MIRRORED_TABLES:
+        return {"refreshed": None}
+
+    await mirror.refresh(baserow, table_name)  # type: ignore
+    return {"refreshed": table_name}
@@ -0,0 +1,18 @@
+-- 2026-10-18
+-- locations with admissions/discharges since the last census refresh
+
+-- pass in
+-- watermark : timestamp of the last change already held in the census
+
+-- every insert/update to star.location_visit moves stored_from forward so
+-- this returns each location that needs its census row re-deriving along
+-- with the newest change seen for it
+
+SELECT
+	 lv.location_id
+	,MAX(lv.stored_from) stored_from
+FROM star.location_visit lv
+WHERE lv.stored_from > :watermark
+GROUP BY lv.location_id
+
+;
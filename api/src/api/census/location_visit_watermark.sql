@@ -0,0 +1,11 @@
+-- 2026-10-18
+-- high water mark for changes to star.location_visit
+
+-- taken before a full census refresh so that subsequent incremental
+-- refreshes only need to look at visits stored after this point
+
+SELECT
+	MAX(lv.stored_from) watermark
+FROM star.location_visit lv
+
+;
@@ -1,25 +1,53 @@
 import pandas as pd
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import ORJSONResponse
+from functools import lru_cache
 from pathlib import Path
 from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+from threading import Lock
 from typing import Any
 
 from api.utils import Timer
 from api import wards
+from api.census.snapshot import CensusSnapshot, get_census_snapshot
 from api.census.wrangle import aggregate_by_department
+from api.convert import ResponseFormat, to_columns
 from api.db import get_star_session
+from api.logger import logger
 from api.wards import (
     CAMPUSES,
     MISSING_DEPARTMENT_LOCATIONS,
     MISSING_LOCATION_DEPARTMENTS,
 )
-from models.census import CensusDepartment, CensusRow
+from models.census import CensusDepartment, CensusRow, CensusSnapshotStatus
 
 router = APIRouter(prefix="/census")
 
 mock_router = APIRouter(prefix="/census")
 
+REFRESHED_AT_HEADER = "X-Census-Refreshed-At"
+
+# Held while the full census query runs so that the scheduled jobs never run
+# it twice at once
+_full_refresh_lock = Lock()
+
+
+@lru_cache()
+def _live_query() -> TextClause:
+    return text((Path(__file__).parent / "live.sql").read_text())
+
+
+@lru_cache()
+def _watermark_query() -> TextClause:
+    return text((Path(__file__).parent / "location_visit_watermark.sql").read_text())
+
+
+@lru_cache()
+def _changes_query() -> TextClause:
+    return text((Path(__file__).parent / "location_visit_changes.sql").read_text())
+
 
 def _fetch_census(
     session: Session, query: Any, departments: list[str], locations: list[str]
@@ -51,6 +79,82 @@ def _fetch_census(
     return census_rows
 
 
+def refresh_census_snapshot(session: Session, snapshot: CensusSnapshot) -> None:
+    """Run the census query for every department in wards.ALL and swap the
+    result into the snapshot"""
+    with _full_refresh_lock:
+        # Read the watermark first: changes that land while the census query
+        # runs will then be picked up again by the next incremental refresh.
+        watermark = session.execute(_watermark_query()).scalar()
+        census_rows = _fetch_census(session, _live_query(), list(wards.ALL), [])
+        snapshot.update(census_rows, watermark)
+    logger.info(f"Census snapshot refreshed with {len(census_rows)} rows")
+
+
+def refresh_census_snapshot_incremental(
+    session: Session, snapshot: CensusSnapshot
+) -> None:
+    """Re-derive census rows only for locations with location_visit changes
+    since the snapshot watermark and merge them into the snapshot, unless a
+    full refresh replaced the snapshot meanwhile"""
+    generation = snapshot.generation
+    if snapshot.watermark is None:
+        # No full refresh has finished yet; start one unless one is running
+        if not _full_refresh_lock.locked():
+            refresh_census_snapshot(session, snapshot)
+        return
+
+    changes = session.execute(_changes_query(), {"watermark": snapshot.watermark}).all()
+    if not changes:
+        return
+
+    watermark = max(change.stored_from for change in changes)
+    locations = snapshot.location_strings(change.location_id for change in changes)
+    census_rows = (
+        _fetch_census(session, _live_query(), [], locations) if locations else []
+    )
+    if not snapshot.merge(census_rows, watermark, generation):
+        logger.info("Census snapshot replaced by a full refresh; merge dropped")
+        return
+    logger.info(f"Census snapshot merged {len(census_rows)} changed locations")
+
+
+def _set_refreshed_at(response: Response, snapshot: CensusSnapshot) -> None:
+    if snapshot.refreshed_at is not None:
+        response.headers[REFRESHED_AT_HEADER] = snapshot.refreshed_at.isoformat()
+
+
+def _census_response(
+    census_rows: list[CensusRow], response_format: ResponseFormat, response: Response
+) -> list[CensusRow] | Response:
+    if response_format is not ResponseFormat.columns:
+        return census_rows
+    # Returned as is so FastAPI skips re-validating against the response_model
+    columns_response = ORJSONResponse(to_columns(census_rows, CensusRow))
+    if REFRESHED_AT_HEADER in response.headers:
+        columns_response.headers[REFRESHED_AT_HEADER] = response.headers[
+            REFRESHED_AT_HEADER
+        ]
+    return columns_response
+
+
+def _fetch_departments(census_rows: list[CensusRow]) -> list[CensusDepartment]:
+    census_df = pd.DataFrame((row.dict() for row in census_rows))
+    departments_df = aggregate_by_department(census_df)
+
+    return [
+        CensusDepartment.parse_obj(row)
+        for row in departments_df.to_dict(orient="records")
+    ]
+
+
+def _campus_departments(campuses: list[str]) -> list[str]:
+    departments: list = []
+    for campus in campuses:
+        departments.extend(CAMPUSES.get(campus, []))
+    return departments
+
+
 # noinspection SqlResolve
 def _fetch_mock_census(departments: list[str], locations: list[str]) -> list[CensusRow]:
     engine = create_engine(f"sqlite:///{Path(__file__).parent}/mock.db", future=True)
@@ -72,72 +176,98 @@ def _fetch_mock_census(departments: list[str], locations: list[str]) -> list[Cen
 @mock_router.get("/departments/", response_model=list[CensusDepartment])
 def get_mock_departments() -> list[CensusDepartment]:
     census_rows = _fetch_mock_census(list(wards.ALL), [])
-    census_df = pd.DataFrame((row.dict() for row in census_rows))
-    departments_df = aggregate_by_department(census_df)
-
-    return [
-        CensusDepartment.parse_obj(row)
-        for row in departments_df.to_dict(orient="records")
-    ]
+    return _fetch_departments(census_rows)
 
 
 @router.get("/departments/", response_model=list[CensusDepartment])
 @Timer(text="Get census/departments route: Elapsed time: {:.4f}")
 def get_departments(
+    response: Response,
     session: Session = Depends(get_star_session),
+    snapshot: CensusSnapshot = Depends(get_census_snapshot),
 ) -> list[CensusDepartment]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
-    census_rows = _fetch_census(session, query, list(wards.ALL), [])
-    census_df = pd.DataFrame((row.dict() for row in census_rows))
-    departments_df = aggregate_by_department(census_df)
+    if not snapshot.is_ready:
+        # Before the first scheduled refresh has finished
+        census_rows = _fetch_census(session, _live_query(), list(wards.ALL), [])
+        return _fetch_departments(census_rows)
+    _set_refreshed_at(response, snapshot)
+    return snapshot.departments()
 
-    return [
-        CensusDepartment.parse_obj(row)
-        for row in departments_df.to_dict(orient="records")
-    ]
+
+@router.get("/snapshot/", response_model=CensusSnapshotStatus)
+def get_snapshot_status(
+    snapshot: CensusSnapshot = Depends(get_census_snapshot),
+) -> CensusSnapshotStatus:
+    return CensusSnapshotStatus(
+        refreshed_at=snapshot.refreshed_at,
+        age_seconds=snapshot.age_seconds(),
+        rows=snapshot.row_count(),
+    )
 
 
 @mock_router.get("/", response_model=list[CensusRow])
 def get_mock_census(
+    response: Response,
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[CensusRow]:
-    return _fetch_mock_census(departments, locations)
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[CensusRow] | Response:
+    census_rows = _fetch_mock_census(departments, locations)
+    return _census_response(census_rows, response_format, response)
 
 
 @router.get("/", response_model=list[CensusRow])
 @Timer(text="Get census/ route: Elapsed time: {:.4f}")
 def get_census(
+    response: Response,
     session: Session = Depends(get_star_session),
+    snapshot: CensusSnapshot = Depends(get_census_snapshot),
     departments: list[str] = Query(default=[]),
     locations: list[str] = Query(default=[]),
-) -> list[CensusRow]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
-    return _fetch_census(session, query, departments, locations)
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[CensusRow] | Response:
+    if snapshot.is_ready and snapshot.covers(departments, locations):
+        _set_refreshed_at(response, snapshot)
+        census_rows = snapshot.select(departments, locations)
+    else:
+        # Outside wards.ALL (or before the first scheduled refresh has
+        # finished) so not held in the snapshot
+        census_rows = _fetch_census(session, _live_query(), departments, locations)
+    return _census_response(census_rows, response_format, response)
 
 
 @mock_router.get("/campus/", response_model=list[CensusRow])
 def get_mock_census_by_campus(
+    response: Response,
     campuses: list[str] = Query(default=[]),
-) -> list[CensusRow]:
-    locations: list = []
-    departments: list = []
-    for campus in campuses:
-        departments.extend(CAMPUSES.get(campus, []))
-
-    return _fetch_mock_census(departments, locations)
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[CensusRow] | Response:
+    census_rows = _fetch_mock_census(_campus_departments(campuses), [])
+    return _census_response(census_rows, response_format, response)
 
 
 @router.get("/campus/", response_model=list[CensusRow])
 @Timer(text="Get census/campus route: Elapsed time: {:.4f}")
 def get_census_by_campus(
+    response: Response,
     session: Session = Depends(get_star_session),
+    snapshot: CensusSnapshot = Depends(get_census_snapshot),
     campuses: list[str] = Query(default=[]),
-) -> list[CensusRow]:
-    query = text((Path(__file__).parent / "live.sql").read_text())
-    locations: list = []
-    departments: list = []
-    for campus in campuses:
-        departments.extend(CAMPUSES.get(campus, []))
-
-    return _fetch_census(session, query, departments, locations)
+    response_format: ResponseFormat = Query(
+        default=ResponseFormat.records, alias="format"
+    ),
+) -> list[CensusRow] | Response:
+    if snapshot.is_ready:
+        _set_refreshed_at(response, snapshot)
+        census_rows = snapshot.select_campuses(campuses)
+    else:
+        # Before the first scheduled refresh has finished
+        departments = _campus_departments(campuses)
+        census_rows = _fetch_census(session, _live_query(), departments, [])
+    return _census_response(census_rows, response_format, response)
@@ -0,0 +1,196 @@
+"""
+In-memory census snapshot
+
+The census query (live.sql) takes ~20s to run against EMAP star, so rather
+than run it per request we run it once for every department in wards.ALL on
+a schedule and serve the census routes from the result held in memory.
+
+Between full refreshes only the locations whose visits have changed since the
+last seen star.location_visit watermark are re-derived and merged in.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Iterable
+
+import pandas as pd
+
+from api import wards
+from api.census.wrangle import aggregate_by_department
+from api.wards import CAMPUSES
+from models.census import CensusDepartment, CensusRow
+
+
+@dataclass(frozen=True)
+class _SnapshotState:
+    """Immutable view of the census; swapped in whole on refresh"""
+
+    rows: dict[str, CensusRow] = field(default_factory=dict)
+    by_department: dict[str, tuple[str, ...]] = field(default_factory=dict)
+    by_campus: dict[str, tuple[str, ...]] = field(default_factory=dict)
+    departments: tuple[CensusDepartment, ...] = ()
+    by_location_id: dict[int, str] = field(default_factory=dict)
+    refreshed_at: datetime | None = None
+    watermark: datetime | None = None
+
+
+def _build_state(
+    rows: dict[str, CensusRow], watermark: datetime | None
+) -> _SnapshotState:
+    by_department: dict[str, list[str]] = {}
+    for location_string in sorted(rows):
+        department = rows[location_string].department
+        by_department.setdefault(department, []).append(location_string)
+
+    by_campus = {
+        campus: tuple(
+            sorted(
+                location_string
+                for department in departments
+                for location_string in by_department.get(department, [])
+            )
+        )
+        for campus, departments in CAMPUSES.items()
+    }
+
+    if rows:
+        census_df = pd.DataFrame((row.dict() for row in rows.values()))
+        departments_df = aggregate_by_department(census_df)
+        departments = tuple(
+            CensusDepartment.parse_obj(row)
+            for row in departments_df.to_dict(orient="records")
+        )
+    else:
+        departments = ()
+
+    return _SnapshotState(
+        rows=rows,
+        by_department={k: tuple(v) for k, v in by_department.items()},
+        by_campus=by_campus,
+        departments=departments,
+        by_location_id={row.location_id: loc for loc, row in rows.items()},
+        refreshed_at=datetime.now(timezone.utc),
+        watermark=watermark,
+    )
+
+
+class CensusSnapshot:
+    """
+    Census rows for all of wards.ALL indexed by department, location_string
+    and campus
+
+    Readers always see a complete snapshot: a refresh builds a new state
+    and then replaces the old one in a single assignment. Writers are
+    serialised, and each full refresh (update) bumps the generation. An
+    incremental refresh passes merge the generation it started from, and
+    the merge is dropped if a full refresh has replaced the state since
+    then, because its rows may be older than that refresh's.
+    """
+
+    def __init__(self) -> None:
+        self._state = _SnapshotState()
+        self._write_lock = Lock()
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        """Number of full refreshes so far"""
+        return self._generation
+
+    @property
+    def refreshed_at(self) -> datetime | None:
+        return self._state.refreshed_at
+
+    @property
+    def watermark(self) -> datetime | None:
+        return self._state.watermark
+
+    @property
+    def is_ready(self) -> bool:
+        return self._state.refreshed_at is not None
+
+    def age_seconds(self) -> float | None:
+        refreshed_at = self._state.refreshed_at
+        if refreshed_at is None:
+            return None
+        return (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+
+    def row_count(self) -> int:
+        return len(self._state.rows)
+
+    def update(
+        self, census_rows: Iterable[CensusRow], watermark: datetime | None = None
+    ) -> None:
+        """Replace the snapshot with a fresh set of census rows"""
+        rows = {row.location_string: row for row in census_rows}
+        with self._write_lock:
+            self._state = _build_state(rows, watermark)
+            self._generation += 1
+
+    def merge(
+        self,
+        census_rows: Iterable[CensusRow],
+        watermark: datetime | None,
+        generation: int | None = None,
+    ) -> bool:
+        """
+        Replace the rows for just these locations, leaving the rest of the
+        census as it was, and move the watermark forward
+
+        The rows are dropped (and False returned) if a full refresh has run
+        since generation.
+        """
+        with self._write_lock:
+            if generation is not None and generation != self._generation:
+                return False
+            state = self._state
+            rows = dict(state.rows)
+            rows.update((row.location_string, row) for row in census_rows)
+            if state.watermark is not None and (
+                watermark is None or watermark < state.watermark
+            ):
+                watermark = state.watermark
+            self._state = _build_state(rows, watermark)
+        return True
+
+    def location_strings(self, location_ids: Iterable[int]) -> list[str]:
+        """Location strings held in the snapshot for these location_ids"""
+        by_location_id = self._state.by_location_id
+        return [by_location_id[i] for i in location_ids if i in by_location_id]
+
+    def covers(self, departments: list[str], locations: list[str]) -> bool:
+        """True if the snapshot can answer for these departments/locations"""
+        state = self._state
+        return (
+            state.refreshed_at is not None
+            and all(d in wards.ALL for d in departments)
+            and all(loc in state.rows for loc in locations)
+        )
+
+    def select(self, departments: list[str], locations: list[str]) -> list[CensusRow]:
+        """
+        Rows for the union of the departments and locations ordered by
+        location_string (as per live.sql)
+        """
+        state = self._state
+        location_strings = set(locations) & state.rows.keys()
+        for department in departments:
+            location_strings.update(state.by_department.get(department, ()))
+        return [state.rows[loc] for loc in sorted(location_strings)]
+
+    def select_campuses(self, campuses: list[str]) -> list[CensusRow]:
+        state = self._state
+        location_strings: set[str] = set()
+        for campus in campuses:
+            location_strings.update(state.by_campus.get(campus, ()))
+        return [state.rows[loc] for loc in sorted(location_strings)]
+
+    def departments(self) -> list[CensusDepartment]:
+        return list(self._state.departments)
+
+
+_census_snapshot = CensusSnapshot()
+
+
+def get_census_snapshot() -> CensusSnapshot:
+    return _census_snapshot
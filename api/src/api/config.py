@@ -24,6 +24,32 @@ class Settings(BaseSettings):
     echo_sql: bool = False
 
     icu_admission_predictions: bool = False
+    # How often to re-run the PERRT ICU admission prediction pipeline
+    perrt_predictions_refresh_seconds: int = 1800
+
+    # How often to re-run the full census query behind the /census routes and,
+    # in between, to merge in locations whose visits have changed
+    census_refresh_seconds: int = 1800
+    census_incremental_refresh_seconds: int = 60
+
+    # Caboodle/Clarity queries behind /electives/ run at once (1 to run them
+    # one after another)
+    electives_query_workers: int = 8
+    # Surgery dates held in the table behind /electives/by_date/ (today and
+    # this many days after; the electives page offers the same range), how
+    # often they are all rebuilt and how often today's cases are
+    electives_days_ahead: int = 10
+    electives_refresh_seconds: int = 6 * 3600
+    electives_today_refresh_seconds: int = 900
+
+    # How often to re-download the baserow tables held in the mirror
+    baserow_mirror_refresh_seconds: int = 600
+    # How far back the mirror holds discharge statuses; longer look backs are
+    # queried from baserow directly
+    baserow_mirror_recent_hours: int = 72
+    # Shared secret baserow sends with its webhooks (the webhook route is
+    # disabled if unset)
+    baserow_webhook_secret: SecretStr | None = None
 
     slack_log_webhook: SecretStr
 
@@ -1,4 +1,7 @@
-from typing import Iterable
+from datetime import date, datetime, time
+from enum import Enum
+from types import UnionType
+from typing import Any, Callable, Iterable, Union, get_args, get_origin
 
 import pandas as pd
 from pydantic import BaseModel
@@ -15,3 +18,124 @@ def to_data_frame(
 def parse_to_data_frame(rows: list[dict], model_type: type[BaseModel]) -> pd.DataFrame:
     model_rows = (model_type.parse_obj(row) for row in rows)
     return to_data_frame(model_rows, model_type)
+
+
+# the strings pydantic accepts for a bool
+_BOOL_STRINGS = {
+    **dict.fromkeys(["0", "off", "f", "false", "n", "no"], False),
+    **dict.fromkeys(["1", "on", "t", "true", "y", "yes"], True),
+}
+
+
+def _to_bool(values: pd.Series) -> pd.Series:
+    if values.dtype == object:
+        values = values.astype(str).str.lower().map(_BOOL_STRINGS)
+        if values.isna().any():
+            raise ValueError(f"{values.name}: values that are not bools")
+    return values.astype(bool)
+
+
+def _to_number_or_value(values: pd.Series, type_: type) -> pd.Series:
+    """e.g. for float | str: numbers where they parse, otherwise as they are"""
+    numbers = pd.to_numeric(values, errors="coerce").astype(type_)
+    return numbers.astype(object).where(numbers.notna(), values)
+
+
+_COERCE: dict[Any, Callable[[pd.Series], pd.Series]] = {
+    bool: _to_bool,
+    int: lambda values: pd.to_numeric(values).astype("int64"),
+    float: lambda values: pd.to_numeric(values).astype("float64"),
+    str: lambda values: values.astype(str),
+    datetime: pd.to_datetime,
+    date: lambda values: pd.to_datetime(values).dt.date,
+    time: lambda values: pd.to_datetime(values.astype(str)).dt.time,
+}
+
+
+def _coerce(values: pd.Series, type_: Any) -> pd.Series:
+    """Non-null values coerced to type_ as the model would coerce each one"""
+    if get_origin(type_) in (Union, UnionType):
+        first = get_args(type_)[0]
+        if first in (int, float):
+            return _to_number_or_value(values, first)
+        return values
+    coerce = _COERCE.get(type_)
+    return coerce(values) if coerce is not None else values
+
+
+def to_typed_data_frame(df: pd.DataFrame, model_type: type[BaseModel]) -> pd.DataFrame:
+    """
+    The model's fields from df (e.g. straight from pd.read_sql, with columns
+    named by field or alias) coerced a column at a time rather than by
+    building a model per row. The result matches to_data_frame of the parsed
+    rows: nulls are NaN/NaT in numeric and datetime columns, otherwise None.
+
+    Raises ValueError if a field that is not Optional has missing or null
+    values.
+    """
+    columns: dict[str, pd.Series] = {}
+    not_nullable = []
+    for name, field in model_type.__fields__.items():
+        column = field.alias if field.alias in df.columns else name
+        if column in df.columns:
+            values = df[column]
+        else:
+            values = pd.Series([None] * len(df), index=df.index, dtype=object)
+
+        present = values.notna()
+        if not field.allow_none and not present.all():
+            not_nullable.append(name)
+        elif present.all():
+            columns[name] = _coerce(values, field.type_)
+        elif not present.any():
+            columns[name] = pd.Series([None] * len(df), index=df.index, dtype=object)
+        elif field.type_ in (int, float, datetime):
+            columns[name] = _coerce(values[present], field.type_).reindex(df.index)
+        else:
+            coerced = _coerce(values[present], field.type_).astype(object)
+            columns[name] = coerced.reindex(df.index).where(present, None)
+
+    if not_nullable:
+        raise ValueError(
+            f"{model_type.__name__}: missing or null values for {not_nullable}"
+        )
+    return pd.DataFrame(columns, index=df.index, columns=list(model_type.__fields__))
+
+
+class ResponseFormat(str, Enum):
+    """
+    records: a list of rows (the default)
+    columns: a dict of field name -> list of values, in row order
+    """
+
+    records = "records"
+    columns = "columns"
+
+
+def to_columns(
+    rows: Iterable[BaseModel], model_type: type[BaseModel]
+) -> dict[str, list]:
+    """Column oriented copy of rows that have already been parsed"""
+    rows = list(rows)
+    return {
+        name: [getattr(row, name) for row in rows] for name in model_type.__fields__
+    }
+
+
+def parse_to_columns(rows: list[dict], model_type: type[BaseModel]) -> dict[str, list]:
+    """
+    Column oriented copy of raw rows, coerced a column at a time by
+    to_typed_data_frame rather than by building a model per row, with None
+    for nulls
+    """
+    df = to_typed_data_frame(pd.DataFrame.from_records(rows), model_type)
+    columns: dict[str, list] = {}
+    for name, field in model_type.__fields__.items():
+        values = df[name]
+        if field.type_ is int:
+            # NaN made the column float where there were nulls
+            values = values.astype("Int64")
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.Series(values.dt.to_pydatetime(), df.index, dtype=object)
+        columns[name] = values.astype(object).where(values.notna(), None).tolist()
+    return columns
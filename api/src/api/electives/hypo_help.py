@@ -9,7 +9,6 @@ This aims to solve the issue that otherwise changes in individual functions
 would need to be transferred manually between two github repos.
 
 """
-from typing import Any
 import numpy as np
 import pandas as pd
 
@@ -221,8 +220,10 @@ def model_preassess(df: pd.DataFrame) -> pd.DataFrame:
     note_nums["a_line"] = note_nums["a_line"].astype(bool).astype(int)
     note_nums["c_line"] = note_nums["a_line"].astype(bool).astype(int)
 
-    note_nums = note_nums[
-        [
+    # categories without a numeric value (e.g. none recorded) are dropped by the
+    # sum, but would have summed to 0
+    note_nums = note_nums.reindex(
+        columns=[
             "patient_durable_key",
             "creation_instant",
             "author_type",
@@ -242,8 +243,9 @@ def model_preassess(df: pd.DataFrame) -> pd.DataFrame:
             "a_line",
             "c_line",
             "expected_stay",
-        ]
-    ]
+        ],
+        fill_value=0,
+    )
 
     note_strings = (
         df.groupby(["patient_durable_key", "creation_instant", "author_type"])
@@ -305,47 +307,60 @@ def wrangle_labs(labs: pd.DataFrame) -> pd.DataFrame:
         "crp": "C-reactive protein",
     }
 
-    op_dict = {
-        "mean": "_mean_value",
-        "min": "_min_value",
-        "max": "_max_value",
-        "count": "_measured_count",
-    }
-
-    df = labs.copy()
-
-    df.loc[:, "value"] = pd.to_numeric(
-        df["value"].str.replace("<|(result checked)", "", regex=True),
-        errors="coerce",
-    ).dropna()
-    df["name"] = df["name"].replace({v: k for k, v in lab_names.items()})
-    df = df.join(df.pivot(columns="name", values="value"))
-
-    for key in lab_names:
-        df[key + "_abnormal_count"] = df[key].groupby(
-            df["patient_durable_key"]
-        ).transform(lambda x: x > labs_limits[key][1]) | df[key].groupby(
-            df["patient_durable_key"]
-        ).transform(
-            lambda x: x < labs_limits[key][0]
-        )
-
-        for op in op_dict:
-            df[key + op_dict[op]] = (
-                df[key].groupby(df["patient_durable_key"]).transform(op)
-            )
-    gdf = df.groupby("patient_durable_key").sum(numeric_only=True)
-    gdf = gdf.loc[:, gdf.columns.str.contains("_abnormal")]
+    stats = ["mean_value", "min_value", "max_value", "measured_count"]
 
-    hdf = df.groupby("patient_durable_key").mean(numeric_only=True)
-    hdf = hdf.loc[:, hdf.columns.str.contains("_m")]
+    lab = labs["name"].map({v: k for k, v in lab_names.items()})
+    df = pd.DataFrame(
+        {
+            "patient_durable_key": labs["patient_durable_key"],
+            "lab": lab,
+            "value": pd.to_numeric(
+                labs["value"].str.replace("<|(result checked)", "", regex=True),
+                errors="coerce",
+            ),
+            "result_instant": labs["result_instant"],
+        }
+    )
+    low, high = (
+        lab.map({k: limits[i] for k, limits in labs_limits.items()}) for i in (0, 1)
+    )
+    df["abnormal_count"] = (df["value"] < low) | (df["value"] > high)
 
-    idf = df.sort_values("result_instant").groupby("patient_durable_key").last()
-    idf = idf.loc[:, list(lab_names.keys())]
+    # one grouped pass for every lab at once, then a column per lab and stat
+    grouped = df.dropna(subset=["lab"]).groupby(["patient_durable_key", "lab"])
+    wide = grouped.agg(
+        abnormal_count=("abnormal_count", "sum"),
+        mean_value=("value", "mean"),
+        min_value=("value", "min"),
+        max_value=("value", "max"),
+        measured_count=("value", "count"),
+    )
+    wide["last_value"] = (
+        df.dropna(subset=["lab", "value"])
+        .sort_values("result_instant", kind="stable")
+        .groupby(["patient_durable_key", "lab"])["value"]
+        .last()
+    )
+    wide = wide.unstack("lab")
+    wide.columns = [f"{key}_{stat}" for stat, key in wide.columns]
 
-    final_df = gdf.join(hdf).join(idf.add_suffix("_last_value")).reset_index()
+    # every patient, with or without these labs, as grouping the whole table did
+    patients = pd.Index(
+        np.sort(labs["patient_durable_key"].unique()), name="patient_durable_key"
+    )
+    abnormal_columns = [key + "_abnormal_count" for key in lab_names]
+    columns = (
+        abnormal_columns
+        + [f"{key}_{stat}" for key in lab_names for stat in stats]
+        + [key + "_last_value" for key in lab_names]
+    )
+    final_df = wide.reindex(index=patients, columns=columns)
+    measured_columns = [key + "_measured_count" for key in lab_names]
+    final_df[measured_columns] = final_df[measured_columns].fillna(0)
+    final_df = final_df.astype("float64")
+    final_df[abnormal_columns] = final_df[abnormal_columns].fillna(0).astype("int64")
 
-    return final_df
+    return final_df.reset_index()
 
 
 def simple_sum(df: pd.DataFrame) -> pd.DataFrame:
@@ -383,6 +398,27 @@ def simple_sum(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+_PERCENT = re.compile(r"(\d*)%")
+_NUMBER = re.compile(r"(\d*\.?\d+)")
+
+
+def _first_percent(comments: pd.Series) -> pd.Series:
+    """The number before the first % in each comment (NaN if there is none)"""
+    percent = comments.str.extract(_PERCENT, expand=False)
+    return pd.to_numeric(percent.replace("", np.nan), errors="coerce")
+
+
+def _first_pasp(comments: pd.Series) -> pd.Series:
+    """
+    The first number in (8, 80) in each comment that mentions PASP or systolic
+    pressure (NaN if there is none)
+    """
+    mentions = comments.str.contains("PASP|systolic pressure", na=False)
+    numbers = comments[mentions].str.extractall(_NUMBER)[0].astype(float)
+    first = numbers[(numbers > 8) & (numbers < 80)].groupby(level=0).first()
+    return first.reindex(comments.index)
+
+
 def j_wrangle_echo(df: pd.DataFrame) -> pd.DataFrame:
     df["finding"] = df["finding_type"] + " " + df["finding_name"]
 
@@ -425,91 +461,27 @@ def j_wrangle_echo(df: pd.DataFrame) -> pd.DataFrame:
     df_string = df[df["finding"].isin(findings_string)]
     df_cat = df[df["finding"].isin(findings_categorical)]
 
-    # extract EF values from LV comments strings
-    df_string.loc[:, "lv_string_value"] = df_string.loc[
-        df_string["finding"] == "Left Ventricle Comment", "string_value"
-    ].apply(lambda x: re.findall(r"\d*[%]", x))
-    df_string.loc[:, "lv_string_value"] = df_string.loc[:, "lv_string_value"].apply(
-        lambda d: d if isinstance(d, list) else []
-    )
-    df_string.loc[:, "lv_string_value"] = df_string.loc[:, "lv_string_value"].str[0]
-    df_string.loc[
-        ~df_string["lv_string_value"].isna(), "lv_string_value"
-    ] = df_string.loc[~df_string["lv_string_value"].isna(), "lv_string_value"].apply(
-        lambda x: x.replace("%", "")
-    )
-    df_string.loc[:, "lv_string_value"] = (
-        df_string.loc[:, "lv_string_value"]
-        .replace(r"^\s*$", np.nan, regex=True)
-        .apply(float)
-    )
-    df_string.loc[
-        ~df_string["lv_string_value"].isna(), "lv_string_value"
-    ] = df_string.loc[~df_string["lv_string_value"].isna(), "lv_string_value"].apply(
-        lambda x: float(x)
+    df_string = df_string.copy()
+    string_value = df_string["string_value"]
+
+    # extract EF values from LV comments strings (the first number before a %)
+    df_string["lv_string_value"] = _first_percent(
+        string_value.where(df_string["finding"] == "Left Ventricle Comment")
     )
 
     # extract EF values from LVEF comments strings
-    df_string.loc[:, "lv_string_value_2"] = df_string.loc[
-        df_string["finding"] == "Left Ventricle ejection fraction comments",
-        "string_value",
-    ].apply(lambda x: re.findall(r"\d*[%]", x))
-    df_string.loc[:, "lv_string_value_2"] = df_string.loc[:, "lv_string_value_2"].apply(
-        lambda d: d if isinstance(d, list) else []
-    )
-    df_string.loc[:, "lv_string_value_2"] = df_string.loc[:, "lv_string_value_2"].str[0]
-    df_string.loc[
-        ~df_string["lv_string_value_2"].isna(), "lv_string_value_2"
-    ] = df_string.loc[
-        ~df_string["lv_string_value_2"].isna(), "lv_string_value_2"
-    ].apply(
-        lambda x: x.replace("%", "")
-    )
-    df_string.loc[:, "lv_string_value_2"] = (
-        df_string.loc[:, "lv_string_value_2"]
-        .replace(r"^\s*$", np.nan, regex=True)
-        .apply(float)
-    )
-    df_string.loc[
-        ~df_string["lv_string_value_2"].isna(), "lv_string_value_2"
-    ] = df_string.loc[
-        ~df_string["lv_string_value_2"].isna(), "lv_string_value_2"
-    ].apply(
-        lambda x: float(x)
+    df_string["lv_string_value_2"] = _first_percent(
+        string_value.where(
+            df_string["finding"] == "Left Ventricle ejection fraction comments"
+        )
     )
 
     # Extract PASP strings from PH comments
-    df_string.loc[:, "contains PASP value"] = df_string.loc[
-        df_string["finding"] == "Pulmonary Hypertension pulmonary hypertension",
-        "string_value",
-    ].apply(lambda x: np.where(("PASP" in x) | ("systolic pressure" in x), 1, 0))
-    df_string.loc[:, "PH_string_value"] = df_string.loc[
-        (
-            (df_string["finding"] == "Pulmonary Hypertension pulmonary hypertension")
-            & (df_string["contains PASP value"] == 1)
-        ),
-        "string_value",
-    ].apply(lambda x: re.findall(r"\d*\.?\d+", x))
-    df_string.loc[:, "PH_string_value"] = df_string.loc[
-        (
-            (df_string["finding"] == "Pulmonary Hypertension pulmonary hypertension")
-            & (df_string["contains PASP value"] == 1)
-        ),
-        "PH_string_value",
-    ].apply(lambda x: [float(i) for i in x])
-
-    def get_first_above_8(list_of_nos: list[float]) -> float:
-        item = next((x for x in list_of_nos if ((x > 8) & (x < 80))), np.nan)
-        return item
-
-    df_string.loc[:, "PH_string_value"] = df_string.loc[
-        (
-            (df_string["finding"] == "Pulmonary Hypertension pulmonary hypertension")
-            & (df_string["contains PASP value"] == 1)
-        ),
-        "PH_string_value",
-    ].apply(lambda x: get_first_above_8(x))
-    df_string = df_string.drop(columns=["contains PASP value"])
+    df_string["PH_string_value"] = _first_pasp(
+        string_value.where(
+            df_string["finding"] == "Pulmonary Hypertension pulmonary hypertension"
+        )
+    )
 
     # convert selected PH comment strings to binary vars
     df_string["pulm_HTN_string_bin"] = np.where(
@@ -903,9 +875,11 @@ def j_wrangle_obs(caboodle_obs: pd.DataFrame) -> pd.DataFrame:
     text_obs = text_obs[text_obs["value"] != ""]
 
     # Process text obs
-    text_obs[["SYS_BP", "DIAS_BP"]] = text_obs[text_obs.loc[:, "display_name"] == "BP"][
-        "value"
-    ].str.split("/", 1, expand=True)
+    text_obs[["SYS_BP", "DIAS_BP"]] = (
+        text_obs[text_obs.loc[:, "display_name"] == "BP"]["value"]
+        .str.split("/", n=1, expand=True)
+        .reindex(columns=[0, 1])
+    )
 
     text_obs.loc[:, "SYS_BP"].fillna(value=np.nan, inplace=True)
     text_obs.loc[:, "DIAS_BP"].fillna(value=np.nan, inplace=True)
@@ -1003,7 +977,7 @@ def j_wrangle_obs(caboodle_obs: pd.DataFrame) -> pd.DataFrame:
         ],
         values="numeric_value",
         columns="obs_code",
-    )
+    ).reindex(columns=list(values_obs_codes))
 
     numerical_obs.reset_index(inplace=True)
     numerical_obs.columns.name = None
@@ -1111,6 +1085,72 @@ def j_wrangle_obs(caboodle_obs: pd.DataFrame) -> pd.DataFrame:
     return obs
 
 
+def visit_sequence(
+    visits: pd.DataFrame,
+    by: list[str],
+    order: list[str],
+    shifts: dict[str, tuple[str, int]],
+) -> pd.DataFrame:
+    """
+    visits sorted by order (keeping the existing order of ties) with a column
+    for each of shifts, name: (column, periods), holding the value of column
+    from the visit periods before in the same group of by (or after, for
+    negative periods).
+
+    e.g. shifts={"prev_ward": ("name", 1), "next_ward": ("name", -1)}
+
+    This is one sort and a grouped shift per column rather than a
+    groupby.apply(assign) (and so a data frame per group) for each.
+    """
+    visits = visits.sort_values(order, kind="stable")
+    grouped = visits.groupby(by, sort=False)
+    for name, (column, periods) in shifts.items():
+        visits[name] = grouped[column].shift(periods)
+    return visits
+
+
+def merge_split_visits(visits: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    """
+    visits (in admission_time order) with the columns (*_group, min_adm_*,
+    max_disch_*, lv_id_longest_adm) describing the one visit that each group
+    of by is merged into: the earliest admission, the latest discharge, the
+    location_visit_id of the longest visit and the wards before the first
+    and after the last.
+
+    Grouped transforms rather than a groupby.apply(assign) for each column.
+    """
+    # still in admission_time order, so first/last are the earliest/latest
+    visits = visits.copy()
+    merging = visits.groupby(by, sort=False)
+
+    visits["min_adm_dt64"] = merging["adm_datetime_dt64"].transform("min")
+    visits["min_adm_time"] = visits["min_adm_dt64"].astype(str)
+
+    # get latest admission time for group
+    visits["max_disch_dt64"] = merging["disch_datetime_dt64"].transform("max")
+    visits["max_disch_time"] = visits["max_disch_dt64"].astype(str)
+
+    # get lv_id corresponding to longest admission
+    longest = merging["duration_hours"].transform("idxmax")
+    visits["longest_adm"] = (longest == visits.index).astype(int)
+    visits["lv_id_longest_adm"] = visits.loc[longest, "location_visit_id"].to_numpy()
+
+    # get prev and next admissions for groups
+    # recreate same columns from original df
+    group_columns = {
+        "prev_ward_group": ("prev_ward", "first"),
+        "next_ward_group": ("next_ward", "last"),
+        "next_ward_duration_group": ("ward_after_theatre_duration_hours", "last"),
+        "prev_ward_2_group": ("prev_ward2", "first"),
+        "ICU_PACU_prev_ward_group": ("ICU_PACU_prev_ward", "first"),
+        "ICU_PACU_next_ward_group": ("ICU_PACU_next_ward", "last"),
+        "icu_pacu_duration_hours_group": ("icu_pacu_duration_hours", "last"),
+    }
+    for name, (column, how) in group_columns.items():
+        visits[name] = merging[column].transform(how)
+    return visits
+
+
 def generate_icu_binary_from_emap(
     data: pd.DataFrame,  # consider adding more locations here if appropriate.
     old: bool = False,
@@ -1203,46 +1243,18 @@ def generate_icu_binary_from_emap(
     # prev_and_next_wards
     print("prev_and_next_wards")
 
-    if old:
-        data = (
-            data.sort_values("admission_time")
-            .groupby("hospital_visit_id")
-            .apply(lambda x: x.assign(prev_ward=lambda x: x["name"].shift(1)))
-        )
-        data = (
-            data.sort_values("admission_time")
-            .groupby("hospital_visit_id")
-            .apply(lambda x: x.assign(next_ward=lambda x: x["name"].shift(-1)))
-        )
-        data = (
-            data.sort_values("admission_time")
-            .groupby("hospital_visit_id")
-            .apply(lambda x: x.assign(prev_ward2=lambda x: x["name"].shift(2)))
-        )
-        data = (
-            data.sort_values("admission_time")
-            .groupby("hospital_visit_id")
-            .apply(
-                lambda x: x.assign(
-                    ward_after_theatre_duration_hours=lambda x: np.where(
-                        x["main_theatre"] == "Yes",
-                        x["duration_hours"].shift(-1),
-                        pd.NaT,
-                    )
-                )
-            )
-        )
-    else:
-        data = data.sort_values(["admission_time", "discharge_time"])
-        data["prev_ward"] = data.groupby(["hospital_visit_id"])["name"].shift(1)
-        data["next_ward"] = data.groupby(["hospital_visit_id"])["name"].shift(-1)
-        data["prev_ward2"] = data.groupby(["hospital_visit_id"])["name"].shift(2)
-        data["ward_after_theatre_duration_hours"] = data.groupby("hospital_visit_id")[
-            "duration_hours"
-        ].shift(-1)
-        data.loc[
-            data["main_theatre"] == "No", "ward_after_theatre_duration_hours"
-        ] = pd.NaT
+    data = visit_sequence(
+        data,
+        by=["hospital_visit_id"],
+        order=["admission_time"] if old else ["admission_time", "discharge_time"],
+        shifts={
+            "prev_ward": ("name", 1),
+            "next_ward": ("name", -1),
+            "prev_ward2": ("name", 2),
+            "ward_after_theatre_duration_hours": ("duration_hours", -1),
+        },
+    )
+    data.loc[data["main_theatre"] == "No", "ward_after_theatre_duration_hours"] = pd.NaT
 
     # filter out patients for whom there is no discharge time
 
@@ -1314,7 +1326,7 @@ def generate_icu_binary_from_emap(
         )
 
     if old:
-        lambda x: x.assign(
+        data = data.assign(
             icu_pacu_duration_hours=lambda x: np.where(
                 np.logical_and(
                     x["main_theatre"] == "Yes",
@@ -1349,42 +1361,17 @@ def generate_icu_binary_from_emap(
         ~data["hospital_visit_id"].isin(duplicates["hospital_visit_id"])
     ]
 
-    dupes = data[data["hospital_visit_id"].isin(duplicates["hospital_visit_id"])]
-
-    dupes = (
-        dupes.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(prev_adm_time=lambda x: x["adm_datetime_dt64"].shift(1))
-        )
-    )
-
-    dupes = (
-        dupes.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(
-                prev_disch_time=lambda x: x["disch_datetime_dt64"].shift(1)
-            )
-        )
-    )
-
-    dupes = (
-        dupes.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(next_adm_time=lambda x: x["adm_datetime_dt64"].shift(-1))
-        )
-    )
-
-    dupes = (
-        dupes.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(
-                next_disch_time=lambda x: x["disch_datetime_dt64"].shift(-1)
-            )
-        )
+    visit_groups = ["hospital_visit_id", "adm_date", "location_id"]
+    dupes = visit_sequence(
+        data[data["hospital_visit_id"].isin(duplicates["hospital_visit_id"])],
+        by=visit_groups,
+        order=["admission_time"],
+        shifts={
+            "prev_adm_time": ("adm_datetime_dt64", 1),
+            "prev_disch_time": ("disch_datetime_dt64", 1),
+            "next_adm_time": ("adm_datetime_dt64", -1),
+            "next_disch_time": ("disch_datetime_dt64", -1),
+        },
     )
 
     dupes["since_prev_discharge"] = (
@@ -1402,100 +1389,7 @@ def generate_icu_binary_from_emap(
     )
 
     dupes_not_merged = dupes[dupes["to_merge"] == 0]
-    dupes_to_merge = dupes[dupes["to_merge"] == 1]
-
-    dupes_to_merge = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(lambda x: x.assign(min_adm_dt64=lambda x: x["adm_datetime_dt64"].min()))
-    )
-
-    dupes_to_merge["min_adm_time"] = dupes_to_merge["min_adm_dt64"].astype(str)
-
-    # get latest admission time for group
-    dupes_to_merge = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(max_disch_dt64=lambda x: x["disch_datetime_dt64"].max())
-        )
-    )
-
-    dupes_to_merge["max_disch_time"] = dupes_to_merge["max_disch_dt64"].astype(str)
-
-    # get lv_id corresponding to longest admission
-    dupes_to_merge["longest_adm"] = dupes_to_merge.index.isin(
-        dupes_to_merge.groupby(["hospital_visit_id", "adm_date", "location_id"])[
-            "duration_hours"
-        ].idxmax()
-    ).astype(int)
-
-    dupes_to_merge = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])
-        .apply(
-            lambda x: x.assign(
-                lv_id_longest_adm=lambda x: x.loc[
-                    x["longest_adm"] == 1, ["location_visit_id"]
-                ]
-            )
-        )
-    )
-
-    dupes_to_merge["lv_id_longest_adm"] = dupes_to_merge["lv_id_longest_adm"].fillna(
-        dupes_to_merge.groupby(["hospital_visit_id", "adm_date", "location_id"])[
-            "lv_id_longest_adm"
-        ].transform("max")
-    )
-
-    # get prev and next admissions for groups
-    # recreate same columns from original df
-
-    dupes_to_merge["prev_ward_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])["prev_ward"]
-        .transform("first")
-    )
-
-    dupes_to_merge["next_ward_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])["next_ward"]
-        .transform("last")
-    )
-
-    dupes_to_merge["next_ward_duration_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])[
-            "ward_after_theatre_duration_hours"
-        ]
-        .transform("last")
-    )
-
-    dupes_to_merge["prev_ward_2_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])["prev_ward2"]
-        .transform("first")
-    )
-
-    dupes_to_merge["ICU_PACU_prev_ward_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])["ICU_PACU_prev_ward"]
-        .transform("first")
-    )
-
-    dupes_to_merge["ICU_PACU_next_ward_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])["ICU_PACU_next_ward"]
-        .transform("last")
-    )
-
-    dupes_to_merge["icu_pacu_duration_hours_group"] = (
-        dupes_to_merge.sort_values("admission_time")
-        .groupby(["hospital_visit_id", "adm_date", "location_id"])[
-            "icu_pacu_duration_hours"
-        ]
-        .transform("last")
-    )
+    dupes_to_merge = merge_split_visits(dupes[dupes["to_merge"] == 1], visit_groups)
 
     # ICU_PACU_next_ward
     # icu_pacu_duration_hours
@@ -1730,40 +1624,57 @@ def wrangle_pas(df: pd.DataFrame) -> pd.DataFrame:
     )
 
 
-def wrangle_hx(hx: pd.DataFrame) -> pd.DataFrame:
-    icd_codes = (
-        ("A00", "B99", "I"),
-        ("C00", "D48", "II"),
-        ("D50", "D89", "III"),
-        ("E00", "E90", "IV"),
-        ("F00", "F99", "V"),
-        ("G00", "G99", "VI"),
-        ("H00", "H59", "VII"),
-        ("H60", "H95", "VIII"),
-        ("I00", "I99", "IX"),
-        ("J00", "J99", "X"),
-        ("K00", "K93", "XI"),
-        ("L00", "L99", "XII"),
-        ("M00", "M99", "XIII"),
-        ("N00", "N99", "XIV"),
-        ("O00", "O99", "XV"),
-        ("P00", "P96", "XVI"),
-        ("Q00", "Q99", "XVII"),
-        ("R00", "R99", "XVIII"),
-        ("S00", "T98", "XIX"),
-        ("U00", "U99", "XX"),
-        ("V01", "Y98", "XXI"),
-        ("Z00", "Z99", "XXII"),
-    )
+# ICD-10 chapters by the first three characters of the code: (first, last, chapter)
+_ICD_CHAPTERS = (
+    ("A00", "B99", "I"),
+    ("C00", "D48", "II"),
+    ("D50", "D89", "III"),
+    ("E00", "E90", "IV"),
+    ("F00", "F99", "V"),
+    ("G00", "G99", "VI"),
+    ("H00", "H59", "VII"),
+    ("H60", "H95", "VIII"),
+    ("I00", "I99", "IX"),
+    ("J00", "J99", "X"),
+    ("K00", "K93", "XI"),
+    ("L00", "L99", "XII"),
+    ("M00", "M99", "XIII"),
+    ("N00", "N99", "XIV"),
+    ("O00", "O99", "XV"),
+    ("P00", "P96", "XVI"),
+    ("Q00", "Q99", "XVII"),
+    ("R00", "R99", "XVIII"),
+    ("S00", "T98", "XIX"),
+    ("U00", "U99", "XX"),
+    ("V01", "Y98", "XXI"),
+    ("Z00", "Z99", "XXII"),
+)
+_ICD_FIRST = np.array([first for first, _, _ in _ICD_CHAPTERS])
+_ICD_LAST = np.array([last for _, last, _ in _ICD_CHAPTERS])
+_ICD_CHAPTER = np.array([chapter for _, _, chapter in _ICD_CHAPTERS], dtype=object)
+
+
+def icd_chapter(codes: pd.Series) -> pd.Series:
+    """
+    The chapter of each ICD-10 code, None if it is outside them all. The
+    chapters are in order without overlaps so the only candidate is the last
+    starting at or before the code.
+    """
+    prefixes = codes.str.slice(0, 3)
+    known = prefixes.notna().to_numpy()
+    values = prefixes[known].to_numpy(dtype=str)
+
+    candidate = np.searchsorted(_ICD_FIRST, values, side="right") - 1
+    in_chapter = (candidate >= 0) & (values <= _ICD_LAST[candidate])
 
-    def _get_class(code: str, icd_codes: dict) -> Any:
-        for icd in icd_codes:
-            if code >= icd[0] and code <= icd[1]:
-                return icd[2]
-        return None
+    chapters = np.full(len(codes), None, dtype=object)
+    chapters[np.flatnonzero(known)[in_chapter]] = _ICD_CHAPTER[candidate[in_chapter]]
+    return pd.Series(chapters, index=codes.index)
 
+
+def wrangle_hx(hx: pd.DataFrame) -> pd.DataFrame:
     hx = hx.drop(hx[hx["value"] == "#NC"].index)
-    hx["class"] = hx["value"].str.slice(0, 3).apply(_get_class, icd_codes=icd_codes)
+    hx["class"] = icd_chapter(hx["value"])
 
     one_hot = pd.get_dummies(hx["class"])
     one_hot["patient_durable_key"] = hx["patient_durable_key"]
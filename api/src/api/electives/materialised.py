@@ -0,0 +1,143 @@
+"""
+In-memory electives table
+
+Building the electives list (see router.query_electives) runs nine
+Caboodle/Clarity queries and the wrangling in prepare_draft, so rather than
+do that per request the rows for each surgery date in the window are built
+on a schedule and held here, one partition per date keyed by
+surgical_case_key. Requests for a range of dates are then served from the
+partitions they cover.
+
+A partition is replaced whole when its date is refreshed, so a cancelled or
+moved case drops out of the old date at the next refresh.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from threading import Lock
+from typing import Callable, Iterable
+
+from api.logger import logger
+
+
+def _key_rows(day: date, rows: Iterable[dict]) -> dict[object, dict]:
+    """
+    Rows by surgical_case_key; rows without one are kept, each under its own
+    key, rather than collapsed into one
+    """
+    keyed: dict[object, dict] = {}
+    unkeyed = 0
+    for position, row in enumerate(rows):
+        key = row["surgical_case_key"]
+        if key is None:
+            unkeyed += 1
+            key = ("no surgical_case_key", position)
+        keyed[key] = row
+    if unkeyed:
+        logger.warning(f"{unkeyed} electives on {day} have no surgical_case_key")
+    return keyed
+
+
+@dataclass(frozen=True)
+class _Partition:
+    """The electives rows for one surgery date"""
+
+    # keyed by surgical_case_key (see _key_rows)
+    rows: dict[object, dict] = field(default_factory=dict)
+    refreshed_at: datetime | None = None
+
+
+class ElectivesTable:
+    """
+    Electives rows (as dicts of MergedData fields) partitioned by surgery
+    date
+
+    Readers always see complete partitions: a refresh builds a new mapping of
+    dates to partitions and then replaces the old one in a single assignment.
+    Writers are serialised so that refreshes of different dates do not lose
+    each other's partitions, and each date is rebuilt by one caller at a time
+    (see refresh).
+    """
+
+    def __init__(self) -> None:
+        self._partitions: dict[date, _Partition] = {}
+        self._write_lock = Lock()
+        self._refresh_locks: dict[date, Lock] = {}
+
+    def refreshed_at(self, day: date) -> datetime | None:
+        partition = self._partitions.get(day)
+        return partition.refreshed_at if partition is not None else None
+
+    def dates(self) -> list[date]:
+        return sorted(self._partitions)
+
+    def update(self, day: date, rows: Iterable[dict]) -> None:
+        """Replace the partition for day with these rows"""
+        partition = _Partition(
+            rows=_key_rows(day, rows),
+            refreshed_at=datetime.now(timezone.utc),
+        )
+        with self._write_lock:
+            self._partitions = {**self._partitions, day: partition}
+
+    def refresh(
+        self,
+        day: date,
+        build: Callable[[], Iterable[dict]],
+        only_missing: bool = False,
+    ) -> None:
+        """
+        Replace the partition for day with the rows from build()
+
+        Callers refreshing the same day wait for each other rather than
+        rebuild it at the same time. With only_missing, a caller that finds
+        the partition there (e.g. built while it waited) leaves it as it is.
+        """
+        with self._write_lock:
+            refresh_lock = self._refresh_locks.setdefault(day, Lock())
+        with refresh_lock:
+            if only_missing and day in self._partitions:
+                return
+            self.update(day, build())
+
+    def drop_before(self, day: date) -> None:
+        """Forget the partitions for surgery dates before day"""
+        with self._write_lock:
+            self._partitions = {k: v for k, v in self._partitions.items() if k >= day}
+            self._refresh_locks = {
+                k: v for k, v in self._refresh_locks.items() if k >= day
+            }
+
+    def missing(self, days: Iterable[date]) -> list[date]:
+        """The days that have not been refreshed yet"""
+        partitions = self._partitions
+        return [day for day in days if day not in partitions]
+
+    def select(
+        self, start_date: date, end_date: date, campus: str | None = None
+    ) -> list[dict]:
+        """
+        Rows for surgery dates from start_date to end_date (inclusive) whose
+        department_name contains campus, ordered by surgery date
+
+        As for /electives/, a patient booked more than once in the range is
+        listed once, for their earliest surgery.
+        """
+        partitions = self._partitions
+        rows = []
+        seen: set[int] = set()
+        for day in sorted(k for k in partitions if start_date <= k <= end_date):
+            for row in partitions[day].rows.values():
+                if campus is not None and campus not in (row["department_name"] or ""):
+                    continue
+                if row["patient_durable_key"] in seen:
+                    continue
+                seen.add(row["patient_durable_key"])
+                rows.append(row)
+        return rows
+
+
+_electives_table = ElectivesTable()
+
+
+def get_electives_table() -> ElectivesTable:
+    return _electives_table
@@ -1,16 +1,29 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import cast
 
 import numpy as np
 import pandas as pd
 from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from sqlalchemy import text, create_engine
+from sqlalchemy.engine import Engine
 from sqlmodel import Session
 
-from api.db import get_caboodle_session, get_clarity_session
+from api.config import Settings, get_settings
+from api.convert import to_typed_data_frame
+from api.db import (
+    _caboodle_engine,
+    _clarity_engine,
+    get_caboodle_session,
+    get_clarity_session,
+)
+from api.electives.materialised import ElectivesTable, get_electives_table
 from api.electives.wrangle import prepare_draft  # , prepare_electives
+from api.logger import logger
 from models.electives import (
     CaboodlePreassessment,
     ClarityPostopDestination,
@@ -54,6 +67,44 @@ def _get_mock_sql_rows(table: str, model: type[BaseModel]) -> list[type[BaseMode
         return [model.parse_obj(row) for row in result]
 
 
+def _get_mock_sql_frame(table: str, model: type[BaseModel]) -> pd.DataFrame:
+    engine = create_engine(f"sqlite:///{Path(__file__).parent}/mock.db", future=True)
+
+    with engine.connect() as connection:
+        df = pd.read_sql(text(f"SELECT * FROM {table}"), connection)
+    return to_typed_data_frame(df, model)
+
+
+@lru_cache()
+def _read_sql_file(query_file: str) -> str:
+    return (Path(__file__).parent / query_file).read_text()
+
+
+def _read_query(
+    query_file: str, session: Session, start_date: date, end_date: date
+) -> pd.DataFrame:
+    """
+    reads a text query from a file and runs it for the cases from start_date
+    up to (not including) end_date
+
+    :param query_file:
+    :param session:
+    :param start_date:
+    :param end_date:
+    :return:
+    """
+    query = text(_read_sql_file(query_file))
+
+    return pd.read_sql(
+        query,
+        session.connection(),
+        params={
+            "start_date": start_date.strftime("%Y-%m-%d"),
+            "end_date": end_date.strftime("%Y-%m-%d"),
+        },
+    )
+
+
 def _parse_query(
     query_file: str, session: Session, model: BaseModel, params: dict
 ) -> list[BaseModel]:
@@ -66,19 +117,9 @@ def _parse_query(
     :param model:
     :return:
     """
-    query = text((Path(__file__).parent / query_file).read_text())
-
-    start_date = date.today().strftime("%Y-%m-%d")
-    end_date = (date.today() + timedelta(days=params["days_ahead"])).strftime(
-        "%Y-%m-%d"
-    )
-
-    df = pd.read_sql(
-        query,
-        session.connection(),
-        params={"start_date": start_date, "end_date": end_date},
-    )
-
+    start_date = date.today()
+    end_date = start_date + timedelta(days=params["days_ahead"])
+    df = _read_query(query_file, session, start_date, end_date)
     return [model.parse_obj(row) for row in df.to_dict(orient="records")]
 
 
@@ -224,62 +265,205 @@ def get_mock_medical_hx() -> list[type[MedicalHx]]:
     return _get_mock_sql_rows("new_hx", MedicalHx)
 
 
-@router.get("/axa/", response_model=list[AxaCodes])
-def get_axa_codes() -> list[AxaCodes]:
-    model = AxaCodes
+def _axa_codes_frame() -> pd.DataFrame:
     df = pd.read_csv(
         (Path(__file__).parent / "supp_data/axa_codes.csv")
     )  # , encoding="cp1252")
-    return [model.parse_obj(row) for row in df.to_dict(orient="records")]
+    return to_typed_data_frame(df, AxaCodes)
+
+
+@router.get("/axa/", response_model=list[AxaCodes])
+def get_axa_codes() -> list[AxaCodes]:
+    df = _axa_codes_frame().replace({np.nan: None})
+    return [AxaCodes.parse_obj(row) for row in df.to_dict(orient="records")]
+
+
+# The queries behind get_electives by prepare_draft argument: (sql, model)
+CABOODLE_QUERIES: dict[str, tuple[str, type[BaseModel]]] = {
+    "electives": ("live_sql/get_surg.sql", SurgData),
+    "preassess": ("live_sql/get_preassess.sql", PreassessData),
+    "labs": ("live_sql/get_labs.sql", LabData),
+    "echo": ("live_sql/get_echo_2.sql", EchoWithAbnormalData),
+    "obs": ("live_sql/get_obs.sql", ObsData),
+    "pa_summary": ("live_sql/get_pa_summary.sql", PreassessSummaryData),
+    "medical_hx": ("live_sql/new_hx.sql", MedicalHx),
+}
+CLARITY_QUERIES: dict[str, tuple[str, type[BaseModel]]] = {
+    "pod": ("live_sql/get_pod.sql", ClarityPostopDestination),
+}
+
+
+def _run_query(
+    engine: Engine,
+    query_file: str,
+    model: type[BaseModel],
+    start_date: date,
+    end_date: date,
+) -> pd.DataFrame:
+    """
+    The query's rows as a data frame typed by model, run on a session (and
+    pooled connection) of its own
+    """
+    with Session(engine) as session:
+        df = _read_query(query_file, session, start_date, end_date)
+    return to_typed_data_frame(df, model)
+
+
+def query_electives(
+    caboodle: Engine,
+    clarity: Engine,
+    start_date: date,
+    end_date: date,
+    workers: int,
+) -> pd.DataFrame:
+    """
+    The merged electives (see prepare_draft) from start_date up to (not
+    including) end_date with nulls as None
+
+    The queries are independent so run concurrently (up to workers at once),
+    each on its own connection. Their rows stay in data frames until merged.
+    """
+    queries = {
+        **{name: (caboodle, *query) for name, query in CABOODLE_QUERIES.items()},
+        **{name: (clarity, *query) for name, query in CLARITY_QUERIES.items()},
+    }
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            name: pool.submit(
+                _run_query, engine, query_file, model, start_date, end_date
+            )
+            for name, (engine, query_file, model) in queries.items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    # e.g. a weekend or bank holiday
+    if results["electives"].empty:
+        return pd.DataFrame(columns=list(MergedData.__fields__))
+
+    df = prepare_draft(**results, axa=_axa_codes_frame(), to_predict=False)
+    return df.replace({np.nan: None})
 
 
 @router.get("/", response_model=list[MergedData])
 def get_electives(
-    s_caboodle: Session = Depends(get_caboodle_session),
-    s_clarity: Session = Depends(get_clarity_session),
+    caboodle: Engine = Depends(_caboodle_engine),
+    clarity: Engine = Depends(_clarity_engine),
+    settings: Settings = Depends(get_settings),
     days_ahead: int = 10,
 ) -> list[MergedData]:
-    case = get_caboodle_cases(session=s_caboodle, days_ahead=days_ahead)
-    preassess = get_caboodle_preassess(session=s_caboodle, days_ahead=days_ahead)
-    labs = get_caboodle_labs(session=s_caboodle, days_ahead=days_ahead)
-    echo = get_caboodle_echo(session=s_caboodle, days_ahead=days_ahead)
-    obs = get_caboodle_obs(session=s_caboodle, days_ahead=days_ahead)
-    pa_summary = get_caboodle_pas(session=s_caboodle, days_ahead=days_ahead)
-    hx = get_medical_hx(session=s_caboodle, days_ahead=days_ahead)
-    pod = get_clarity_pod(session=s_clarity, days_ahead=days_ahead)
-    axa = get_axa_codes()
-
-    # pod = _parse_query("live_pod.sql", s_clarity, ClarityPostopDestination, params)
-
-    df = prepare_draft(
-        electives=case,
-        preassess=preassess,
-        labs=labs,
-        echo=echo,
-        obs=obs,
-        axa=axa,
-        pod=pod,
-        to_predict=False,
-        medical_hx=hx,
-        pa_summary=pa_summary,
+    start_date = date.today()
+    df = query_electives(
+        caboodle,
+        clarity,
+        start_date,
+        start_date + timedelta(days=days_ahead),
+        settings.electives_query_workers,
     )
-    df = df.replace({np.nan: None})
     return [MergedData.parse_obj(row) for row in df.to_dict(orient="records")]
 
 
+def _table_rows(rows: list[dict]) -> list[dict]:
+    """
+    Rows validated as MergedData for the electives table, with pandas
+    Timestamps as datetimes so the table can be served as is by orjson
+    """
+    return [
+        {
+            k: v.to_pydatetime() if isinstance(v, pd.Timestamp) else v
+            for k, v in MergedData.parse_obj(row).dict().items()
+        }
+        for row in rows
+    ]
+
+
+def refresh_electives_partition(
+    caboodle: Engine,
+    clarity: Engine,
+    settings: Settings,
+    table: ElectivesTable,
+    day: date,
+    only_missing: bool = False,
+) -> None:
+    """Re-run the electives queries for the cases on day and swap the result
+    into its partition of the table (see ElectivesTable.refresh)"""
+
+    def build() -> list[dict]:
+        df = query_electives(
+            caboodle,
+            clarity,
+            day,
+            day + timedelta(days=1),
+            settings.electives_query_workers,
+        )
+        logger.info(f"Electives for {day} refreshed with {len(df)} cases")
+        return _table_rows(df.to_dict(orient="records"))
+
+    table.refresh(day, build, only_missing)
+
+
+def _electives_window(settings: Settings) -> list[date]:
+    today = date.today()
+    days = range(settings.electives_days_ahead + 1)
+    return [today + timedelta(days=i) for i in days]
+
+
+def refresh_electives_table(
+    caboodle: Engine, clarity: Engine, settings: Settings, table: ElectivesTable
+) -> None:
+    """Refresh every date in the window (today and the electives_days_ahead
+    days after) and forget the dates that have passed"""
+    table.drop_before(date.today())
+    for day in _electives_window(settings):
+        # one failed date should not hold up the rest; it keeps its last rows
+        try:
+            refresh_electives_partition(caboodle, clarity, settings, table, day)
+        except Exception:
+            logger.exception(f"Failed to refresh the electives for {day}")
+
+
+@router.get("/by_date/", response_model=list[MergedData], response_model_by_alias=False)
+def get_electives_by_date(
+    start_date: date | None = None,
+    end_date: date | None = None,
+    campus: str | None = None,
+    caboodle: Engine = Depends(_caboodle_engine),
+    clarity: Engine = Depends(_clarity_engine),
+    settings: Settings = Depends(get_settings),
+    table: ElectivesTable = Depends(get_electives_table),
+) -> ORJSONResponse:
+    """
+    Electives from start_date to end_date (inclusive, defaulting to the whole
+    window) in departments whose name contains campus (e.g. UCH)
+
+    Served from the table kept by refresh_electives_table; dates in the
+    window that it has not reached yet are refreshed first (once, however
+    many requests are waiting for them) and dates outside it are empty. Rows
+    are keyed by field name (not alias) so the pages can use them as they
+    are.
+    """
+    window = _electives_window(settings)
+    start_date = start_date or window[0]
+    end_date = end_date or window[-1]
+    for day in table.missing(d for d in window if start_date <= d <= end_date):
+        refresh_electives_partition(
+            caboodle, clarity, settings, table, day, only_missing=True
+        )
+    return ORJSONResponse(table.select(start_date, end_date, campus))
+
+
 @mock_router.get("/", response_model=list[MergedData])
 def get_mock_electives(
     #   days_ahead: int = 100,
 ) -> list[MergedData]:
-    case = _get_mock_sql_rows("surg", SurgData)
-    preassess = _get_mock_sql_rows("preassess", PreassessData)
-    labs = _get_mock_sql_rows("labs", LabData)
-    echo = _get_mock_sql_rows("echo_2", EchoWithAbnormalData)
-    obs = _get_mock_sql_rows("obs", ObsData)
-    hx = _get_mock_sql_rows("new_hx", MedicalHx)
-    axa = get_axa_codes()
-    pod = _get_mock_sql_rows("pod", ClarityPostopDestination)
-    pa_summary = _get_mock_sql_rows("pa_summary", PreassessSummaryData)
+    case = _get_mock_sql_frame("surg", SurgData)
+    preassess = _get_mock_sql_frame("preassess", PreassessData)
+    labs = _get_mock_sql_frame("labs", LabData)
+    echo = _get_mock_sql_frame("echo_2", EchoWithAbnormalData)
+    obs = _get_mock_sql_frame("obs", ObsData)
+    hx = _get_mock_sql_frame("new_hx", MedicalHx)
+    axa = _axa_codes_frame()
+    pod = _get_mock_sql_frame("pod", ClarityPostopDestination)
+    pa_summary = _get_mock_sql_frame("pa_summary", PreassessSummaryData)
 
     df = prepare_draft(
         electives=case,
@@ -295,3 +479,20 @@ def get_mock_electives(
     )
     df = df.replace({np.nan: None})
     return [MergedData.parse_obj(row) for row in df.to_dict(orient="records")]
+
+
+@mock_router.get(
+    "/by_date/", response_model=list[MergedData], response_model_by_alias=False
+)
+def get_mock_electives_by_date(
+    start_date: date | None = None,
+    end_date: date | None = None,
+    campus: str | None = None,
+) -> ORJSONResponse:
+    table = ElectivesTable()
+    rows = _table_rows([row.dict() for row in get_mock_electives()])
+    for day in {row["surgery_date"] for row in rows}:
+        table.update(day, (row for row in rows if row["surgery_date"] == day))
+    return ORJSONResponse(
+        table.select(start_date or date.min, end_date or date.max, campus)
+    )
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from pydantic import BaseModel
 
 import pickle
 from pathlib import Path
@@ -10,19 +9,6 @@ from pathlib import Path
 # from sklearn.linear_model import BayesianRidge
 # from sklearn.ensemble import RandomForestClassifier
 # from category_encoders import TargetEncoder
-from api.convert import to_data_frame
-
-from models.electives import (
-    PreassessSummaryData,
-    ClarityPostopDestination,
-    SurgData,
-    PreassessData,
-    LabData,
-    EchoWithAbnormalData,
-    ObsData,
-    AxaCodes,
-    MedicalHx,
-)
 from api.electives.hypo_help import (
     merge_surg_preassess,
     wrangle_labs,
@@ -34,15 +20,15 @@ from api.electives.hypo_help import (
 
 
 def prepare_draft(
-    electives: list[type[BaseModel]],
-    preassess: list[type[BaseModel]],
-    labs: list[type[BaseModel]],
-    echo: list[type[BaseModel]],
-    obs: list[type[BaseModel]],
-    axa: list[type[BaseModel]],
-    pod: list[type[BaseModel]],
-    pa_summary: list[type[BaseModel]],
-    medical_hx: list[type[BaseModel]],
+    electives: pd.DataFrame,
+    preassess: pd.DataFrame,
+    labs: pd.DataFrame,
+    echo: pd.DataFrame,
+    obs: pd.DataFrame,
+    axa: pd.DataFrame,
+    pod: pd.DataFrame,
+    pa_summary: pd.DataFrame,
+    medical_hx: pd.DataFrame,
     to_predict: bool = False,
 ) -> pd.DataFrame:
     """
@@ -61,18 +47,13 @@ def prepare_draft(
 
     If to_predict is set to True, it also loads a
     pre-trained random forest model to predict ICU admission.
+
+    Each table is a data frame with the columns of its model in
+    models.electives (SurgData, PreassessData, ...), see
+    api.convert.to_typed_data_frame.
     """
 
-    electives_df = to_data_frame(electives, SurgData)
-    preassess_df = to_data_frame(preassess, PreassessData)
-    pa_summary_df = to_data_frame(pa_summary, PreassessSummaryData)
-    labs_df = to_data_frame(labs, LabData)
-    echo_df = to_data_frame(echo, EchoWithAbnormalData)
-    obs_df = to_data_frame(obs, ObsData)
-    axa_codes = to_data_frame(axa, AxaCodes)
-    pod_df = to_data_frame(pod, ClarityPostopDestination)
-    hx_df = to_data_frame(medical_hx, MedicalHx)
-    # print(hx_df)
+    # print(medical_hx)
 
     # axa_codes = camel_to_snake(
     #    pd.read_csv(
@@ -85,12 +66,12 @@ def prepare_draft(
     # print(axa_codes.columns)
 
     df = (
-        merge_surg_preassess(surg_data=electives_df, preassess_data=preassess_df)
-        .merge(pod_df, left_on="surgical_case_epic_id", right_on="or_case_id")
-        .merge(wrangle_labs(labs_df), how="left", on="patient_durable_key")
-        .merge(wrangle_echo(echo_df), how="left", on="patient_durable_key")
+        merge_surg_preassess(surg_data=electives, preassess_data=preassess)
+        .merge(pod, left_on="surgical_case_epic_id", right_on="or_case_id")
+        .merge(wrangle_labs(labs), how="left", on="patient_durable_key")
+        .merge(wrangle_echo(echo), how="left", on="patient_durable_key")
         .merge(
-            j_wrangle_obs(obs_df),
+            j_wrangle_obs(obs),
             how="left",
             on=["surgical_case_key", "planned_operation_start_instant"],
         )
@@ -99,13 +80,15 @@ def prepare_draft(
         .sort_index()
         # .pipe(fill_na)
         .merge(
-            axa_codes[["surgical_service", "name", "axa_severity", "protocolised_adm"]],
+            axa[["surgical_service", "name", "axa_severity", "protocolised_adm"]],
             on=["surgical_service", "name"],
             how="left",
         )
-        .merge(wrangle_pas(pa_summary_df), how="left", on="patient_durable_key")
+        .merge(wrangle_pas(pa_summary), how="left", on="patient_durable_key")
         .merge(
-            hx_df.groupby("patient_durable_key").agg({"display_string": ". ".join}),
+            medical_hx.groupby("patient_durable_key").agg(
+                {"display_string": ". ".join}
+            ),
             # .rename({"display_string": "hx_string"}),
             how="left",
             on="patient_durable_key",
@@ -1,4 +1,5 @@
 import functools
+import inspect
 import notifiers
 from loguru import logger
 from notifiers.logging import NotificationHandler
@@ -7,7 +8,7 @@ from api.config import get_settings
 from datetime import datetime
 import time
 from collections.abc import Callable
-from typing import TypeVar, ParamSpec
+from typing import Any, TypeVar, ParamSpec
 
 # Strategy to manage type checking
 # https://stackoverflow.com/a/65602590/992999
@@ -27,6 +28,23 @@ def logger_timeit(*, level: str = "DEBUG") -> Callable:
     def wrapper(func: Callable[P, T]) -> Callable[P, T]:
         name = func.__name__
 
+        if inspect.iscoroutinefunction(func):
+            # Time the awaited coroutine (and keep the wrapper a coroutine
+            # function so FastAPI still runs it on the event loop)
+            @functools.wraps(func)
+            async def wrapped_async(*args: P.args, **kwargs: P.kwargs) -> Any:
+                logger_ = logger.opt(depth=1)
+                start = time.time()
+                result = await func(*args, **kwargs)  # type: ignore
+                end = time.time()
+                logger_.log(
+                    level,
+                    f"Function {name} returned in" f" {1000 * (end - start):.1f}ms",
+                )
+                return result
+
+            return wrapped_async  # type: ignore
+
         @functools.wraps(func)
         def wrapped(*args: P.args, **kwargs: P.kwargs) -> T:
             logger_ = logger.opt(depth=1)
@@ -3,22 +3,39 @@
 Entry point and main file for the FastAPI backend
 """
 import time
+from datetime import date
 
 import arrow
 from fastapi import APIRouter, FastAPI
 from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi_utils.tasks import repeat_every
+from sqlalchemy.orm import Session
 
 from api.beds.router import mock_router as mock_beds_router
 from api.beds.router import router as beds_router
+from api.baserow import get_baserow_db
+from api.baserow_mirror import get_baserow_mirror
 from api.census.router import mock_router as mock_census_router
+from api.census.router import (
+    refresh_census_snapshot,
+    refresh_census_snapshot_incremental,
+)
 from api.census.router import router as census_router
+from api.census.snapshot import get_census_snapshot
+from api.config import get_settings
 from api.consults.router import router as consults_router
+from api.db import _caboodle_engine, _clarity_engine, _star_engine
 from api.demo.router import mock_router as mock_demo_router
 from api.demo.router import router as demo_router
 from api.ed.router import mock_router as mock_ed_router
 from api.ed.router import router as ed_router
+from api.electives.materialised import get_electives_table
 from api.electives.router import mock_router as mock_electives_router
+from api.electives.router import (
+    refresh_electives_partition,
+    refresh_electives_table,
+)
 from api.electives.router import router as electives_router
 from api.hospital.router import mock_router as mock_hospital_router
 from api.hospital.router import router as hospital_router
@@ -32,6 +49,11 @@ from api.sitrep.router import mock_router as mock_sitrep_router
 from api.sitrep.router import router as sitrep_router
 
 from api.perrt.admission_probability.predictions_script import run_prediction_pipeline
+from api.perrt.admission_probability.predictions_store import (
+    run_in_predictions_executor,
+    shutdown_predictions_executor,
+    get_predictions_store,
+)
 
 logger.info("API app starting")
 
@@ -79,11 +101,90 @@ app.include_router(mock_router)
 
 # DH's work as per a4e125c926ac8110525a741c4c5709652de8bd49
 @app.on_event("startup")
-@repeat_every(seconds=1800, raise_exceptions=False)
-def refresh_perrt_icu_admission_predictions() -> None:
-    app.state.perrt_icu_adm_predictions = {}
-    predictions = run_prediction_pipeline()
-    app.state.perrt_icu_adm_predictions = predictions
+@repeat_every(
+    seconds=get_settings().perrt_predictions_refresh_seconds, raise_exceptions=False
+)
+async def refresh_perrt_icu_admission_predictions() -> None:
+    # The pipeline runs in a worker process; the previous predictions are
+    # served until it finishes and are kept if it fails (or the worker dies,
+    # in which case the next run gets a new one)
+    predictions, ward_acuity = await run_in_predictions_executor(
+        run_prediction_pipeline
+    )
+    generation = get_predictions_store().swap(predictions, ward_acuity)
+    logger.info(
+        f"PERRT predictions generation {generation} ({len(predictions)} visits)"
+    )
+
+
+@app.on_event("shutdown")
+def stop_perrt_predictions_worker() -> None:
+    shutdown_predictions_executor()
+
+
+@app.on_event("shutdown")
+async def close_baserow_client() -> None:
+    # only if it was made, making it logs in to baserow
+    if get_baserow_db.cache_info().currsize:
+        await get_baserow_db().aclose()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=get_settings().census_refresh_seconds, raise_exceptions=False)
+def refresh_census() -> None:
+    with Session(_star_engine(get_settings())) as session:
+        refresh_census_snapshot(session, get_census_snapshot())
+
+
+@app.on_event("startup")
+@repeat_every(
+    seconds=get_settings().census_incremental_refresh_seconds,
+    wait_first=True,
+    raise_exceptions=False,
+)
+def refresh_census_incremental() -> None:
+    with Session(_star_engine(get_settings())) as session:
+        refresh_census_snapshot_incremental(session, get_census_snapshot())
+
+
+@app.on_event("startup")
+@repeat_every(seconds=get_settings().electives_refresh_seconds, raise_exceptions=False)
+def refresh_electives() -> None:
+    settings = get_settings()
+    refresh_electives_table(
+        _caboodle_engine(settings),
+        _clarity_engine(settings),
+        settings,
+        get_electives_table(),
+    )
+
+
+@app.on_event("startup")
+@repeat_every(
+    seconds=get_settings().electives_today_refresh_seconds,
+    wait_first=True,
+    raise_exceptions=False,
+)
+def refresh_electives_today() -> None:
+    # today's list changes the most (cancellations, late bookings)
+    settings = get_settings()
+    refresh_electives_partition(
+        _caboodle_engine(settings),
+        _clarity_engine(settings),
+        settings,
+        get_electives_table(),
+        date.today(),
+    )
+
+
+@app.on_event("startup")
+@repeat_every(
+    seconds=get_settings().baserow_mirror_refresh_seconds, raise_exceptions=False
+)
+async def refresh_baserow_mirror() -> None:
+    # get_baserow_db blocks (and may retry for a minute) on first use
+    baserow = await run_in_threadpool(get_baserow_db)
+    await get_baserow_mirror().refresh_all(baserow)
 
 
 @app.get("/ping")
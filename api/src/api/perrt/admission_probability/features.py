@@ -0,0 +1,74 @@
+"""
+Grouped feature aggregation for the PERRT ICU admission model
+
+Computes the Mean/Slope/R/Count/Last features for every vital and lab in
+one pass over the observations using grouped reductions, instead of a
+groupby per column with linear_slope (scipy.stats.linregress) called per
+patient.
+
+Slope and R are the least squares fit of each patient's non-missing values
+against their position (0, 1, 2, ...) in observation order, matching
+linear_slope: Slope is 0 with fewer than 2 values and R is 0 with fewer
+than 3 values (or when the values do not vary).
+"""
+import numpy as np
+import pandas as pd
+
+AGG_PREFIXES = ("Mean", "Slope", "R", "Count", "Last")
+
+
+def agg_feature_names(cols_for_agg: list[str]) -> list[str]:
+    return [f"{prefix}_{col}" for col in cols_for_agg for prefix in AGG_PREFIXES]
+
+
+def aggregate_features(
+    df: pd.DataFrame, cols_for_agg: list[str], group_col: str = "hospital_visit_id"
+) -> pd.DataFrame:
+    """
+    One row per group_col with the columns given by agg_feature_names
+
+    df must be in observation order within each group (as the pipeline
+    leaves it) since that order defines the x axis of the slope.
+    """
+    keys = df[group_col].to_numpy()
+    values = df[cols_for_agg].astype(float)
+    notna = values.notna()
+
+    grouped_values = values.groupby(keys, sort=True)
+    n = notna.groupby(keys, sort=True).sum()
+    mean = grouped_values.mean()
+
+    # position of each non-missing value amongst the group's non-missing
+    # values; missing values stay missing so they drop out of every sum
+    x = notna.groupby(keys, sort=True).cumsum().where(notna) - 1
+
+    # centre on the group means so that constant values give exactly zero
+    dx = x - x.groupby(keys, sort=True).transform("mean")
+    dy = values - grouped_values.transform("mean")
+
+    sxx = (dx * dx).groupby(keys, sort=True).sum()
+    syy = (dy * dy).groupby(keys, sort=True).sum()
+    sxy = (dx * dy).groupby(keys, sort=True).sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (sxy / sxx).where(n >= 2, 0.0)
+        r = (sxy / np.sqrt(sxx * syy)).where((n >= 3) & (syy > 0), 0.0)
+    r = r.clip(-1.0, 1.0)
+
+    features = {
+        "Mean": mean,
+        "Slope": slope,
+        "R": r,
+        "Count": grouped_values.count(),
+        "Last": grouped_values.last(),
+    }
+    res = pd.concat(
+        {
+            f"{prefix}_{col}": features[prefix][col]
+            for col in cols_for_agg
+            for prefix in AGG_PREFIXES
+        },
+        axis="columns",
+    )
+    res.index.name = group_col
+    return res
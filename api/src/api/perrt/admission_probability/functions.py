@@ -5,6 +5,7 @@
 # Ignore linting for the moment
 # flake8: noqa
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
 from pathlib import Path
@@ -18,6 +19,11 @@ from sqlalchemy import create_engine
 import sqlalchemy
 
 from scipy import stats
+
+from api.perrt.admission_probability.features import (
+    agg_feature_names,
+    aggregate_features,
+)
 from sklearn.preprocessing import OneHotEncoder, LabelEncoder
 import re
 
@@ -85,6 +91,7 @@ class FlexibleSqlQuery:
                 end_time=self.end_time,  # Time that the prediction is made from (end of obs collection)
                 icu_location=self.icu_location,  # Which ICU wards are we predicting on?
                 min_age=self.min_age,  # The minimum age that we are interested in
+                visit_filter=self.visit_filter,  # Optionally only these hospital visits
             )
 
         elif self.type == "others":
@@ -92,7 +99,6 @@ class FlexibleSqlQuery:
             self.query = self.unformatted_query.format(
                 horizon=self.time_interval,  # The period over which we pull results
                 end_time=self.end_time,  # Time that the prediction is made from (end of obs collection)
-                hv_ids=self.hv_ids,  # Using the hospital visit ids from the previous query
             )
 
         else:
@@ -106,11 +112,13 @@ class FlexibleSqlQuery:
         icu_location: str = "loc.location_string LIKE 'T03%%' OR loc.location_string LIKE '%%T06PACU%%' OR loc.location_string LIKE '%%GWB L01W%%'",
         min_age: int = 13,
         location: str = "SELECT location_string FROM ward_location",
+        hv_ids: list = None,
     ):
         """
         Location is a string, this is the location where the patients are pulled from (usually (SELECT loc FROM ward_location))
         End_time is the time that we are looking for patients on the wards
         icu_location is a string that defaults to PACU, T03 and GWB critical care - but could easily add places here
+        hv_ids optionally restricts the pull to these hospital visits (otherwise everyone on a ward)
         """
         # This method uses the census query
 
@@ -140,6 +148,16 @@ class FlexibleSqlQuery:
             str(min_age) + " YEARS"
         )  # The minimum age of patients we are looking for
 
+        # As for others the hv_ids are bound as an array rather than formatted in;
+        # this query is run as is by the DBAPI (hence the %% in it) so uses its
+        # paramstyle
+        if hv_ids is None:
+            self.visit_filter = ""
+            self.params = {}
+        else:
+            self.visit_filter = "AND ob.hospital_visit_id = ANY(%(hv_ids)s)"
+            self.params = {"hv_ids": [int(i) for i in np.unique(hv_ids)]}
+
         # Now just generate the query
         self.generate_query()
 
@@ -169,13 +187,8 @@ class FlexibleSqlQuery:
         # Set the time to make predictions from
         self.end_time = end_time
 
-        # Make the list of hv_ids
-        # Process IDs into useable string
-        hv_ids = np.unique(hv_ids)
-        formatted_hv_ids = "'" + str(hv_ids[0]) + "'"
-        for i in hv_ids[1:]:
-            formatted_hv_ids = formatted_hv_ids + ", " + "'" + str(i) + "'"
-        self.hv_ids = formatted_hv_ids
+        # The hv_ids are bound as an array (= ANY(:hv_ids)) rather than formatted in
+        self.params = {"hv_ids": [int(i) for i in np.unique(hv_ids)]}
 
         # Now just generate the query
         self.generate_query()
@@ -183,6 +196,17 @@ class FlexibleSqlQuery:
     def __str__(self):
         return self.query
 
+    def read(self, engine, chunksize: int = 10_000) -> pd.DataFrame:
+        """Run an others query with its bound hv_ids, streaming the rows in chunks"""
+        with engine.connect().execution_options(stream_results=True) as conn:
+            chunks = pd.read_sql(
+                sqlalchemy.text(self.query),
+                conn,
+                params=self.params,
+                chunksize=chunksize,
+            )
+            return pd.concat(chunks, ignore_index=True)
+
     def __call__(self):
         return self.query
 
@@ -264,10 +288,53 @@ def argmax_time(time_array: np.array) -> int:
         return not_na[0][max_time]
 
 
+# Vitals the processing below reads directly; a small set of visits (e.g. a
+# single one) may have none of some of them
+PIVOTED_VITALS = [
+    "BP",
+    "Oxygen therapy flow rate",
+    "Oxygen",
+    "Oxygen delivery device",
+    "FiO2",
+    "GCS Total",
+    "AVPU",
+    "NA",
+    "K",
+    "CREA",
+    "NEWS Score",
+    "HBGL",
+    "All pressure areas observed?",
+]
+
+
+def compute_ward_acuity(final_inputs: pd.DataFrame) -> pd.DataFrame:
+    """Mean last NEWS and number of patients with a last NEWS of 5 or more on
+    each ward (indexed by ward_raw)"""
+    news = pd.to_numeric(final_inputs["Last_NEWS_Score"])
+    wards = final_inputs["ward_raw"]
+    return pd.DataFrame(
+        {
+            "average_ward_NEWS": news.groupby(wards).mean(),
+            "ward_NEWS_over_5": (news >= 5).groupby(wards).sum().astype(float),
+        }
+    )
+
+
 # Now run the whole pipeline
-def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
+def run_pipeline(
+    date_list: list,
+    engine,
+    now: bool = False,
+    hospital_visit_ids: list = None,
+    ward_acuity: pd.DataFrame = None,
+) -> pd.DataFrame:
     """Function to run the whole data preparation pipeline
     We need to pass a list of dates and the number of hours to take obs from
+    hospital_visit_ids optionally restricts the pipeline to just those visits
+    ward_acuity (from compute_ward_acuity over a full run) is used for the
+    ward strain features in place of that of the visits pulled, for the
+    wards it covers
+    Also returns the ward acuity used for the last date
     """
 
     # We have to set up the column names that we are going to use:
@@ -528,6 +595,9 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
         "Last_pressure_areas_observed": 1.0,
     }
 
+    # Nothing may be pulled if no requested visits have recent obs
+    obs_df = others_df = results_df = labs_only_df = acuity = None
+
     # Work through all of the dates to get ICU admission after 24h from ward patients
     for number, date in enumerate(date_list):
         if not now:
@@ -543,23 +613,30 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
 
         # Do the observations pull
         obs_query = FlexibleSqlQuery("24 HOURS")
-        obs_query.observations(end_time)
-        obs_df = pd.read_sql(obs_query(), engine)
+        obs_query.observations(end_time, hv_ids=hospital_visit_ids)
+        obs_df = pd.read_sql(obs_query(), engine, params=obs_query.params)
+        if obs_df.empty:
+            continue
 
         # The labs pull
         labs_query = FlexibleSqlQuery("72 HOURS")
         labs_query.others("labs", end_time, obs_df["hospital_visit_id"])
-        labs_df = pd.read_sql(labs_query(), engine)
 
         # Consults pull
         consults_query = FlexibleSqlQuery("48 HOURS")
         consults_query.others("consults", end_time, obs_df["hospital_visit_id"])
-        consults_df = pd.read_sql(consults_query(), engine)
 
         # Other data pull
         other_query = FlexibleSqlQuery("7 DAYS")
         other_query.others("others", end_time, obs_df["hospital_visit_id"])
-        others_df = pd.read_sql(other_query(), engine)
+
+        # These only depend on the obs pull so run them at the same time, each on
+        # its own connection from the engine's pool
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            labs_df, consults_df, others_df = executor.map(
+                lambda query: query.read(engine),
+                [labs_query, consults_query, other_query],
+            )
 
         print("data pulls done")
 
@@ -666,6 +743,9 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
         # Annoying way to allow us to subsequently merge because pivotting on 2 columns gives multi index
         Pivot_results.columns = [i[1] for i in Pivot_results.columns.to_flat_index()]
         Pivot_results = Pivot_results.reset_index()
+        for vital in PIVOTED_VITALS:
+            if vital not in Pivot_results.columns:
+                Pivot_results[vital] = np.nan
 
         ##Now split BP in the Pivotted results
         # Find all non-na BPs and split them
@@ -965,11 +1045,11 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
         # Now make something we can merge back onto the main table
         ethnic_categories = [str(i) + "_ethnicity" for i in OH_enc.categories_[0]]
 
-        # Don't want one named 'nan_ethnicity'
-        nan_ethnicity = [
-            i for i, j in enumerate(ethnic_categories) if j == "nan_ethnicity"
+        # Don't want one named 'nan_ethnicity' (there may be none)
+        ethnic_categories = [
+            "missing_ethnicity" if j == "nan_ethnicity" else j
+            for j in ethnic_categories
         ]
-        ethnic_categories[nan_ethnicity[0]] = "missing_ethnicity"
         ethnicity_df = pd.DataFrame(OH_ethnicity, columns=ethnic_categories)
 
         # Now merge back on
@@ -1108,33 +1188,10 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
             np.nan, columns=final_inputs_colnames, index=final_inputs_index
         )
 
-        for colname in cols_for_agg:
-            all_colnames = [
-                f"Mean_{colname}",
-                f"Slope_{colname}",
-                f"R_{colname}",
-                f"Count_{colname}",
-                f"Last_{colname}",
-            ]
-
-            # We're looping through all of the columns calling these aggregate functions
-            final_inputs.loc[:, all_colnames] = Transformed_dataframe.groupby(
-                "hospital_visit_id"
-            ).agg(
-                **{
-                    f"Mean_{colname}": pd.NamedAgg(colname, aggfunc=np.mean),
-                    # These two return the slope and r value for a least squares fit line
-                    f"Slope_{colname}": pd.NamedAgg(
-                        colname, aggfunc=lambda x: linear_slope(x, returns="slope")
-                    ),
-                    f"R_{colname}": pd.NamedAgg(
-                        colname, aggfunc=lambda x: linear_slope(x, returns="r value")
-                    ),
-                    # These named functions exclude nans helpfully
-                    f"Count_{colname}": pd.NamedAgg(colname, aggfunc="count"),
-                    f"Last_{colname}": pd.NamedAgg(colname, aggfunc="last"),
-                }
-            )
+        # Mean, Slope, R, Count and Last for every column in one grouped pass
+        final_inputs.loc[:, agg_feature_names(cols_for_agg)] = aggregate_features(
+            Transformed_dataframe, cols_for_agg
+        )
 
         for colname in cols_for_last:
             # We're looping through all of the columns calling these aggregate functions
@@ -1153,27 +1210,13 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
         ).agg(**{"ward_raw": pd.NamedAgg("ward_raw", aggfunc="last")})
 
         ### Now for the ward acuity steps
-        final_inputs["ward_NEWS_over_5"] = np.nan
-        final_inputs["average_ward_NEWS"] = np.nan
-
-        # Work through all the wards, getting the number of patients with a NEWS > 5
-        for i in final_inputs["ward_raw"].unique():
-            ward_locs = final_inputs["ward_raw"] == i
-
-            # Patients with a NEWS >5
-            ward_NEWS_over_5 = len(
-                np.intersect1d(
-                    np.where(pd.to_numeric(final_inputs["Last_NEWS_Score"]) >= 5),
-                    np.where(ward_locs),
-                )
-            )
-
-            # Mean news
-            mean_NEWS = np.nanmean(final_inputs.Last_NEWS_Score[ward_locs])
-
-            # Now re_allocate
-            final_inputs.loc[ward_locs, ["average_ward_NEWS"]] = mean_NEWS
-            final_inputs.loc[ward_locs, ["ward_NEWS_over_5"]] = ward_NEWS_over_5
+        # Patients with a NEWS >= 5 and the mean NEWS on each ward
+        acuity = compute_ward_acuity(final_inputs)
+        if ward_acuity is not None:
+            acuity = ward_acuity.combine_first(acuity)
+        final_inputs[["average_ward_NEWS", "ward_NEWS_over_5"]] = acuity.reindex(
+            final_inputs["ward_raw"]
+        ).to_numpy()
 
         ### Now we are going to impute the missing values
         # Keep track of missingness
@@ -1194,7 +1237,7 @@ def run_pipeline(date_list: list, engine, now: bool = False) -> pd.DataFrame:
         )
 
     # Now return the practice dataset
-    return practice_dataset, obs_df, others_df, results_df, labs_only_df
+    return practice_dataset, obs_df, others_df, results_df, labs_only_df, acuity
 
 
 def pull_extra_data(csns, engine):
@@ -0,0 +1,44 @@
+"""
+Loads the pickled PERRT ICU admission model once per process
+
+The model is reloaded only when the pickle's modification time changes so a
+retrained final_model.pkl can be dropped in without restarting the API.
+"""
+import pickle
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
+# Ignore xgboost import, it's required for pickled file
+import xgboost  # noqa: F401
+
+from api.logger import logger
+
+MODEL_PATH = Path(__file__).parent.resolve() / "final_model.pkl"
+
+
+class ModelRegistry:
+    def __init__(self, path: Path = MODEL_PATH) -> None:
+        self._path = path
+        self._model: Any = None
+        self._mtime_ns: int | None = None
+        self._lock = Lock()
+
+    def get(self) -> Any:
+        """The unpickled model, reloaded if the file has changed"""
+        mtime_ns = self._path.stat().st_mtime_ns
+        if mtime_ns != self._mtime_ns:
+            with self._lock:
+                if mtime_ns != self._mtime_ns:
+                    with open(self._path, "rb") as f:
+                        self._model = pickle.load(f)
+                    self._mtime_ns = mtime_ns
+                    logger.info(f"Loaded PERRT model from {self._path}")
+        return self._model
+
+
+_model_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    return _model_registry
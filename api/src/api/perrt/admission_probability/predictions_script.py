@@ -1,13 +1,11 @@
-# Ignore xgboost import, it's required for pickled file
-import xgboost  # noqa: F401
-
 # from api.db import get_star_session
 # from sqlmodel import Session
+from functools import lru_cache
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 
-import pickle
 import pandas as pd
-from pathlib import Path
 
 # import os
 import re
@@ -18,18 +16,22 @@ import re
 from .functions import run_pipeline  # type: ignore
 
 from api.config import get_settings
-
-_this_file = Path(__file__)
+from api.perrt.admission_probability.model_registry import get_model_registry
 
 # def get_emapdb_engine():
 #     get_settings().star_dsn
 #     return create_engine(get_settings().star_dsn)
 
 
+@lru_cache()
+def _pipeline_engine() -> Engine:
+    settings = get_settings()
+    return create_engine(settings.star_dsn, echo=settings.echo_sql)
+
+
 def get_predictions(dataset: pd.DataFrame) -> dict:
-    # Load the model and shap model
-    with open(f"{_this_file.parent.resolve()}/final_model.pkl", "rb") as f:
-        model = pickle.load(f)
+    # Load the model (cached until final_model.pkl changes)
+    model = get_model_registry().get()
 
     # Remove columns with 'ward' in them (these may cause model drift)
     ward_columns = [i for i in dataset.columns if re.match(".*_ward$", i)]
@@ -55,21 +57,25 @@ def get_predictions(dataset: pd.DataFrame) -> dict:
 #         pickle.dump(predictions_map, f)
 
 
-def run_prediction_pipeline() -> dict:
+def run_prediction_pipeline() -> tuple[dict, pd.DataFrame | None]:
+    """
+    Predictions for every visit on the wards, and the ward acuity (see
+    compute_ward_acuity) that score_visits reuses until the next run
+    """
     # most return variables unused for our use case
 
     settings = get_settings()
 
     if settings.icu_admission_predictions:
-        return {}
+        return {}, None
 
-    dataset, _, _, _, _ = run_pipeline(
+    dataset, _, _, _, _, ward_acuity = run_pipeline(
         list([pd.to_datetime("now").date()]),
-        create_engine(settings.star_dsn, echo=settings.echo_sql),
+        _pipeline_engine(),
         now=True,
     )
 
-    return get_predictions(dataset)
+    return get_predictions(dataset), ward_acuity
     # write_predictions(predictions_map)
 
     # scheduler.enter(
@@ -77,6 +83,35 @@ def run_prediction_pipeline() -> dict:
     # )
 
 
+def score_visits(
+    hospital_visit_ids: list[int], ward_acuity: pd.DataFrame | None = None
+) -> dict:
+    """
+    Build features for just these visits as of now and score them in one
+    batch; visits not currently on a ward with observations score None
+
+    The ward strain features are taken from ward_acuity (that of the last
+    full run) so the scores match the full run's, rather than worked out
+    from just these visits
+    """
+    scores: dict = {str(i): None for i in hospital_visit_ids}
+
+    if get_settings().icu_admission_predictions or not hospital_visit_ids:
+        return scores
+
+    dataset, _, _, _, _, _ = run_pipeline(
+        list([pd.to_datetime("now").date()]),
+        _pipeline_engine(),
+        now=True,
+        hospital_visit_ids=hospital_visit_ids,
+        ward_acuity=ward_acuity,
+    )
+    if not dataset.empty:
+        scores.update(get_predictions(dataset))
+
+    return scores
+
+
 # if __name__ == "__main__":
 #     # functions.py relies on specific, relative paths
 #     dir_path = os.path.dirname(os.path.realpath(__file__))
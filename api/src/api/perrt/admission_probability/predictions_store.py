@@ -0,0 +1,130 @@
+"""
+Latest PERRT ICU admission predictions
+
+The prediction pipeline takes several minutes so it runs in a worker process
+(see api.main) and the resulting map of hospital_visit_id -> probability is
+swapped in here whole once it is complete. Until then, and if a run fails,
+the previous map carries on being served. A worker that dies is replaced
+(see run_in_predictions_executor) so the next run can go ahead.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from threading import Lock
+from typing import Any, Callable, TypeVar
+
+import pandas as pd
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class _PredictionsState:
+    """Immutable prediction map; swapped in whole after each run"""
+
+    predictions: dict[str, float] = field(default_factory=dict)
+    ward_acuity: pd.DataFrame | None = None
+    generation: int = 0
+    generated_at: datetime | None = None
+
+
+class PredictionsStore:
+    def __init__(self) -> None:
+        self._state = _PredictionsState()
+        self._write_lock = Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._state.generation
+
+    @property
+    def generated_at(self) -> datetime | None:
+        return self._state.generated_at
+
+    @property
+    def ward_acuity(self) -> pd.DataFrame | None:
+        """Ward strain features from the run behind the predictions"""
+        return self._state.ward_acuity
+
+    def swap(
+        self, predictions: dict[str, float], ward_acuity: pd.DataFrame | None = None
+    ) -> int:
+        """Replace the prediction map and return its generation id"""
+        with self._write_lock:
+            generation = self._state.generation + 1
+            self._state = _PredictionsState(
+                predictions=predictions,
+                ward_acuity=ward_acuity,
+                generation=generation,
+                generated_at=datetime.now(timezone.utc),
+            )
+        return generation
+
+    def get(self, hospital_visit_ids: list[int]) -> dict[str, float | None]:
+        predictions = self._state.predictions
+        return {str(i): predictions.get(str(i), None) for i in hospital_visit_ids}
+
+
+_predictions_store = PredictionsStore()
+
+
+def get_predictions_store() -> PredictionsStore:
+    return _predictions_store
+
+
+def _new_predictions_executor() -> ProcessPoolExecutor:
+    """
+    Single worker process for the prediction pipeline
+
+    Spawned rather than forked so the worker does not inherit the API's
+    threads, event loop or database connections.
+    """
+    return ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+
+
+_predictions_executor: ProcessPoolExecutor | None = None
+_executor_lock = Lock()
+
+
+def get_predictions_executor() -> ProcessPoolExecutor:
+    global _predictions_executor
+    with _executor_lock:
+        if _predictions_executor is None:
+            _predictions_executor = _new_predictions_executor()
+        return _predictions_executor
+
+
+def replace_predictions_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Swap in a new worker process for one that has died (e.g. killed for
+    running out of memory), which leaves its pool broken for good
+    """
+    global _predictions_executor
+    with _executor_lock:
+        if _predictions_executor is broken:
+            _predictions_executor = _new_predictions_executor()
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_predictions_executor(fn: Callable[..., T], *args: Any) -> T:
+    """
+    fn(*args) run in the prediction worker process
+
+    If the worker has died the call fails with BrokenProcessPool as before,
+    but the next call gets a new worker.
+    """
+    executor = get_predictions_executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except BrokenProcessPool:
+        replace_predictions_executor(executor)
+        raise
+
+
+def shutdown_predictions_executor() -> None:
+    with _executor_lock:
+        if _predictions_executor is not None:
+            _predictions_executor.shutdown(wait=False, cancel_futures=True)
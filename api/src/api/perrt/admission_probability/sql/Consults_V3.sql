@@ -20,5 +20,5 @@ AND cr.closed_due_to_discharge = 'false'
 
 AND cr.scheduled_datetime BETWEEN {end_time} - '{horizon}'::INTERVAL AND {end_time}
 
-AND cr.hospital_visit_id IN ({hv_ids})
+AND cr.hospital_visit_id = ANY(:hv_ids)
 ORDER BY cr.hospital_visit_id DESC
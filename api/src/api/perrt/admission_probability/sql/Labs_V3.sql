@@ -30,6 +30,6 @@ AND def.test_lab_code IN ('HBGL', 'RCC', 'HCT', 'HCTU', 'MCVU', 'PLT', 'NE', 'WC
 									'GLU', 'Glu', 'pH', 'pCO2', 'K+', 'Na+', 'Lac', 'Urea', 'Crea', 'tHb', 'COHb', 'Ferr', 'pO2', 'Urea')
 
 --Only patients in the previous data pull
-AND lo.hospital_visit_id IN ({hv_ids})
+AND lo.hospital_visit_id = ANY(:hv_ids)
 
 ORDER BY res.lab_order_id, lo.request_datetime ASC;
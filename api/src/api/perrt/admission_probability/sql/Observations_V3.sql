@@ -380,5 +380,8 @@ AND
 -- Only include specified CSNs
 AND visit.encounter IN (SELECT csn from census)
 
+-- Optionally only include specified hospital visits
+{visit_filter}
+
 ORDER BY visit.hospital_visit_id, ob.observation_datetime DESC
 ;
@@ -7,13 +7,13 @@ SELECT DISTINCT * FROM star.location
 
 -- Possible ED strings - either 'ED^...' or null^ED ... or ED^UCHED or SDEC present
 WHERE (SPLIT_PART(location_string , '^', 1) = 'ED'
-OR SPLIT_PART(location_string , '^', 2) LIKE 'ED %%'
-OR location_string LIKE '%%SDEC%%'
-OR SPLIT_PART(location_string, '^', 2) LIKE 'UCHED%%')
+OR SPLIT_PART(location_string , '^', 2) LIKE 'ED %'
+OR location_string LIKE '%SDEC%'
+OR SPLIT_PART(location_string, '^', 2) LIKE 'UCHED%')
 
 -- Don't want to inclued eastman dental or national ENT hospital
-AND location_string NOT LIKE '%%ENTED%%'
-AND location_string NOT LIKE '%%EDH%%'
+AND location_string NOT LIKE '%ENTED%'
+AND location_string NOT LIKE '%EDH%'
 ORDER BY location_string),
 
 
@@ -150,7 +150,7 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 		JOIN star.advance_decision_type adt
 		ON adt.advance_decision_type_id = ad.advance_decision_type_id
 
-	  	WHERE ad.hospital_visit_id IN ({hv_ids})
+	  	WHERE ad.hospital_visit_id = ANY(:hv_ids)
 	  	ORDER BY ad.hospital_visit_id, ad.valid_from DESC
 	),
 
@@ -162,7 +162,7 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 
 	FROM star.location_visit lv
 	LEFT JOIN star.location loc ON lv.location_id = loc.location_id
-	WHERE lv.hospital_visit_id IN ({hv_ids})
+	WHERE lv.hospital_visit_id = ANY(:hv_ids)
 	AND loc.location_string IN (SELECT location_string FROM ed_locations)
 	ORDER BY lv.hospital_visit_id, lv.admission_datetime ASC),
 
@@ -175,7 +175,7 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 
 	FROM star.location_visit lv
 	LEFT JOIN star.location loc ON lv.location_id = loc.location_id
-	WHERE lv.hospital_visit_id IN ({hv_ids})
+	WHERE lv.hospital_visit_id = ANY(:hv_ids)
 
 	--Choose theatres
 	AND SPLIT_PART(loc.location_string, '^', 1) IN ('THP3', 'T02THR', '1021800001') -- 1021800001 is GWB theatres
@@ -195,7 +195,7 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 
 	FROM star.location_visit lv
 	LEFT JOIN star.location loc ON lv.location_id = loc.location_id
-	WHERE lv.hospital_visit_id IN ({hv_ids})
+	WHERE lv.hospital_visit_id = ANY(:hv_ids)
 
 	--Choose theatres
 	AND SPLIT_PART(loc.location_string, '^', 1) IN ('THP3', 'T02THR', '1021800001') -- 1021800001 is GWB theatres
@@ -212,12 +212,12 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 
 	FROM star.location_visit lv
 	LEFT JOIN star.location loc ON lv.location_id = loc.location_id
-	WHERE lv.hospital_visit_id IN ({hv_ids})
+	WHERE lv.hospital_visit_id = ANY(:hv_ids)
 
 	--Choose theatres
-	AND ( loc.location_string LIKE 'T03%%' OR
-			loc.location_string LIKE '%%T06PACU%%' OR
-			loc.location_string LIKE '%%GWB L01W%%')
+	AND ( loc.location_string LIKE 'T03%' OR
+			loc.location_string LIKE '%T06PACU%' OR
+			loc.location_string LIKE '%GWB L01W%')
 
 	--Make sure they were only in theatres in the past
 	AND lv.discharge_datetime <= {end_time}
@@ -237,7 +237,7 @@ ORDER BY cr.hospital_visit_id, cr.scheduled_datetime, ct.name DESC),
 
         AND cr.scheduled_datetime BETWEEN {end_time} - '7 DAYS'::INTERVAL AND {end_time}
 
-        AND cr.hospital_visit_id IN ({hv_ids})
+        AND cr.hospital_visit_id = ANY(:hv_ids)
         ORDER BY cr.hospital_visit_id, cr.scheduled_datetime ASC)
 
 
@@ -291,6 +291,6 @@ FULL JOIN gynae ON hv.hospital_visit_id = gynae.hospital_visit_id
 FULL JOIN oncology ON hv.hospital_visit_id = oncology.hospital_visit_id
 FULL JOIN ortho ON hv.hospital_visit_id = ortho.hospital_visit_id
 
-WHERE hv.hospital_visit_id IN ({hv_ids})
+WHERE hv.hospital_visit_id = ANY(:hv_ids)
 
 ORDER BY hv.hospital_visit_id;
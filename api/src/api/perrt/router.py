@@ -7,12 +7,18 @@ Serve the PERRT endpoints
 import datetime as dt
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, Query, Request
+from fastapi import APIRouter, Body, Depends, Query, Response
 from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
 
 from api.convert import parse_to_data_frame, to_data_frame
 from api.db import get_star_session
 from api.mock import _get_json_rows, _parse_query
+from api.perrt.admission_probability.predictions_script import score_visits
+from api.perrt.admission_probability.predictions_store import (
+    PredictionsStore,
+    get_predictions_store,
+)
 from api.perrt.wrangle import wrangle
 from models.perrt import EmapConsults, EmapCpr, EmapVitalsLong, EmapVitalsWide
 
@@ -20,15 +26,22 @@ router = APIRouter(prefix="/perrt")
 mock_router = APIRouter(prefix="/perrt")
 _this_file = Path(__file__)
 
+PREDICTIONS_GENERATION_HEADER = "X-Predictions-Generation"
+PREDICTIONS_GENERATED_AT_HEADER = "X-Predictions-Generated-At"
+
 
 @router.get("/icu_admission_prediction", response_model=dict)
 def get_icu_admission_preciction(
-    request: Request, hospital_visit_ids: list[int] = Query(default=[])
+    response: Response,
+    hospital_visit_ids: list[int] = Query(default=[]),
+    store: PredictionsStore = Depends(get_predictions_store),
 ) -> dict:
-    return {
-        str(id): request.app.state.perrt_icu_adm_predictions.get(str(id), None)
-        for id in hospital_visit_ids
-    }
+    response.headers[PREDICTIONS_GENERATION_HEADER] = str(store.generation)
+    if store.generated_at is not None:
+        response.headers[
+            PREDICTIONS_GENERATED_AT_HEADER
+        ] = store.generated_at.isoformat()
+    return store.get(hospital_visit_ids)
 
 
 @mock_router.get("/icu_admission_prediction", response_model=dict)
@@ -39,6 +52,29 @@ def get_mock_icu_admission_preciction(
     return {str(id): mock_predictions.get(str(id), None) for id in hospital_visit_ids}
 
 
+@router.post("/icu_admission_prediction/score", response_model=dict)
+async def score_icu_admission_prediction(
+    hospital_visit_ids: list[int] = Body(default=[]),
+    store: PredictionsStore = Depends(get_predictions_store),
+) -> dict:
+    """
+    Fresh predictions for just these visits, built from their observations
+    as of now and scored in a single batch
+
+    Scored in the threadpool with the cached model rather than in the
+    prediction worker process, so neither waits on the other's full runs,
+    using the ward strain features of the last full run
+    """
+    return await run_in_threadpool(score_visits, hospital_visit_ids, store.ward_acuity)
+
+
+@mock_router.post("/icu_admission_prediction/score", response_model=dict)
+def score_mock_icu_admission_prediction(
+    hospital_visit_ids: list[int] = Body(default=[]),
+) -> dict:
+    return get_mock_icu_admission_preciction(hospital_visit_ids)
+
+
 @router.get("/cpr", response_model=list[EmapCpr])
 def get_emap_cpr(
     session: Session = Depends(get_star_session),
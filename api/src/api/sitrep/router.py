@@ -12,6 +12,10 @@ from sqlmodel import Session
 from api.config import Settings, get_settings
 
 from api.baserow import BaserowDB, get_baserow_db
+from api.baserow_mirror import BaserowMirror, get_baserow_mirror
+from api.beds.router import patch_beds_batch
+
+from models.beds import BatchRowResult, BedUpdate
 
 # TODO: Give sitrep its own CensusRow model so we do not have interdependencies.
 from models.census import CensusRow
@@ -40,21 +44,13 @@ mock_router = APIRouter(prefix="/sitrep")
 
 
 @router.get("/beds/", response_model=list[BedRow])
-def get_beds(
+async def get_beds(
     department: str,
     baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
 ) -> list[BedRow]:
-    field_ids = baserow.get_fields("beds")
-
-    department_field_id = field_ids["department"]
-
-    params = {
-        "size": 200,  # The maximum size of a page.
-        "user_field_names": "true",
-        f"filter__field_{department_field_id}__equal": department,
-    }
-
-    rows = baserow.get_rows("beds", params)
+    await mirror.ensure(baserow, "beds")
+    rows = mirror.filter("beds", "department", [department])
     return [BedRow.parse_obj(row) for row in rows]
 
 
@@ -123,18 +119,11 @@ def get_live_ui(
     return [SitrepRow.parse_obj(row) for row in rows]
 
 
-@router.patch("/beds")
+@router.patch("/beds", response_model=list[BatchRowResult])
 def update_bed_row(
-    table_id: int, row_id: int, data: dict, settings: Settings = Depends(get_settings)
-) -> None:
-    url = f"{settings.baserow_url}/api/database/rows/table/{table_id}/"
-
-    # TODO: Need to get working.
-    requests.patch(
-        url=f"{url}{row_id}/?user_field_names=true",
-        headers={
-            "Authorization": f"Token {settings.BASEROW_READWRITE_TOKEN}",
-            "Content-Type": "application/json",
-        },
-        json=data,
-    )
+    updates: list[BedUpdate],
+    baserow: BaserowDB = Depends(get_baserow_db),
+    mirror: BaserowMirror = Depends(get_baserow_mirror),
+) -> list[BatchRowResult]:
+    """Kept for the sitrep pages; the same as PATCH /baserow/beds/batch"""
+    return patch_beds_batch(updates, baserow, mirror)
@@ -0,0 +1,179 @@
+# type: ignore
+import asyncio
+
+import httpx
+
+from api.baserow import BaserowDB, to_batch_results
+from api.baserow_mirror import BaserowMirror
+from api.config import get_settings
+
+TABLES = {"beds": {"id": 1, "name": "beds", "fields": {"department": 11}}}
+
+
+def _mock_beds_transport(n_rows: int) -> httpx.MockTransport:
+    rows = [{"id": i, "department": f"dept{i % 3}"} for i in range(n_rows)]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        params = request.url.params
+        department = params.get("filter__field_11__equal")
+        matches = [r for r in rows if department in (None, r["department"])]
+        page = int(params["page"])
+        size = int(params["size"])
+        results = matches[(page - 1) * size : page * size]
+        more = page * size < len(matches)
+        return httpx.Response(
+            200,
+            json={
+                "count": len(matches),
+                "next": "next" if more else None,
+                "results": results,
+            },
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def _baserow(transport: httpx.MockTransport) -> BaserowDB:
+    return BaserowDB(get_settings(), "token", TABLES, transport=transport)
+
+
+def test_get_rows_async_all_pages() -> None:
+    baserow = _baserow(_mock_beds_transport(n_rows=450))
+    rows = asyncio.run(baserow.get_rows_async("beds", {"size": 200}))
+    assert [r["id"] for r in rows] == list(range(450))
+
+
+def test_async_client_is_closed_when_replaced_and_on_aclose() -> None:
+    baserow = _baserow(_mock_beds_transport(n_rows=450))
+    asyncio.run(baserow.get_rows_async("beds", {"size": 200}))
+    first = baserow._async_client
+
+    # a new event loop gets a new client and the first one is closed
+    asyncio.run(baserow.get_rows_async("beds", {"size": 200}))
+    second = baserow._async_client
+    assert second is not first
+    assert first.is_closed
+    assert not second.is_closed
+
+    asyncio.run(baserow.aclose())
+    assert second.is_closed
+    assert baserow._async_client is None
+
+
+def test_get_rows_by_field() -> None:
+    baserow = _baserow(_mock_beds_transport(n_rows=450))
+    rows = asyncio.run(
+        baserow.get_rows_by_field("beds", {}, "department", ["dept0", "dept1"])
+    )
+    assert len(rows) == 300
+    assert {r["department"] for r in rows} == {"dept0", "dept1"}
+
+
+def test_mirror_filter_and_upsert() -> None:
+    mirror = BaserowMirror()
+    mirror.load(
+        "beds",
+        [
+            {"id": 1, "department": "A", "location_string": "A^1^1", "hl7_room": "1"},
+            {"id": 2, "department": "A", "location_string": "A^1^2", "hl7_room": "1"},
+            {"id": 3, "department": "B", "location_string": "B^1^1", "hl7_room": "2"},
+        ],
+    )
+
+    assert [r["id"] for r in mirror.filter("beds", "department", ["A"])] == [1, 2]
+    assert [r["id"] for r in mirror.filter("beds", "location_string", ["B^1^1"])] == [3]
+
+    # callers get copies so cannot modify the mirror
+    mirror.rows("beds")[0]["department"] = "C"
+    assert mirror.filter("beds", "department", ["C"]) == []
+
+    mirror.upsert("beds", [{"id": 2, "department": "B", "location_string": "A^1^2"}])
+    assert [r["id"] for r in mirror.filter("beds", "department", ["B"])] == [2, 3]
+
+
+def test_mirror_version_changes_only_with_rows() -> None:
+    mirror = BaserowMirror()
+    assert mirror.version("rooms") == 0
+
+    rows = [{"id": 1, "hl7_room": "BY01", "department": "A"}]
+    mirror.load("rooms", rows)
+    mirror.load("rooms", [dict(row) for row in rows])
+    assert mirror.version("rooms") == 1
+
+    mirror.upsert("rooms", [{"id": 1, "hl7_room": "BY01", "department": "B"}])
+    assert mirror.version("rooms") == 2
+
+
+def test_mirror_upsert_before_load_is_ignored() -> None:
+    mirror = BaserowMirror()
+    mirror.upsert("discharge_statuses", [{"id": 1, "csn": 123}])
+    assert mirror.refreshed_at("discharge_statuses") is None
+    assert mirror.rows("discharge_statuses") == []
+
+
+def test_mirror_load_keeps_upserts_made_during_refresh() -> None:
+    mirror = BaserowMirror()
+    mirror.load("discharge_statuses", [{"id": 1, "csn": 123, "status": "review"}])
+
+    # a refresh downloads the table, then a status is posted before it loads
+    generation = mirror.generation("discharge_statuses")
+    downloaded = [{"id": 1, "csn": 123, "status": "review"}]
+    mirror.upsert("discharge_statuses", [{"id": 2, "csn": 123, "status": "discharge"}])
+    mirror.load("discharge_statuses", downloaded, generation)
+
+    statuses = mirror.filter("discharge_statuses", "csn", [123])
+    assert [row["status"] for row in statuses] == ["review", "discharge"]
+
+    # the next refresh includes the posted row so the upsert is not kept
+    mirror.load("discharge_statuses", [{"id": 1, "csn": 123, "status": "review"}])
+    assert [row["id"] for row in mirror.rows("discharge_statuses")] == [1]
+
+
+def test_mirror_refresh_downloads_recent_discharge_statuses() -> None:
+    class _Baserow:
+        tables_dict = {"discharge_statuses": {"fields": {"modified_at": 7}}}
+
+        async def get_rows_async(self, table_name: str, params: dict) -> list:
+            self.params = params
+            return [{"id": 1, "csn": 123}]
+
+    baserow = _Baserow()
+    mirror = BaserowMirror()
+    asyncio.run(mirror.refresh(baserow, "discharge_statuses"))
+
+    assert "filter__field_7__date_after" in baserow.params
+    assert mirror.rows("discharge_statuses") == [{"id": 1, "csn": 123}]
+
+
+class _FakeBatchSession:
+    """Stands in for requests.Session; fails any chunk containing csn 0"""
+
+    def __init__(self) -> None:
+        self.chunk_sizes: list[int] = []
+
+    def request(self, method, url, params=None, json=None):
+        items = json["items"]
+        self.chunk_sizes.append(len(items))
+        if any(item.get("csn") == 0 for item in items):
+            return httpx.Response(400, content=b"bad row")
+        return httpx.Response(
+            200, json={"items": [{"id": i, **item} for i, item in enumerate(items)]}
+        )
+
+
+def test_post_rows_batch_chunks_and_reports_per_row() -> None:
+    baserow = _baserow(_mock_beds_transport(n_rows=0))
+    baserow._session = _FakeBatchSession()
+
+    items = [{"csn": i + 1, "status": "ready"} for i in range(450)]
+    items[300]["csn"] = 0
+    results = to_batch_results(baserow.post_rows_batch("beds", {}, items))
+
+    assert baserow._session.chunk_sizes == [200, 200, 50]
+    assert len(results) == 450
+    assert [r.index for r in results] == list(range(450))
+    # the whole of the second chunk fails
+    assert all(r.ok for r in results[:200])
+    assert not any(r.ok for r in results[200:400])
+    assert all(r.error for r in results[200:400])
+    assert all(r.ok for r in results[400:])
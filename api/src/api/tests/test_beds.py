@@ -1,8 +1,17 @@
 # type: ignore
+import json
+from datetime import date, datetime, timezone
+
 from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from api.convert import parse_to_columns
 
+from api.baserow import get_baserow_db
+from api.baserow_mirror import BaserowMirror, get_baserow_mirror
+from api.beds.layout import BedLayoutCache
 from api.main import app
-from models.beds import Bed
+from models.beds import BatchRowResult, Bed, BedLayout
 
 client = TestClient(app)
 
@@ -22,3 +31,164 @@ def test_get_mock_beds() -> None:
     assert response.status_code == 200
     beds = [Bed.parse_obj(row) for row in response.json()]
     assert len(beds) > 0
+
+
+def test_get_mock_beds_columns() -> None:
+    params = {"departments": "UCH T03 INTENSIVE CARE"}
+    records = client.get("/mock/baserow/beds", params=params).json()
+    response = client.get("/mock/baserow/beds", params={**params, "format": "columns"})
+    assert response.status_code == 200
+
+    columns = response.json()
+    assert list(columns) == list(Bed.__fields__)
+    assert [dict(zip(columns, values)) for values in zip(*columns.values())] == records
+
+
+class _Row(BaseModel):
+    id: int
+    name: str
+    score: float | None
+    count: int | None
+    closed: bool | None
+    admitted: datetime | None
+    day: date
+
+
+def test_parse_to_columns_matches_records() -> None:
+    rows = [
+        {
+            "id": "1",
+            "name": 7,
+            "score": "1.5",
+            "count": None,
+            "closed": "yes",
+            "admitted": "2022-03-01T08:00:00+00:00",
+            "day": "2022-03-01",
+        },
+        {
+            "id": 2,
+            "name": "T03",
+            "score": None,
+            "count": "3",
+            "closed": False,
+            "admitted": None,
+            "day": date(2022, 3, 2),
+        },
+        {
+            "id": 3,
+            "name": "T06",
+            "score": 2,
+            "count": 4,
+            "closed": None,
+            "admitted": datetime(2022, 3, 3, 9, 30, tzinfo=timezone.utc),
+            "day": "2022-03-03",
+        },
+    ]
+    records = [_Row.parse_obj(row).dict() for row in rows]
+
+    columns = parse_to_columns(rows, _Row)
+    assert list(columns) == list(_Row.__fields__)
+    as_records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    assert as_records == records
+    for as_record, record in zip(as_records, records):
+        assert {k: type(v) for k, v in as_record.items()} == {
+            k: type(v) for k, v in record.items()
+        }
+
+
+def test_post_mock_discharge_status_batch() -> None:
+    response = client.post(
+        "/mock/baserow/discharge_status/batch",
+        json=[{"csn": 123, "status": "ready"}, {"csn": 456, "status": "review"}],
+    )
+    assert response.status_code == 200
+
+    results = [BatchRowResult.parse_obj(row) for row in response.json()]
+    assert [r.index for r in results] == [0, 1]
+    assert all(r.ok for r in results)
+    assert results[1].row["csn"] == 456
+
+
+def test_get_mock_layout() -> None:
+    params = {"departments": "UCH T03 INTENSIVE CARE", "include_closed_beds": False}
+    response = client.get("/mock/baserow/layout", params=params)
+    assert response.status_code == 200
+
+    layout = BedLayout.parse_obj(response.json())
+    assert [d.department for d in layout.departments] == ["UCH T03 INTENSIVE CARE"]
+    assert len(layout.beds) > 0
+    assert not any(bed.closed for bed in layout.beds)
+    assert {bed.floor_y_index for bed in layout.beds} == {1}
+    x_index = sorted(bed.floor_x_index for bed in layout.beds)
+    assert x_index == list(range(1, len(layout.beds) + 1))
+
+
+def test_layout_cache_rebuilds_only_when_baserow_changes() -> None:
+    mirror = BaserowMirror()
+    mirror.load("departments", [{"id": 1, "department": "A", "floor_order": 1}])
+    mirror.load(
+        "rooms", [{"id": 1, "hl7_room": "BY01", "department": "A", "has_beds": True}]
+    )
+    bed = {"id": 1, "department": "A", "hl7_room": "BY01", "location_string": "A^1"}
+    mirror.load("beds", [{**bed, "bed_number": 1, "closed": False}])
+
+    layouts = BedLayoutCache()
+    first = layouts.get(mirror, department_names=["A"])
+    assert layouts.get(mirror, department_names=["A"]) is first
+
+    # a refresh with the same rows keeps the cached layout
+    mirror.load("beds", mirror.rows("beds"))
+    assert layouts.get(mirror, department_names=["A"]) is first
+
+    mirror.upsert("beds", [{**bed, "bed_number": 2, "closed": False}])
+    rebuilt = json.loads(layouts.get(mirror, department_names=["A"]))
+    assert [b["bed_number"] for b in rebuilt["beds"]] == [2]
+
+
+def test_layout_cache_drops_least_recently_used() -> None:
+    mirror = BaserowMirror()
+    for table in ("departments", "rooms", "beds"):
+        mirror.load(table, [])
+
+    layouts = BedLayoutCache(maxsize=2)
+    first = layouts.get(mirror, department_names=["A"])
+    layouts.get(mirror, department_names=["B"])
+    assert layouts.get(mirror, department_names=["A"]) is first
+
+    # B is now the least recently used so makes way for C
+    layouts.get(mirror, department_names=["C"])
+    assert layouts.get(mirror, department_names=["A"]) is first
+    assert set(layouts._layouts) == {
+        (None, ("A",), True),
+        (None, ("C",), True),
+    }
+
+
+def test_webhook_needs_the_shared_secret() -> None:
+    refreshed = []
+
+    class _Baserow:
+        tables_dict = {"beds": {"id": 7}}
+
+    class _Mirror:
+        async def refresh(self, baserow, table_name: str) -> None:
+            refreshed.append(table_name)
+
+    app.dependency_overrides[get_baserow_db] = _Baserow
+    app.dependency_overrides[get_baserow_mirror] = _Mirror
+    try:
+        payload = {"table_id": 7}
+        assert client.post("/baserow/webhook", json=payload).status_code == 403
+        response = client.post(
+            "/baserow/webhook", json=payload, headers={"X-Webhook-Secret": "wrong"}
+        )
+        assert response.status_code == 403
+        assert refreshed == []
+
+        response = client.post(
+            "/baserow/webhook", json=payload, headers={"X-Webhook-Secret": "hyui"}
+        )
+        assert response.json() == {"refreshed": "beds"}
+        assert refreshed == ["beds"]
+    finally:
+        app.dependency_overrides.clear()
@@ -1,10 +1,16 @@
 # type: ignore
+from datetime import datetime
+
 import pandas as pd
 
 from api import wards
+from api.census import router as census_router
 from api.census.router import _fetch_mock_census
+from api.census.snapshot import CensusSnapshot
 from api.census.wrangle import aggregate_by_department
 from api.main import app
+from api.convert import ResponseFormat
+from fastapi import Response
 from fastapi.testclient import TestClient
 
 from models.census import CensusDepartment, CensusRow
@@ -42,3 +48,129 @@ def test_get_mock_census() -> None:
 
     census_rows = [CensusRow.parse_obj(row) for row in response.json()]
     assert len(census_rows) > 0
+
+
+def test_get_mock_census_columns() -> None:
+    params = {"departments": "UCH T03 INTENSIVE CARE"}
+    records = client.get("/mock/census/", params=params).json()
+    response = client.get("/mock/census/", params={**params, "format": "columns"})
+    assert response.status_code == 200
+
+    columns = response.json()
+    assert list(columns) == list(CensusRow.__fields__)
+    assert [dict(zip(columns, values)) for values in zip(*columns.values())] == records
+
+
+def test_census_snapshot_select() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    assert not snapshot.is_ready
+
+    snapshot.update(census_rows)
+    assert snapshot.is_ready
+    assert snapshot.row_count() == len({r.location_string for r in census_rows})
+
+    department = "UCH T03 INTENSIVE CARE"
+    expected = sorted(
+        r.location_string for r in census_rows if r.department == department
+    )
+    selected = snapshot.select([department], [])
+    assert [r.location_string for r in selected] == expected
+
+
+def test_census_snapshot_select_campuses() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    snapshot.update(census_rows)
+
+    expected = _fetch_mock_census(list(wards.CAMPUSES["UCH"]), [])
+    selected = snapshot.select_campuses(["UCH"])
+    assert [r.location_string for r in selected] == sorted(
+        r.location_string for r in expected
+    )
+
+
+def test_census_snapshot_covers() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    assert not snapshot.covers(["UCH T03 INTENSIVE CARE"], [])
+
+    snapshot.update(census_rows)
+    assert snapshot.covers(["UCH T03 INTENSIVE CARE"], [])
+    assert not snapshot.covers(["NOT A WARD"], [])
+    assert not snapshot.covers([], ["NOT^A^LOCATION"])
+
+
+def test_census_snapshot_departments() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    snapshot.update(census_rows)
+
+    assert len(snapshot.departments()) > 0
+    assert all(isinstance(d, CensusDepartment) for d in snapshot.departments())
+
+
+def test_census_snapshot_merge() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    snapshot.update(census_rows, watermark=datetime(2022, 1, 1))
+
+    changed = census_rows[0].copy(update={"occupied": not census_rows[0].occupied})
+    snapshot.merge([changed], watermark=datetime(2022, 1, 2))
+
+    assert snapshot.row_count() == len({r.location_string for r in census_rows})
+    assert snapshot.watermark == datetime(2022, 1, 2)
+    merged = snapshot.select([], [changed.location_string])
+    assert merged[0].occupied == changed.occupied
+    assert snapshot.location_strings([changed.location_id]) == [changed.location_string]
+
+    # The watermark never moves backwards
+    snapshot.merge([], watermark=datetime(2021, 1, 1))
+    assert snapshot.watermark == datetime(2022, 1, 2)
+
+
+def test_census_before_first_refresh_queries_live(monkeypatch) -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    queried = []
+
+    def fetch_census(session, query, departments, locations):
+        queried.append(departments)
+        return [row for row in census_rows if row.department in departments]
+
+    monkeypatch.setattr(census_router, "_fetch_census", fetch_census)
+    snapshot = CensusSnapshot()
+
+    census_rows = census_router.get_census_by_campus(
+        response=Response(),
+        session=None,
+        snapshot=snapshot,
+        campuses=["UCH"],
+        response_format=ResponseFormat.records,
+    )
+    departments = census_router.get_departments(
+        response=Response(), session=None, snapshot=snapshot
+    )
+
+    assert len(census_rows) > 0
+    assert len(departments) > 0
+    # only the departments asked for, and the snapshot is left to the schedule
+    assert queried == [list(wards.CAMPUSES["UCH"]), list(wards.ALL)]
+    assert not snapshot.is_ready
+
+
+def test_census_snapshot_merge_after_full_refresh_is_dropped() -> None:
+    census_rows = _fetch_mock_census(list(wards.ALL), [])
+    snapshot = CensusSnapshot()
+    snapshot.update(census_rows, watermark=datetime(2022, 1, 1))
+
+    # an incremental refresh starts, then a full refresh lands before it merges
+    generation = snapshot.generation
+    stale = census_rows[0].copy(update={"occupied": not census_rows[0].occupied})
+    snapshot.update(census_rows, watermark=datetime(2022, 1, 3))
+
+    assert not snapshot.merge([stale], datetime(2022, 1, 2), generation)
+    kept = snapshot.select([], [stale.location_string])
+    assert kept[0].occupied == census_rows[0].occupied
+    assert snapshot.watermark == datetime(2022, 1, 3)
+
+    assert snapshot.merge([stale], datetime(2022, 1, 4), snapshot.generation)
@@ -1,14 +1,35 @@
 # type: ignore
+import threading
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+from api.convert import to_data_frame, to_typed_data_frame
+from api.electives.materialised import ElectivesTable
+from api.electives import router as electives_router
+from api.electives.router import (
+    _axa_codes_frame,
+    _get_mock_sql_frame,
+    _get_mock_sql_rows,
+    refresh_electives_table,
+)
+from api.electives.wrangle import prepare_draft
+from api.config import get_settings
 from api.main import app
 from fastapi.testclient import TestClient
 
 from models.electives import (
+    ClarityPostopDestination,
+    MedicalHx,
+    PreassessSummaryData,
     SurgData,
     PreassessData,
     MergedData,
     LabData,
     EchoWithAbnormalData,
     ObsData,
+    EchoData,
 )
 
 client = TestClient(app)
@@ -60,3 +81,176 @@ def test_mock_obs() -> None:
 
     rows = [ObsData.parse_obj(row) for row in response.json()]
     assert len(rows) > 0
+
+
+@pytest.mark.parametrize(
+    "table,model",
+    [("surg", SurgData), ("labs", LabData), ("echo_2", EchoWithAbnormalData)],
+)
+def test_typed_data_frame_matches_parsed_rows(table, model) -> None:
+    expected = to_data_frame(_get_mock_sql_rows(table, model), model)
+    pd.testing.assert_frame_equal(_get_mock_sql_frame(table, model), expected)
+
+
+def test_typed_data_frame_coerces_by_alias() -> None:
+    df = pd.DataFrame(
+        {
+            "PatientDurableKey": ["1", "2"],
+            "SurgicalCaseKey": [3, None],
+            "ImagingKey": [4, 5],
+            "FindingType": [None, None],
+            "NumericValue": ["1.5", None],
+            "EchoStartDate": ["2023-01-02", "2023-01-03 10:00"],
+            "EchoFinalisedDate": ["2023-01-04", "2023-01-05"],
+            "PlannedOperationStartInstant": ["2023-01-06 08:00", "2023-01-07 09:00"],
+        }
+    )
+    typed = to_typed_data_frame(df, EchoData)
+
+    assert list(typed.columns) == list(EchoData.__fields__)
+    assert typed["patient_durable_key"].tolist() == [1, 2]
+    assert typed["surgical_case_key"].iloc[1] != typed["surgical_case_key"].iloc[1]
+    assert typed["finding_type"].tolist() == [None, None]
+    assert typed["numeric_value"].iloc[0] == 1.5
+    assert typed["echo_start_date"].tolist() == [date(2023, 1, 2), date(2023, 1, 3)]
+    assert typed["planned_operation_start_instant"].dtype.kind == "M"
+
+
+def test_typed_data_frame_rejects_nulls() -> None:
+    df = pd.DataFrame({"patient_durable_key": [1, None], "value": ["a", "b"]})
+    with pytest.raises(ValueError, match="patient_durable_key"):
+        to_typed_data_frame(df, EchoData)
+
+
+def test_get_mock_electives_by_date() -> None:
+    response = client.get("/mock/electives/")
+    electives = response.json()
+
+    response = client.get(
+        "/mock/electives/by_date/",
+        params={"start_date": "2023-03-03", "end_date": "2023-03-03", "campus": "UCH"},
+    )
+    assert response.status_code == 200
+
+    rows = [MergedData.parse_obj(row) for row in response.json()]
+    assert len(rows) > 0
+    assert len(rows) == sum("UCH" in row["DepartmentName"] for row in electives)
+    assert all(row.surgery_date == date(2023, 3, 3) for row in rows)
+
+    response = client.get(
+        "/mock/electives/by_date/",
+        params={"start_date": "2023-03-04", "end_date": "2023-03-10"},
+    )
+    assert response.json() == []
+
+
+def _elective(case: int, patient: int, department: str) -> dict:
+    return {
+        "surgical_case_key": case,
+        "patient_durable_key": patient,
+        "department_name": department,
+    }
+
+
+def test_electives_table_select() -> None:
+    table = ElectivesTable()
+    day = date(2023, 3, 3)
+    next_day = date(2023, 3, 4)
+    table.update(day, [_elective(1, 10, "UCH T03"), _elective(2, 20, "GWB B-1")])
+    table.update(next_day, [_elective(3, 10, "UCH T03"), _elective(4, 30, None)])
+
+    cases = [row["surgical_case_key"] for row in table.select(day, next_day)]
+    # patient 10 once, for their earliest surgery
+    assert cases == [1, 2, 4]
+    assert [row["surgical_case_key"] for row in table.select(next_day, next_day)] == [
+        3,
+        4,
+    ]
+    assert [row["surgical_case_key"] for row in table.select(day, next_day, "UCH")] == [
+        1
+    ]
+    assert table.missing([day, next_day, date(2023, 3, 5)]) == [date(2023, 3, 5)]
+
+    # a refresh replaces the whole date, dropping cases no longer booked
+    table.update(day, [_elective(2, 20, "GWB B-1")])
+    assert [row["surgical_case_key"] for row in table.select(day, day)] == [2]
+
+    table.drop_before(next_day)
+    assert table.dates() == [next_day]
+    assert table.refreshed_at(day) is None
+
+
+MOCK_TABLES = {
+    "electives": ("surg", SurgData),
+    "preassess": ("preassess", PreassessData),
+    "labs": ("labs", LabData),
+    "echo": ("echo_2", EchoWithAbnormalData),
+    "obs": ("obs", ObsData),
+    "medical_hx": ("new_hx", MedicalHx),
+    "pod": ("pod", ClarityPostopDestination),
+    "pa_summary": ("pa_summary", PreassessSummaryData),
+}
+
+
+@pytest.mark.parametrize("empty", [list(MOCK_TABLES), ["preassess"], ["obs"]])
+def test_prepare_draft_empty_tables(empty) -> None:
+    frames = {name: _get_mock_sql_frame(*table) for name, table in MOCK_TABLES.items()}
+    for name in empty:
+        frames[name] = frames[name].iloc[:0]
+    df = prepare_draft(**frames, axa=_axa_codes_frame())
+    if "electives" in empty or "preassess" in empty:
+        # cases are only listed once preassessed
+        assert df.empty
+    else:
+        assert len(df) > 0
+
+
+def test_refresh_electives_table_empty_and_failed_days(monkeypatch) -> None:
+    today = date.today()
+
+    def query_electives(caboodle, clarity, start_date, end_date, workers):
+        if start_date == today + timedelta(days=1):
+            raise RuntimeError("Caboodle unavailable")
+        return pd.DataFrame(columns=list(MergedData.__fields__))
+
+    monkeypatch.setattr(electives_router, "query_electives", query_electives)
+    table = ElectivesTable()
+    refresh_electives_table(None, None, get_settings(), table)
+
+    days_ahead = get_settings().electives_days_ahead
+    window = [today + timedelta(days=i) for i in range(days_ahead + 1)]
+    assert table.dates() == [day for day in window if day != window[1]]
+    assert table.select(window[0], window[-1]) == []
+
+
+def test_electives_table_refreshes_a_day_once() -> None:
+    table = ElectivesTable()
+    day = date(2023, 3, 3)
+    builds = []
+
+    def build():
+        builds.append(day)
+        time.sleep(0.1)
+        return [_elective(1, 10, "UCH T03")]
+
+    threads = [
+        threading.Thread(target=table.refresh, args=(day, build, True))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert builds == [day]
+    assert len(table.select(day, day)) == 1
+
+
+def test_electives_table_keeps_cases_without_a_key() -> None:
+    table = ElectivesTable()
+    day = date(2023, 3, 3)
+    unkeyed = [{**_elective(1, 10, "UCH T03"), "surgical_case_key": None}]
+    unkeyed.append({**_elective(2, 11, "UCH T03"), "surgical_case_key": None})
+
+    table.update(day, [_elective(3, 12, "UCH T03"), *unkeyed])
+    assert len(table.select(day, day)) == 3
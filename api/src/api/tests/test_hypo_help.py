@@ -0,0 +1,384 @@
+# type: ignore
+import re
+import string
+
+import numpy as np
+import pandas as pd
+import pytest
+import api.electives.hypo_help as hypo_help
+from api.electives.hypo_help import (
+    _ICD_CHAPTERS,
+    _first_pasp,
+    _first_percent,
+    generate_icu_binary_from_emap,
+    icd_chapter,
+    j_wrangle_echo,
+    visit_sequence,
+    wrangle_hx,
+    wrangle_labs,
+)
+from api.electives.router import _get_mock_sql_frame
+from models.electives import LabData, MedicalHx
+
+LAB_NAMES = {
+    "na": "Sodium",
+    "crea": "Creatinine",
+    "wcc": "White cell count",
+    "hb": "Haemoglobin (g/L)",
+    "plt": "Platelet count",
+    "alb": "Albumin",
+    "bili": "Bilirubin (total)",
+    "inr": "INR",
+    "crp": "C-reactive protein",
+}
+
+
+def _row_by_row_labs(labs: pd.DataFrame) -> pd.DataFrame:
+    """wrangle_labs as it was, with a transform per lab per patient"""
+    limits = {
+        "crea": (49, 112),
+        "hb": (115, 170),
+        "wcc": (3, 10),
+        "plt": (150, 400),
+        "na": (135, 145),
+        "alb": (34, 50),
+        "crp": (0, 5),
+        "bili": (0, 20),
+        "inr": (0.8, 1.3),
+    }
+    ops = {
+        "mean": "_mean_value",
+        "min": "_min_value",
+        "max": "_max_value",
+        "count": "_measured_count",
+    }
+    df = labs.copy()
+    df.loc[:, "value"] = pd.to_numeric(
+        df["value"].str.replace("<|(result checked)", "", regex=True),
+        errors="coerce",
+    ).dropna()
+    df["name"] = df["name"].replace({v: k for k, v in LAB_NAMES.items()})
+    df = df.join(df.pivot(columns="name", values="value"))
+    for key in LAB_NAMES:
+        by_patient = df[key].groupby(df["patient_durable_key"])
+        df[key + "_abnormal_count"] = by_patient.transform(
+            lambda x: x > limits[key][1]
+        ) | by_patient.transform(lambda x: x < limits[key][0])
+        for op in ops:
+            df[key + ops[op]] = by_patient.transform(op)
+    gdf = df.groupby("patient_durable_key").sum(numeric_only=True)
+    gdf = gdf.loc[:, gdf.columns.str.contains("_abnormal")]
+    hdf = df.groupby("patient_durable_key").mean(numeric_only=True)
+    hdf = hdf.loc[:, hdf.columns.str.contains("_m")]
+    idf = df.sort_values("result_instant").groupby("patient_durable_key").last()
+    idf = idf.loc[:, list(LAB_NAMES)]
+    return gdf.join(hdf).join(idf.add_suffix("_last_value")).reset_index()
+
+
+def _labs(n: int = 2000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    values = ["<5", "12 (result checked)", "abc", None] + [
+        f"{v:.1f}" for v in rng.normal(100, 60, 20)
+    ]
+    return pd.DataFrame(
+        {
+            "patient_durable_key": rng.integers(0, 150, n),
+            "surgical_case_key": 1,
+            "name": rng.choice([*LAB_NAMES.values(), "Potassium"], n),
+            "planned_operation_start_instant": pd.Timestamp("2023-01-01"),
+            "value": rng.choice(np.array(values, dtype=object), n),
+            "result_instant": pd.Timestamp("2022-01-01")
+            + pd.to_timedelta(rng.permutation(n), unit="min"),
+        }
+    )
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_wrangle_labs_matches_row_by_row(seed) -> None:
+    labs = _labs(seed=seed)
+    pd.testing.assert_frame_equal(wrangle_labs(labs), _row_by_row_labs(labs))
+
+
+def test_wrangle_labs_mock() -> None:
+    labs = _get_mock_sql_frame("labs", LabData)
+    pd.testing.assert_frame_equal(wrangle_labs(labs), _row_by_row_labs(labs))
+
+
+def test_wrangle_labs_without_some_labs() -> None:
+    labs = _labs()
+    labs = labs[labs["name"] != "INR"]
+    wrangled = wrangle_labs(labs)
+    assert wrangled["inr_measured_count"].eq(0).all()
+    assert wrangled["inr_mean_value"].isna().all()
+
+
+def _row_by_row_icd_chapter(code) -> str | None:
+    if not isinstance(code, str):
+        return None
+    for first, last, chapter in _ICD_CHAPTERS:
+        if first <= code[:3] <= last:
+            return chapter
+    return None
+
+
+def test_icd_chapter_matches_linear_scan() -> None:
+    codes = pd.Series(
+        [
+            a + b + c + ".1"
+            for a in string.ascii_uppercase
+            for b in string.digits
+            for c in string.digits
+        ]
+        + ["A", "Z9", "a00", "D49.9", None]
+    )
+    expected = [_row_by_row_icd_chapter(code) for code in codes]
+    assert icd_chapter(codes).tolist() == expected
+
+
+def test_wrangle_hx_mock() -> None:
+    hx = _get_mock_sql_frame("new_hx", MedicalHx)
+    counts = wrangle_hx(hx)
+    assert counts.to_numpy().sum() == (hx["value"] != "#NC").sum()
+
+
+COMMENTS = [
+    "EF 25%",
+    "EF 40-45% est",
+    "EF 60 % and 20%",
+    "% only",
+    "no number",
+    "PASP 65 mmHg",
+    "systolic pressure 3.5 then 45.2",
+    "PASP 5, 12.5 and 70",
+    "PASP 90",
+    "1",
+    "moderate",
+    "severe",
+    "decreased",
+]
+
+
+def _row_by_row_percent(comment: str) -> float:
+    found = re.findall(r"\d*[%]", comment)
+    number = found[0].replace("%", "") if found else ""
+    return float(number) if number.strip() else np.nan
+
+
+def _row_by_row_pasp(comment: str) -> float:
+    if "PASP" not in comment and "systolic pressure" not in comment:
+        return np.nan
+    numbers = [float(i) for i in re.findall(r"\d*\.?\d+", comment)]
+    return next((x for x in numbers if 8 < x < 80), np.nan)
+
+
+def test_echo_comment_numbers_match_row_by_row() -> None:
+    comments = pd.Series(COMMENTS)
+    np.testing.assert_array_equal(
+        _first_percent(comments), comments.map(_row_by_row_percent)
+    )
+    np.testing.assert_array_equal(_first_pasp(comments), comments.map(_row_by_row_pasp))
+
+
+def test_j_wrangle_echo() -> None:
+    comments = {
+        1: ("Left Ventricle", "Comment", "EF 25%"),
+        2: ("Left Ventricle", "ejection fraction comments", "EF 60 % and 20%"),
+        3: ("Pulmonary Hypertension", "pulmonary hypertension", "PASP 65 mmHg"),
+        4: ("Pulmonary Hypertension", "pulmonary hypertension", "PASP 5 and 45"),
+    }
+    echo = pd.DataFrame(
+        [
+            {
+                "patient_durable_key": key,
+                "surgical_case_key": key,
+                "imaging_key": key,
+                "finding_type": finding_type,
+                "finding_name": finding_name,
+                "string_value": comment,
+                "numeric_value": None,
+                "unit": None,
+                "echo_start_date": pd.Timestamp("2022-01-01"),
+                "echo_finalised_date": pd.Timestamp("2022-01-02"),
+                "planned_operation_start_instant": pd.Timestamp("2023-01-01"),
+            }
+            for key, (finding_type, finding_name, comment) in comments.items()
+        ]
+    )
+    wrangled = j_wrangle_echo(echo).set_index("surgical_case_key").sort_index()
+    assert wrangled["lv_function_abnormal"].tolist() == [1, 0, 0, 0]
+    assert wrangled["pulm_htn"].tolist() == [0, 0, 1, 0]
+
+
+def test_visit_sequence() -> None:
+    visits = pd.DataFrame(
+        {
+            "visit": [1, 1, 2, 1],
+            "name": ["b", "a", "x", "c"],
+            "admission_time": [2, 1, 1, 3],
+        }
+    )
+    sequenced = visit_sequence(
+        visits,
+        by=["visit"],
+        order=["admission_time"],
+        shifts={"prev": ("name", 1), "next": ("name", -1)},
+    )
+    assert sequenced["name"].tolist() == ["a", "x", "b", "c"]
+    assert sequenced["prev"].fillna("").tolist() == ["", "", "a", "b"]
+    assert sequenced["next"].fillna("").tolist() == ["b", "", "c", ""]
+    assert "prev" not in visits
+
+
+def _location_visit(name, location_id, lv_id, start, minutes) -> dict:
+    admission = pd.Timestamp("2022-03-01 08:00", tz="UTC") + pd.Timedelta(minutes=start)
+    discharge = admission + pd.Timedelta(minutes=minutes)
+    return {
+        "hospital_visit_id": 1,
+        "location_visit_id": lv_id,
+        "location_id": location_id,
+        "name": name,
+        "admission_time": admission,
+        "discharge_time": discharge,
+        "duration": discharge - admission,
+    }
+
+
+def test_generate_icu_binary_merges_split_theatre_visits() -> None:
+    theatre = "UCH P03 THEATRE SUITE"
+    visits = pd.DataFrame(
+        [
+            _location_visit("UCH T09 NORTH", 10, 1, -600, 590),
+            # one operation recorded as two theatre visits 5 minutes apart
+            _location_visit(theatre, 1, 2, 0, 60),
+            _location_visit(theatre, 1, 3, 65, 120),
+            _location_visit("UCH T03 INTENSIVE CARE", 11, 4, 200, 2000),
+        ]
+    )
+    theatre_visits = generate_icu_binary_from_emap(visits)
+
+    assert len(theatre_visits) == 1
+    merged = theatre_visits.iloc[0]
+    # the longest of the two
+    assert merged["location_visit_id"] == 3
+    assert merged["prev_ward"] == "UCH T09 NORTH"
+    assert merged["next_ward"] == "UCH T03 INTENSIVE CARE"
+    assert merged["duration_hours"] == pytest.approx(185 / 60)
+    assert merged["ICU_binary"] == 1
+
+
+NAMES = {
+    "UCH T09 NORTH": 10,
+    "UCH T07 SOUTH": 12,
+    "UCH T06 SOUTH PACU": 13,
+    "UCH T03 INTENSIVE CARE": 11,
+    "UCH P03 THEATRE SUITE": 1,
+    "GWB B-1 THEATRE SUITE": 2,
+}
+
+
+def _location_visits(n: int = 40, seed: int = 0) -> pd.DataFrame:
+    """
+    n hospital visits through random wards, with some theatre visits split
+    in two a few minutes apart and some visits admitted at the same time
+    """
+    rng = np.random.default_rng(seed)
+    names = list(NAMES)
+    rows = []
+    for hospital_visit_id in range(n):
+        start = int(rng.integers(-600 * 24 * 60, 0, endpoint=True))
+        for _ in range(rng.integers(2, 7)):
+            name = names[rng.integers(len(names))]
+            minutes = int(rng.integers(10, 600))
+            rows.append(
+                _location_visit(name, NAMES[name], len(rows), start, minutes)
+                | {"hospital_visit_id": hospital_visit_id}
+            )
+            if "THEATRE" in name and rng.random() < 0.5:
+                start += minutes + int(rng.integers(1, 20))
+                minutes = int(rng.integers(10, 300))
+                rows.append(
+                    _location_visit(name, NAMES[name], len(rows), start, minutes)
+                    | {"hospital_visit_id": hospital_visit_id}
+                )
+            # sometimes the next visit is admitted at the same time
+            if rng.random() > 0.2:
+                start += minutes + int(rng.integers(0, 120))
+    return pd.DataFrame(rows).sample(frac=1, random_state=seed)
+
+
+def _apply_visit_sequence(visits, by, order, shifts) -> pd.DataFrame:
+    # what visit_sequence replaced: a groupby.apply(assign) for each column.
+    # That sorted ties (old=True only sorts by admission_time) in whatever
+    # order quicksort left them, which could differ between columns, so keep
+    # them in their existing order as visit_sequence does.
+    for name, (column, periods) in shifts.items():
+        visits = (
+            visits.sort_values(order, kind="stable")
+            .groupby(by, group_keys=False)
+            .apply(lambda x: x.assign(**{name: x[column].shift(periods)}))
+        )
+    return visits
+
+
+def _apply_merge_split_visits(visits, by) -> pd.DataFrame:
+    # what merge_split_visits replaced
+    visits = (
+        visits.sort_values("admission_time")
+        .groupby(by, group_keys=False)
+        .apply(lambda x: x.assign(min_adm_dt64=x["adm_datetime_dt64"].min()))
+    )
+    visits["min_adm_time"] = visits["min_adm_dt64"].astype(str)
+    visits = (
+        visits.sort_values("admission_time")
+        .groupby(by, group_keys=False)
+        .apply(lambda x: x.assign(max_disch_dt64=x["disch_datetime_dt64"].max()))
+    )
+    visits["max_disch_time"] = visits["max_disch_dt64"].astype(str)
+    longest = visits.groupby(by)["duration_hours"].idxmax()
+    visits["longest_adm"] = visits.index.isin(longest).astype(int)
+    visits = (
+        visits.sort_values("admission_time")
+        .groupby(by, group_keys=False)
+        .apply(
+            lambda x: x.assign(
+                lv_id_longest_adm=x.loc[x["longest_adm"] == 1, ["location_visit_id"]]
+            )
+        )
+    )
+    visits["lv_id_longest_adm"] = visits["lv_id_longest_adm"].fillna(
+        visits.groupby(by)["lv_id_longest_adm"].transform("max")
+    )
+    group_columns = {
+        "prev_ward_group": ("prev_ward", "first"),
+        "next_ward_group": ("next_ward", "last"),
+        "next_ward_duration_group": ("ward_after_theatre_duration_hours", "last"),
+        "prev_ward_2_group": ("prev_ward2", "first"),
+        "ICU_PACU_prev_ward_group": ("ICU_PACU_prev_ward", "first"),
+        "ICU_PACU_next_ward_group": ("ICU_PACU_next_ward", "last"),
+        "icu_pacu_duration_hours_group": ("icu_pacu_duration_hours", "last"),
+    }
+    for name, (column, how) in group_columns.items():
+        visits[name] = (
+            visits.sort_values("admission_time").groupby(by)[column].transform(how)
+        )
+    return visits
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("old", [False, True])
+def test_generate_icu_binary_matches_apply(monkeypatch, seed, old) -> None:
+    visits = _location_visits(seed=seed)
+    theatre_visits = generate_icu_binary_from_emap(visits.copy(), old=old)
+
+    monkeypatch.setattr(hypo_help, "visit_sequence", _apply_visit_sequence)
+    monkeypatch.setattr(hypo_help, "merge_split_visits", _apply_merge_split_visits)
+    expected = generate_icu_binary_from_emap(visits.copy(), old=old)
+
+    # the synthetic visits do have split theatre visits to merge
+    assert theatre_visits["location_visit_id"].duplicated().sum() == 0
+    assert len(theatre_visits) < len(visits[visits["name"].str.contains("THEATRE")])
+    pd.testing.assert_frame_equal(
+        theatre_visits.sort_values("location_visit_id").reset_index(drop=True),
+        expected.sort_values("location_visit_id").reset_index(drop=True),
+        check_dtype=False,
+    )
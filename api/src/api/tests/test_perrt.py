@@ -1,9 +1,35 @@
 # type: ignore
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+import pickle
+
+import numpy as np
 import pandas as pd
+import pytest
 from fastapi.testclient import TestClient
 
 import api.perrt.wrangle as wng
 from api.main import app
+from api.perrt.admission_probability.features import (
+    agg_feature_names,
+    aggregate_features,
+)
+from api.perrt.admission_probability import functions
+from api.perrt.admission_probability.functions import (
+    FlexibleSqlQuery,
+    linear_slope,
+    run_pipeline,
+)
+from api.perrt.admission_probability.model_registry import ModelRegistry
+from api.perrt.admission_probability.predictions_script import get_predictions
+from api.perrt.admission_probability.predictions_store import (
+    PredictionsStore,
+    get_predictions_executor,
+    get_predictions_store,
+    run_in_predictions_executor,
+)
+from api.perrt.router import PREDICTIONS_GENERATION_HEADER
 from models.perrt import (
     EmapVitalsLong,
     EmapVitalsWide,
@@ -66,3 +92,219 @@ def test_wrangle() -> None:
     pd.testing.assert_series_equal(
         df_r["news_scale_1_max"], pd.Series([1.0, 2.0]), check_names=False
     )
+
+
+def _aggregate_features_per_column(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    """The per column groupby that aggregate_features replaced"""
+    res = pd.DataFrame(
+        np.nan,
+        columns=agg_feature_names(cols),
+        index=df["hospital_visit_id"].unique(),
+    )
+    for colname in cols:
+        res.loc[
+            :, [f"{p}_{colname}" for p in ("Mean", "Slope", "R", "Count", "Last")]
+        ] = df.groupby("hospital_visit_id").agg(
+            **{
+                f"Mean_{colname}": pd.NamedAgg(colname, aggfunc=np.mean),
+                f"Slope_{colname}": pd.NamedAgg(
+                    colname, aggfunc=lambda x: linear_slope(x, returns="slope")
+                ),
+                f"R_{colname}": pd.NamedAgg(
+                    colname, aggfunc=lambda x: linear_slope(x, returns="r value")
+                ),
+                f"Count_{colname}": pd.NamedAgg(colname, aggfunc="count"),
+                f"Last_{colname}": pd.NamedAgg(colname, aggfunc="last"),
+            }
+        )
+    return res
+
+
+def test_aggregate_features_matches_linear_slope() -> None:
+    rng = np.random.default_rng(42)
+    n_rows = 500
+    df = pd.DataFrame(
+        {
+            "hospital_visit_id": rng.integers(0, 60, n_rows),
+            "Heart_Rate": rng.normal(80, 15, n_rows),
+            "NEWS_Score": rng.integers(0, 10, n_rows).astype(float),
+            "Constant": np.full(n_rows, 0.1),
+            "Empty": np.full(n_rows, np.nan),
+        }
+    )
+    df.loc[rng.random(n_rows) < 0.4, ["Heart_Rate", "Constant"]] = np.nan
+    df.loc[rng.random(n_rows) < 0.2, "NEWS_Score"] = np.nan
+    cols = ["Heart_Rate", "NEWS_Score", "Constant", "Empty"]
+
+    expected = _aggregate_features_per_column(df, cols)
+    res = pd.DataFrame(
+        np.nan, columns=expected.columns, index=df["hospital_visit_id"].unique()
+    )
+    res.loc[:, agg_feature_names(cols)] = aggregate_features(df, cols)
+
+    pd.testing.assert_frame_equal(res, expected, check_exact=False, rtol=1e-9)
+
+
+def test_predictions_store_swap() -> None:
+    store = PredictionsStore()
+    assert store.get([1]) == {"1": None}
+    assert store.generated_at is None
+
+    assert store.swap({"1": 0.5}) == 1
+    assert store.swap({"2": 0.25}) == 2
+    assert store.get([1, 2]) == {"1": None, "2": 0.25}
+    assert store.generated_at is not None
+
+
+def test_predictions_executor_replaces_dead_worker() -> None:
+    broken = get_predictions_executor()
+    with pytest.raises(BrokenProcessPool):
+        # the worker exits as if killed
+        asyncio.run(run_in_predictions_executor(os._exit, 1))
+
+    assert get_predictions_executor() is not broken
+    assert asyncio.run(run_in_predictions_executor(abs, -1)) == 1
+
+
+def test_icu_admission_prediction_serves_store() -> None:
+    generation = get_predictions_store().swap({"555719": 0.85})
+    response = client.get(
+        "/perrt/icu_admission_prediction",
+        params={"hospital_visit_ids": [555719, 1]},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"555719": 0.85, "1": None}
+    assert response.headers[PREDICTIONS_GENERATION_HEADER] == str(generation)
+
+
+def test_model_registry_reloads_on_change(tmp_path) -> None:
+    path = tmp_path / "model.pkl"
+    path.write_bytes(pickle.dumps({"version": 1}))
+    registry = ModelRegistry(path)
+
+    first = registry.get()
+    assert first == {"version": 1}
+    assert registry.get() is first
+
+    path.write_bytes(pickle.dumps({"version": 2}))
+    mtime_ns = path.stat().st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    assert registry.get() == {"version": 2}
+
+
+def test_observations_query_visit_filter() -> None:
+    everyone = FlexibleSqlQuery("24 HOURS")
+    everyone.observations("NOW()")
+    assert "ob.hospital_visit_id = ANY" not in everyone()
+    assert everyone.params == {}
+
+    some = FlexibleSqlQuery("24 HOURS")
+    some.observations("NOW()", hv_ids=[3, 1, 3])
+    assert "AND ob.hospital_visit_id = ANY(%(hv_ids)s)" in some()
+    assert some.params == {"hv_ids": [1, 3]}
+
+    # still valid SQL, matching no visits
+    none = FlexibleSqlQuery("24 HOURS")
+    none.observations("NOW()", hv_ids=[])
+    assert none.params == {"hv_ids": []}
+
+
+def test_others_query_binds_hv_ids() -> None:
+    query = FlexibleSqlQuery("72 HOURS")
+    query.others("labs", "NOW()", np.array([3, 1, 3]))
+    assert "= ANY(:hv_ids)" in query()
+    assert query.params == {"hv_ids": [1, 3]}
+
+
+def test_get_mock_icu_admission_prediction_score() -> None:
+    response = client.post(
+        "/mock/perrt/icu_admission_prediction/score", json=[555719, 1]
+    )
+    assert response.status_code == 200
+    assert response.json() == {"555719": 0.85, "1": None}
+
+
+def _single_visit_obs(now: pd.Timestamp) -> pd.DataFrame:
+    # no oxygen, pressure area or lab columns and a known ethnicity
+    vitals = {"Pulse": 90.0, "Resp": 18.0, "SpO2": 96.0, "NEWS Score": 6.0}
+    rows = [
+        {
+            "hospital_visit_id": 1,
+            "observation_datetime": now - pd.Timedelta(hours=hours),
+            "value_as_text": "120/70" if vital == "BP" else None,
+            "value_as_real": value,
+            "vital": vital,
+            "location_string": "T09S^T09S-32^BY01-08",
+            "age_at_obs": 70,
+            "mrn": "40800000",
+            "ethnicity": "White British",
+            "sex": "F",
+            "bed": "BY01-08",
+            "ward_raw": "T09S",
+            "building": "tower",
+            "bed_type": "bay",
+            "icu_admission": 0,
+            "hospital_discharge_dt": None,
+        }
+        for hours in (1, 3)
+        for vital, value in {**vitals, "BP": np.nan}.items()
+    ]
+    return pd.DataFrame(rows)
+
+
+def _single_visit_others(query: FlexibleSqlQuery, now: pd.Timestamp) -> pd.DataFrame:
+    if "dnacpr" in query.query:
+        refs = ["surg_ref", "med_ref", "og_ref", "haem_onc_ref", "ortho_ref"]
+        others = {
+            "hospital_visit_id": 1,
+            "admission_datetime": now - pd.Timedelta(days=2),
+            **{ref: None for ref in refs},
+            "med_ref": now - pd.Timedelta(days=1),
+        }
+        others.update(
+            {
+                column: None
+                for column in [
+                    "dnacpr",
+                    "first_ward",
+                    "recent_surgery",
+                    "ever_surgery",
+                    "since_surgery",
+                    "recent_icu",
+                    "time_since_perrt_ref",
+                ]
+            }
+        )
+        return pd.DataFrame([others])
+    if "lab_test_definition" in query.query:
+        columns = ["test_lab_code", "valid_from", "value_as_real", "value_as_text"]
+    else:
+        columns = ["name", "valid_from"]
+    return pd.DataFrame(columns=["hospital_visit_id", *columns])
+
+
+def test_run_pipeline_single_visit(monkeypatch) -> None:
+    now = pd.Timestamp.now().floor("min")
+    monkeypatch.setattr(
+        functions.pd, "read_sql", lambda query, engine, params: _single_visit_obs(now)
+    )
+    monkeypatch.setattr(
+        FlexibleSqlQuery, "read", lambda query, engine: _single_visit_others(query, now)
+    )
+
+    dataset, *_, acuity = run_pipeline([now.date()], None, now=True)
+    assert len(dataset) == 1
+    # worked out from the visit itself
+    assert acuity.loc["T09S"].tolist() == [6.0, 1.0]
+
+    full_run = pd.DataFrame(
+        {"average_ward_NEWS": [2.5], "ward_NEWS_over_5": [3.0]}, index=["T09S"]
+    )
+    dataset, *_ = run_pipeline(
+        [now.date()], None, now=True, hospital_visit_ids=[1], ward_acuity=full_run
+    )
+    assert dataset.loc[1, ["average_ward_NEWS", "ward_NEWS_over_5"]].tolist() == [
+        2.5,
+        3.0,
+    ]
+    assert 0 <= get_predictions(dataset)["1"] <= 1
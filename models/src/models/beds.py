@@ -10,6 +10,21 @@ class DischargeStatus(BaseModel):
     modified_at: datetime
 
 
+class DischargeStatusUpdate(BaseModel):
+    csn: int
+    status: str
+
+
+class BatchRowResult(BaseModel):
+    """Outcome for one row of a batch write (index is its position in the
+    request)"""
+
+    index: int
+    ok: bool
+    row: dict | None
+    error: str | None
+
+
 class Bed(BaseModel):
     id: int
     location_name: str | None
@@ -57,3 +72,31 @@ class Room(BaseModel):
     is_sideroom: bool | None
     has_beds: bool | None
     closed: bool | None
+
+
+class BedUpdate(BaseModel):
+    """Fields to change on a bed; only those set are sent to baserow"""
+
+    id: int
+    closed: bool | None
+    blocked: bool | None
+    covid: bool | None
+
+
+class LayoutRoom(Room):
+    hl7_department: str | None
+
+
+class LayoutBed(Bed):
+    is_sideroom: bool | None
+    floor_order: int | None
+    floor_y_index: int | None
+    floor_x_index: float | None
+
+
+class BedLayout(BaseModel):
+    """Open departments, rooms and beds positioned for the bed map"""
+
+    departments: list[Department]
+    rooms: list[LayoutRoom]
+    beds: list[LayoutBed]
@@ -51,6 +51,12 @@ class CensusDepartment(BaseModel):
     modified_at: datetime
 
 
+class CensusSnapshotStatus(BaseModel):
+    refreshed_at: datetime | None
+    age_seconds: float | None
+    rows: int
+
+
 class ClosedBed(BaseModel):
     department: str
     closed: bool
@@ -1,6 +1,5 @@
 from pathlib import Path
 from web.config import get_settings
-from web import ids as web_ids
 from web.pages.ed import ids as ed_ids
 
 FONTS_GOOGLE = "https://fonts.googleapis.com/css2?family=Inter:wght@100;200;300;400;500;900&display=swap"
@@ -12,10 +11,6 @@ with Path(__file__).parent / "index.html" as f:
 # Pass either strings or functions
 API_URLS = {
     "campus_url": "http://api:8000/baserow/campus?campuses=uclh",
-    web_ids.DEPT_STORE: f"{get_settings().api_url}/baserow/departments/",
-    web_ids.ROOM_STORE: f"{get_settings().api_url}/baserow/rooms/",
-    web_ids.BEDS_STORE: f"{get_settings().api_url}/baserow/beds/",
-    web_ids.ELECTIVES_STORE: f"{get_settings().api_url}/electives/",
     ed_ids.PATIENTS_STORE: f"{get_settings().api_url}/ed/individual/",
     ed_ids.AGGREGATE_STORE: f"{get_settings().api_url}/ed/aggregate/",
 }
@@ -69,11 +69,13 @@ app.config.suppress_callback_exceptions = True
 # expose application's object server so wsgi server can access it
 server = app.server
 
-# run celery startup tasks
-run_startup_tasks()
+# NOTE: the celery worker imports this module too (to register the background
+# callbacks) so the startup tasks are run by gunicorn's when_ready hook
+# rather than here
 
 
 if __name__ == "__main__":
     logger.info("Running with the local dash development server")
+    run_startup_tasks()
     debug = True if get_settings().debug else False
     app.run_server(host="0.0.0.0", port=get_settings().development_port, debug=debug)
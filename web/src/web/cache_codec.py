@@ -0,0 +1,68 @@
+"""
+Encoding of the values held in the redis cache
+
+Values are orjson bytes behind a one byte header naming the format. Values
+over COMPRESS_THRESHOLD bytes (e.g. electives or a whole campus census) are
+compressed with zlib. Values written before the header was introduced are
+plain orjson and are still read.
+
+Running totals of the bytes before and after encoding are kept in redis
+under CODEC_METRICS_KEY (see codec_metrics).
+"""
+import zlib
+from typing import Any, Callable
+
+import orjson
+from redis import Redis
+from redis.client import Pipeline
+
+# smaller values are not worth the CPU to compress
+COMPRESS_THRESHOLD = 16 * 1024
+CODEC_METRICS_KEY = "cache_codec:metrics"
+
+# first byte of an encoded value; orjson never starts with any of these
+ORJSON = b"\x01"
+ORJSON_ZLIB = b"\x02"
+
+_DECOMPRESS: dict[bytes, Callable[[bytes], bytes]] = {
+    ORJSON: bytes,
+    ORJSON_ZLIB: zlib.decompress,
+}
+
+
+def pack(payload: bytes, threshold: int = COMPRESS_THRESHOLD) -> bytes:
+    """Header and (if over threshold bytes) compress orjson bytes"""
+    if len(payload) > threshold:
+        return ORJSON_ZLIB + zlib.compress(payload, 1)
+    return ORJSON + payload
+
+
+def unpack(value: bytes) -> bytes:
+    """The orjson bytes from a value written by pack (or before it existed)"""
+    decompress = _DECOMPRESS.get(value[:1])
+    if decompress is None:
+        return value
+    return decompress(value[1:])
+
+
+def dumps(data: Any) -> bytes:
+    return pack(orjson.dumps(data))
+
+
+def loads(value: bytes) -> Any:
+    return orjson.loads(unpack(value))
+
+
+def record_metrics(pipe: Pipeline, payload: bytes, packed: bytes) -> None:
+    """Queue the update of the running totals for one value on a pipeline"""
+    pipe.hincrby(CODEC_METRICS_KEY, "values", 1)
+    pipe.hincrby(CODEC_METRICS_KEY, "raw_bytes", len(payload))
+    pipe.hincrby(CODEC_METRICS_KEY, "stored_bytes", len(packed))
+
+
+def codec_metrics(redis: Redis) -> dict[str, int]:
+    """Values written and their bytes before/after encoding, and the saving"""
+    metrics = {k.decode(): int(v) for k, v in redis.hgetall(CODEC_METRICS_KEY).items()}
+    saved_bytes = metrics.get("raw_bytes", 0) - metrics.get("stored_bytes", 0)
+    metrics["saved_bytes"] = saved_bytes
+    return metrics
@@ -0,0 +1,109 @@
+"""
+The API requests the pages make through requests_try_cache
+
+The page callbacks build their requests here so that warm_up_plan can list
+every request they can make (one per campus, the ALL_ICUS view, ...) with
+exactly the same url and params, and so the same cache key. The plan is
+run every minute by the warm_cache task (see web.celery_config) which
+refreshes each request shortly before it would go stale, so the pages
+normally find what they ask for already cached.
+"""
+from datetime import date, timedelta
+from typing import NamedTuple, Optional
+
+from web import SITREP_DEPT2WARD_MAPPING
+from web.config import get_settings
+from web.pages.electives import CAMPUSES as ELECTIVES_CAMPUSES
+from web.pages.electives import DEFAULT_DAYS as ELECTIVES_DEFAULT_DAYS
+from web.pages.perrt import CAMPUSES as PERRT_CAMPUSES
+from web.pages.sitrep import CAMPUSES as SITREP_CAMPUSES
+
+# layouts are cheap for the API to serve so are kept briefly to pick up bed
+# closures
+LAYOUT_EXPIRES = 300
+# the API refreshes today's electives every 15 minutes
+ELECTIVES_EXPIRES = 15 * 60
+
+
+class CachedRequest(NamedTuple):
+    url: str
+    params: Optional[dict] = None
+    expires: Optional[int] = None
+
+
+def _campus_label(campuses: list[dict], campus: str) -> str:
+    return next(i.get("label") for i in campuses if i.get("value") == campus)
+
+
+def sitrep_census_request(dept_grouper: str) -> CachedRequest:
+    """Census for ALL_ICUS or a campus (by its CAMPUSES value)"""
+    if dept_grouper == "ALL_ICUS":
+        return CachedRequest(
+            f"{get_settings().api_url}/census/",
+            {"departments": list(SITREP_DEPT2WARD_MAPPING.keys()), "format": "columns"},
+        )
+    return CachedRequest(
+        f"{get_settings().api_url}/census/campus/",
+        {"campuses": _campus_label(SITREP_CAMPUSES, dept_grouper), "format": "columns"},
+    )
+
+
+def sitrep_layout_request(dept_grouper: str) -> CachedRequest:
+    """Bed layout for ALL_ICUS or a campus (by its CAMPUSES value)"""
+    if dept_grouper == "ALL_ICUS":
+        params = {"departments": list(SITREP_DEPT2WARD_MAPPING.keys())}
+    else:
+        params = {"location_name": dept_grouper}
+    return CachedRequest(
+        f"{get_settings().api_url}/baserow/layout", params, LAYOUT_EXPIRES
+    )
+
+
+def perrt_census_request(campus: str) -> CachedRequest:
+    return CachedRequest(
+        f"{get_settings().api_url}/census/campus/",
+        {"campuses": _campus_label(PERRT_CAMPUSES, campus), "format": "columns"},
+    )
+
+
+def perrt_layout_request(campus: str) -> CachedRequest:
+    """Bed layout for a campus without its closed beds"""
+    return CachedRequest(
+        f"{get_settings().api_url}/baserow/layout",
+        {"location_name": campus, "include_closed_beds": "false"},
+        LAYOUT_EXPIRES,
+    )
+
+
+def electives_request(campus: str, dates: Optional[list] = None) -> CachedRequest:
+    """
+    Electives for a campus (by its CAMPUSES value) with surgery dates in the
+    date picker's range, or all the dates the API holds if there is none
+    """
+    params = {"campus": _campus_label(ELECTIVES_CAMPUSES, campus)}
+    if dates:
+        # the picker's dates may come back with a time
+        params["start_date"], params["end_date"] = (str(d)[:10] for d in dates)
+    return CachedRequest(
+        f"{get_settings().api_url}/electives/by_date/", params, ELECTIVES_EXPIRES
+    )
+
+
+def warm_up_plan() -> list[CachedRequest]:
+    """
+    Every request above for every value of the page selectors (and for the
+    electives, the date picker's default range)
+    """
+    sitrep_groupers = ["ALL_ICUS", *(i["value"] for i in SITREP_CAMPUSES)]
+    perrt_campuses = [i["value"] for i in PERRT_CAMPUSES]
+    electives_dates = [date.today(), date.today() + timedelta(ELECTIVES_DEFAULT_DAYS)]
+
+    plan = [
+        *(sitrep_census_request(i) for i in sitrep_groupers),
+        *(sitrep_layout_request(i) for i in sitrep_groupers),
+        *(perrt_census_request(i) for i in perrt_campuses),
+        *(perrt_layout_request(i) for i in perrt_campuses),
+        *(electives_request(i["value"], electives_dates) for i in ELECTIVES_CAMPUSES),
+    ]
+    # the sitrep and PERRT campus census requests are the same
+    return list({(r.url, repr(r.params)): r for r in plan}.values())
@@ -1,3 +1,5 @@
+import hashlib
+
 from web.config import get_settings
 from web.pages.demo import slow_url
 from web import API_URLS, SITREP_DEPT2WARD_MAPPING
@@ -31,42 +33,6 @@ beat_schedule = {
         ),
         "kwargs": {"expires": (12 * 3600) + 60},  # 12 hours + 1 minute
     },
-    web_ids.DEPT_STORE: {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute=0, hour=0),  # daily at midnight
-        "args": (
-            API_URLS[web_ids.DEPT_STORE],
-            web_ids.DEPT_STORE,
-        ),
-        "kwargs": {"expires": (24 * 3600) + 60},  # 24 hours + 1 minute
-    },
-    web_ids.ROOM_STORE: {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute=0, hour=0),  # daily at midnight
-        "args": (
-            API_URLS[web_ids.ROOM_STORE],
-            web_ids.ROOM_STORE,
-        ),
-        "kwargs": {"expires": (24 * 3600) + 60},  # 24 hours + 1 minute
-    },
-    web_ids.BEDS_STORE: {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute=0, hour=0),  # daily at midnight
-        "args": (
-            API_URLS[web_ids.BEDS_STORE],
-            web_ids.BEDS_STORE,
-        ),
-        "kwargs": {"expires": (24 * 3600) + 60},  # 24 hours + 1 minute
-    },
-    web_ids.ELECTIVES_STORE: {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute=0, hour=0),  # daily at midnight
-        "args": (
-            API_URLS[web_ids.ELECTIVES_STORE],
-            web_ids.ELECTIVES_STORE,
-        ),
-        "kwargs": {"expires": (24 * 3600) + 60},  # 24 hours + 1 minute
-    },
     ed_ids.PATIENTS_STORE: {
         "task": "web.celery_tasks.get_response",
         "schedule": crontab(minute="*/15"),  # ev 15 minutes
@@ -88,40 +54,71 @@ beat_schedule = {
 }
 
 
-# add tasks for all sitrep stores
+def _jittered_minutes(task: str, every: int) -> str:
+    """
+    crontab minutes for every `every` minutes offset by a fixed amount for
+    each task so that tasks on the same interval do not all fire at once
+    """
+    offset = int(hashlib.sha1(task.encode()).hexdigest(), 16) % every
+    return f"{offset}-59/{every}"
+
+
+# The per ICU stores are refreshed together (see refresh_many) rather than by
+# a beat task each; icu_stores holds their urls/keys in the same shape as the
+# beat_schedule entries for the store callbacks
+icu_stores: dict[str, dict] = {}
+
 for icu in list(SITREP_DEPT2WARD_MAPPING.values()):
     kkey = f"{web_ids.SITREP_STORE}-{icu}"
 
     def _sitrep_store_url(icu: str) -> str:
         return f"{get_settings().api_url}/sitrep/live/{icu}/ui/"
 
-    url = _sitrep_store_url(icu)
-    beat_schedule[kkey] = {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute="*/30"),  # every 30 minutes
-        "args": (
-            url,
-            kkey,
-        ),
-        "kwargs": {"expires": (30 * 60) + 60},  # 30 mins + 1 minute
+    icu_stores[kkey] = {
+        "args": (_sitrep_store_url(icu), kkey),
+        "kwargs": {
+            "expires": (30 * 60) + 60,  # 30 mins + 1 minute
+            "model": "models.sitrep.SitrepRow",
+        },
     }
 
-# add task for all hymind discharge predictions
 for icu in list(SITREP_DEPT2WARD_MAPPING.values()):
     kkey = f"{web_ids.HYMIND_ICU_DC_STORE}-{icu}"
-    url = f"{get_settings().api_url}/hymind/discharge/individual/{icu}"
-    beat_schedule[kkey] = {
-        "task": "web.celery_tasks.get_response",
-        "schedule": crontab(minute="*/60"),  # every 60 minutes
-        "args": (
-            url,
-            kkey,
-        ),
-        "kwargs": {"expires": (60 * 60) + 60},  # 60 mins + 1 minute
+    icu_stores[kkey] = {
+        "args": (f"{get_settings().api_url}/hymind/discharge/individual/{icu}", kkey),
+        "kwargs": {
+            "expires": (60 * 60) + 60,  # 60 mins + 1 minute
+            "model": "models.hymind.IcuDischarge",
+        },
+    }
+
+for prefix, every in ((web_ids.SITREP_STORE, 30), (web_ids.HYMIND_ICU_DC_STORE, 60)):
+    stores = [conf for key, conf in icu_stores.items() if key.startswith(prefix)]
+    task = f"refresh-{prefix}"
+    beat_schedule[task] = {
+        "task": "web.celery_tasks.refresh_many",
+        "schedule": crontab(minute=_jittered_minutes(task, every)),
+        "args": ([conf["args"] for conf in stores],),
+        "kwargs": stores[0]["kwargs"],
     }
 
-# add tasks for all census work
-# TODO: add tasks for all census work
+# every cached store by name: its (url, cache_key) args and get_response kwargs
+store_tasks = {
+    **{
+        task: conf
+        for task, conf in beat_schedule.items()
+        if conf["task"] == "web.celery_tasks.get_response"
+    },
+    **icu_stores,
+}
+
+# keep the census, bed layout and electives requests the pages make warm
+beat_schedule["warm_cache"] = {
+    "task": "web.celery_tasks.warm_cache",
+    "schedule": crontab(minute="*"),  # every minute
+    "args": (),
+    "kwargs": {"lead_time": 120},  # refresh 2 minutes before going stale
+}
 
 
 task_time_to_live = 2 * 60 * 60  # 2 hours
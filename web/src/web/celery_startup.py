@@ -1,13 +1,15 @@
 from web.logger import logger
-from web.celery_tasks import get_response
+from web.celery import celery_app
 from web.celery_config import beat_schedule
 
 
 def run_startup_tasks() -> None:
+    """
+    Queue every beat_schedule task once so the cache is warm before the
+    first beat; called by the gunicorn master when it starts (see
+    gunicorn_config.when_ready), not by its workers or the celery worker
+    """
     logger.info("Running startup tasks")
-    for task, _conf in beat_schedule.items():
+    for task, conf in beat_schedule.items():
         logger.info(f"Running {task} task")
-        get_response.apply_async(
-            args=beat_schedule[task]["args"],
-            kwargs=beat_schedule[task]["kwargs"],
-        )
+        celery_app.send_task(conf["task"], args=conf["args"], kwargs=conf["kwargs"])
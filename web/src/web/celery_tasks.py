@@ -1,24 +1,141 @@
 # NOTE: changing the name of this file will require you to
 # change all the ./docker/celery/start-* scripts
 import hashlib
+import importlib
 import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import orjson
 import requests
-from typing import Optional, Any
+from redis.client import Pipeline
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Iterable, Optional
 
+from web import cache_codec
+from web.cached_requests import warm_up_plan
 from web.celery import celery_app, redis_client
 from web.logger import logger
 
+# connections kept open to the API by each celery/web worker process
+HTTP_POOL_SIZE = 16
+# per request; a slow upstream should not hold a celery worker indefinitely
+HTTP_TIMEOUT = 120
+
+# How long a key's refresh lock is held at most: a queued refresh_response
+# may wait behind the other tasks (warm_cache queues them every minute for
+# worker_concurrency workers) before its fetch of up to HTTP_TIMEOUT
+QUEUE_DELAY = 5 * 60
+LOCK_TIMEOUT = QUEUE_DELAY + HTTP_TIMEOUT
+# How long callers missing a key wait for another caller's fetch before
+# fetching themselves
+LOCK_WAIT = 60
+LOCK_POLL_INTERVAL = 0.1
+
+# Deletes the lock only if it still holds our token: an expired lock may
+# have been taken by another caller since
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# how long requests_try_cache_many remembers that the API had nothing for an
+# id (e.g. a patient admitted since the last predictions run)
+MISS_EXPIRES = 60
+
+
+@lru_cache()
+def _http_session() -> requests.Session:
+    """Pooled (keep-alive) HTTP client, one per process"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _fresh_key(cache_key: str) -> str:
+    """Present (with the soft TTL) while the value under cache_key is fresh"""
+    return f"{cache_key}:fresh"
+
+
+def version_key(cache_key: str) -> str:
+    """Content hash of the value under cache_key (written alongside it)"""
+    return f"{cache_key}:version"
+
+
+def _lock_key(cache_key: str) -> str:
+    return f"{cache_key}:lock"
+
+
+def _acquire_lock(cache_key: str) -> Optional[str]:
+    """A token to release the lock with, or None if another caller holds it"""
+    token = uuid.uuid4().hex
+    if redis_client.set(_lock_key(cache_key), token, nx=True, ex=LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def _release_lock(cache_key: str, token: str) -> None:
+    redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(cache_key), token)
+
+
+def _set_cache(cache_key: str, data: Any, expires: int, stale_for: int = 0) -> None:
+    """
+    Cache data as fresh for expires seconds (the soft TTL) and keep it for a
+    further stale_for seconds (up to the hard TTL) to serve while it is
+    refreshed
+    """
+    with redis_client.pipeline() as pipe:
+        _pipe_set_cache(pipe, cache_key, data, expires, stale_for)
+        pipe.execute()
+
+
+def _pipe_set_cache(
+    pipe: Pipeline, cache_key: str, data: Any, expires: int, stale_for: int = 0
+) -> None:
+    """Queue the writes made by _set_cache on a pipeline"""
+    payload = orjson.dumps(data)
+    packed = cache_codec.pack(payload)
+    pipe.set(cache_key, packed, ex=expires + stale_for)
+    cache_codec.record_metrics(pipe, payload, packed)
+    pipe.set(version_key(cache_key), _content_hash(payload), ex=expires + stale_for)
+    pipe.set(_fresh_key(cache_key), 1, ex=expires)
+
+
+def _content_hash(payload: bytes) -> str:
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _validate_rows(rows: list[dict], model: str) -> list[dict]:
+    """
+    Parse rows with a pydantic model given by its dotted path (e.g.
+    models.beds.Department) so that readers of the cache need not
+    """
+    module_name, model_name = model.rsplit(".", 1)
+    model_type = getattr(importlib.import_module(module_name), model_name)
+    return [model_type.parse_obj(row).dict() for row in rows]
+
 
 @celery_app.task
 def get_response(
-    url: str, cache_key: str, params: Optional[int] = None, expires: int = 3600
+    url: str,
+    cache_key: str,
+    params: Optional[dict] = None,
+    expires: int = 3600,
+    stale_for: int = 0,
+    model: Optional[str] = None,
 ) -> tuple[object, int]:
     """
     Get a response from a URL
     TODO: might be best to take the logic below and
     include here so that all tasks can generate their own keys if needed
+
+    If model (the dotted path to a pydantic model) is given then the rows are
+    validated here, once, before they are cached
     """
     try:
         assert type(url) is str
@@ -28,42 +145,197 @@ def get_response(
 
     if params is None:
         logger.info(f"Fetching {url} - no parameters provided")
-        response = requests.get(url)
+        response = _http_session().get(url, timeout=HTTP_TIMEOUT)
     else:
         logger.info(f"Fetching {url} - params {str(params)[:16]} ...")
-        response = requests.get(url, params=str(params))
+        response = _http_session().get(url, params=params, timeout=HTTP_TIMEOUT)
 
     if response.status_code != 200:
         logger.error(f"Error fetching {url}: {response.status_code}")
         return None, response.status_code
 
     data = response.json()  # type: tuple[object, int]
-    redis_client.set(cache_key, orjson.dumps(data))
+    if model is not None:
+        data = _validate_rows(data, model)  # type: ignore
     # Remember to expire the cache just after the task refresh interval
-    redis_client.expire(cache_key, expires)
+    _set_cache(cache_key, data, expires, stale_for)
 
     return data
 
 
+@celery_app.task
+def refresh_response(
+    url: str,
+    cache_key: str,
+    params: Optional[dict] = None,
+    expires: int = 3600,
+    stale_for: int = 0,
+    model: Optional[str] = None,
+    lock_token: Optional[str] = None,
+) -> None:
+    """
+    Refresh a stale key in the background then release its refresh lock
+    (taken by queue_refresh, which passes its lock_token)
+    """
+    try:
+        get_response(
+            url,
+            cache_key,
+            params=params,
+            expires=expires,
+            stale_for=stale_for,
+            model=model,
+        )
+    finally:
+        if lock_token is not None:
+            _release_lock(cache_key, lock_token)
+
+
+def _fetch_json(url: str, params: Optional[dict] = None) -> tuple[Optional[int], Any]:
+    """(status code, JSON body) or (None, None) if the request failed"""
+    try:
+        response = _http_session().get(url, params=params, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching {url}: {e}")
+        return None, None
+    if response.status_code != 200:
+        logger.error(f"Error fetching {url}: {response.status_code}")
+        return response.status_code, None
+    return response.status_code, response.json()
+
+
+@celery_app.task
+def refresh_many(
+    url_keys: list[tuple[str, str]],
+    expires: int = 3600,
+    stale_for: int = 0,
+    model: Optional[str] = None,
+) -> dict[str, Optional[int]]:
+    """
+    Fetch several (url, cache_key) pairs concurrently and cache them all in
+    one redis round trip; the kwargs apply to every pair as for get_response
+
+    A failed fetch leaves the previous value for that key in place. Returns
+    the status code for each cache key.
+    """
+    urls = [url for url, _ in url_keys]
+    with ThreadPoolExecutor(max_workers=min(len(urls), HTTP_POOL_SIZE)) as pool:
+        results = list(pool.map(_fetch_json, urls))
+
+    with redis_client.pipeline() as pipe:
+        for (url, cache_key), (status, data) in zip(url_keys, results):
+            if status != 200:
+                continue
+            if model is not None:
+                data = _validate_rows(data, model)
+            _pipe_set_cache(pipe, cache_key, data, expires, stale_for)
+        pipe.execute()
+
+    logger.info(f"Refreshed {sum(s == 200 for s, _ in results)}/{len(urls)} urls")
+    return {cache_key: status for (_, cache_key), (status, _) in zip(url_keys, results)}
+
+
 def replace_alphanumeric(s: str, replacement: str = "_") -> str:
     return re.sub(r"\W+", replacement, s)
 
 
-def requests_try_cache(
+def queue_refresh(
     url: str,
-    cache_key: Optional[str] = None,
+    cache_key: str,
     params: Optional[dict] = None,
-    expires: Optional[int] = None,
+    expires: int = 3600,
+    stale_for: int = 0,
+    model: Optional[str] = None,
+) -> bool:
+    """
+    Queue a background refresh_response for cache_key unless one is already
+    queued or running; returns True if this call queued it
+    """
+    token = _acquire_lock(cache_key)
+    if token is None:
+        return False
+    try:
+        refresh_response.delay(
+            url,
+            cache_key,
+            params=params,
+            expires=expires,
+            stale_for=stale_for,
+            model=model,
+            lock_token=token,
+        )
+    except Exception as e:
+        logger.error(f"Unable to queue refresh of {url}: {e}")
+        _release_lock(cache_key, token)
+        return False
+    return True
+
+
+def _single_flight(
+    lock_key: str, poll: Callable[[], Optional[Any]], fetch: Callable[[], Any]
 ) -> Any:
     """
-    Drop in replacement for requests.get() that caches the response using redis;
-    the idea is that I can just use this and it will generate a suitable cache
-    key etc automatically from the URL
+    fetch() under lock_key, or if another caller holds the lock wait for
+    poll() to find their result (anything but None) and return that instead
+    """
+    deadline = time.monotonic() + LOCK_WAIT
+    token = _acquire_lock(lock_key)
+    while token is None and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        result = poll()
+        if result is not None:
+            return result
+        token = _acquire_lock(lock_key)
 
-    Crucially this should mean that it's easy to cache anything since the URL is unique
-    TODO: scheduling to keep the cache warm
-    - prob need a sister function that cycles through URLs and prepopulates the cache
+    try:
+        return fetch()
+    finally:
+        if token is not None:
+            _release_lock(lock_key, token)
+
+
+def _fetch_single_flight(
+    url: str, cache_key: str, params: Optional[dict], expires: int, stale_for: int
+) -> Any:
+    """
+    Fetch a missing key, or if another caller is already fetching it wait
+    for and return their result rather than fetching it again
+    """
+
+    def poll() -> Optional[Any]:
+        cached_data = redis_client.get(cache_key)
+        if cached_data is None:
+            return None
+        logger.info(f"Cache filled for {url} by another request")
+        return cache_codec.loads(cached_data)
+
+    # Do not use the apply_async method from the celery_app.task decorator
+    # because the function will return with nothing
+    return _single_flight(
+        cache_key,
+        poll,
+        lambda: get_response(
+            url, cache_key, params=params, expires=expires, stale_for=stale_for
+        ),
+    )
+
+
+def _json_params(params: Optional[dict]) -> Optional[dict]:
+    """
+    celery needs JSON serialisable params (e.g. lists rather than dict_keys);
+    scalars (including None and bools) are kept as they are
     """
+    if not params:
+        return params
+    return {
+        k: list(v) if isinstance(v, Iterable) and not isinstance(v, str) else v
+        for k, v in params.items()
+    }
+
+
+def request_cache_key(url: str, params: Optional[dict] = None) -> str:
+    """The key requests_try_cache caches the response to url with params under"""
+    params = _json_params(params)
     cache_key = replace_alphanumeric(url)
     if params:
         params_suffix = "_PARAMS_" + replace_alphanumeric(str(params))
@@ -75,17 +347,144 @@ def requests_try_cache(
             cache_key = cache_key + params_suffix[:32] + sha256.hexdigest()
         else:
             cache_key = cache_key + params_suffix
+    return cache_key
+
+
+def requests_try_cache(
+    url: str,
+    cache_key: Optional[str] = None,
+    params: Optional[dict] = None,
+    expires: Optional[int] = None,
+    stale_for: Optional[int] = None,
+) -> Any:
+    """
+    Drop in replacement for requests.get() that caches the response using redis;
+    the idea is that I can just use this and it will generate a suitable cache
+    key etc automatically from the URL
+
+    Crucially this should mean that it's easy to cache anything since the URL is unique
+    The requests the pages make are kept warm by warm_cache (see
+    web.cached_requests)
+
+    Responses are fresh for expires seconds. After that they are served stale
+    for up to stale_for seconds (default: expires again) while one background
+    task refreshes them. Concurrent misses for the same key share one fetch.
+    """
+    params = _json_params(params)
+    cache_key = request_cache_key(url, params)
     expires = 3600 if expires is None else expires
+    stale_for = expires if stale_for is None else stale_for
 
-    cached_data = redis_client.get(cache_key)
+    cached_data, fresh = redis_client.mget(cache_key, _fresh_key(cache_key))
 
     if cached_data is None:
         logger.info(f"Cache miss for {url} ... requesting")
-        # Do not use the apply_async method from the celery_app.task decorator
-        # because the function will return with nothing
-        data = get_response(url, cache_key, params=params, expires=expires)
+        return _fetch_single_flight(url, cache_key, params, expires, stale_for)
+
+    if fresh is None and queue_refresh(url, cache_key, params, expires, stale_for):
+        logger.info(f"Cache stale for {url} ... refreshing in the background")
     else:
         logger.info(f"Cache hit for {url}")
-        data = orjson.loads(cached_data)
 
-    return data
+    return cache_codec.loads(cached_data)
+
+
+@celery_app.task
+def warm_cache(
+    plan: Optional[list[tuple[str, Optional[dict], Optional[int]]]] = None,
+    lead_time: int = 120,
+) -> list[str]:
+    """
+    Refresh each (url, params, expires) in plan (by default warm_up_plan()
+    as of now, as some requests depend on the date) that requests_try_cache
+    would find missing or that will go stale within lead_time seconds
+
+    Cheap enough to run every minute: one redis round trip to check the
+    plan and a queue_refresh (deduplicated by its lock) per key due.
+    Returns the cache keys queued.
+    """
+    if plan is None:
+        plan = [tuple(request) for request in warm_up_plan()]
+    keys = [request_cache_key(url, params) for url, params, _ in plan]
+    with redis_client.pipeline() as pipe:
+        for cache_key in keys:
+            pipe.ttl(_fresh_key(cache_key))
+        ttls = pipe.execute()
+
+    queued = []
+    for (url, params, expires), cache_key, ttl in zip(plan, keys, ttls):
+        # ttl is negative if the key is missing (so stale or never cached)
+        if ttl > lead_time:
+            continue
+        expires = 3600 if expires is None else expires
+        if queue_refresh(url, cache_key, _json_params(params), expires, expires):
+            queued.append(cache_key)
+
+    logger.info(f"Warming {len(queued)} of {len(plan)} cached requests")
+    return queued
+
+
+def requests_try_cache_many(
+    url: str,
+    id_param: str,
+    ids: Iterable[Any],
+    split: Callable[[Any, list[str]], dict[str, Any]],
+    expires: Optional[int] = None,
+    miss_expires: int = MISS_EXPIRES,
+) -> dict[str, Any]:
+    """
+    Cache a response per id rather than per list of ids
+
+    Looks up every id with a single MGET, asks the API only for the ids that
+    are missing (in one request, passing them as id_param) and caches each
+    of those separately. split turns that response into a value for every
+    requested id. Ids the API had nothing for (None or []) are kept for just
+    miss_expires seconds so they are asked for again soon.
+
+    Concurrent callers missing the same ids share one request (see
+    _single_flight).
+
+    Returns a dict of str(id) -> value
+    """
+    ids = list(dict.fromkeys(str(i) for i in ids if i is not None))
+    if not ids:
+        return {}
+    expires = 3600 if expires is None else expires
+
+    key_prefix = f"{replace_alphanumeric(url)}_ID_"
+    cached = redis_client.mget([key_prefix + i for i in ids])
+    values = {i: cache_codec.loads(v) for i, v in zip(ids, cached) if v is not None}
+
+    missing = [i for i in ids if i not in values]
+    if not missing:
+        logger.info(f"Cache hit for all {len(ids)} ids from {url}")
+        return values
+
+    logger.info(f"Cache miss for {len(missing)} of {len(ids)} ids from {url}")
+    missing_keys = [key_prefix + i for i in missing]
+
+    def poll() -> Optional[dict[str, Any]]:
+        filled = redis_client.mget(missing_keys)
+        if any(v is None for v in filled):
+            return None
+        logger.info(
+            f"Cache filled for {len(missing)} ids from {url} by another request"
+        )
+        return {i: cache_codec.loads(v) for i, v in zip(missing, filled)}
+
+    def fetch() -> dict[str, Any]:
+        status, data = _fetch_json(url, params={id_param: missing})
+        if status != 200:
+            return {}
+        fetched = split(data, missing)
+        with redis_client.pipeline() as pipe:
+            for i, key in zip(missing, missing_keys):
+                value = fetched.get(i)
+                ttl = miss_expires if value is None or value == [] else expires
+                pipe.set(key, cache_codec.dumps(value), ex=ttl)
+            pipe.execute()
+        return fetched
+
+    lock_key = request_cache_key(url, {id_param: missing})
+    values.update(_single_flight(lock_key, poll, fetch))
+    return values
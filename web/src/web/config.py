@@ -17,6 +17,9 @@ class Settings(BaseSettings):
     celery_dash_broker_url: AnyUrl
     celery_dash_result_backend: AnyUrl
     redis_cache: AnyUrl
+    # Run the CPU heavy callbacks (marked background=...) on the celery
+    # workers rather than in the gunicorn worker that received the request
+    background_callbacks: bool = False
 
     hyui_user: str
     hyui_password: SecretStr
@@ -15,3 +15,8 @@ def to_data_frame(
 def parse_to_data_frame(rows: list[dict], model_type: type[BaseModel]) -> pd.DataFrame:
     model_rows = (model_type.parse_obj(row) for row in rows)
     return to_data_frame(model_rows, model_type)
+
+
+def columns_to_records(columns: dict[str, list]) -> list[dict]:
+    """Rows from a column oriented (?format=columns) API response"""
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
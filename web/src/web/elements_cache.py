@@ -0,0 +1,105 @@
+"""
+Cytoscape elements shared between the clients viewing the same map
+
+Every client viewing a ward sends the same store data to the element
+callbacks so the element list is built once per distinct set of inputs and
+reused for the other viewers, including those served by other web workers
+(via redis). When the inputs do change, e.g. a new census, only the beds
+whose own inputs changed are rebuilt; the rest reuse the element built last
+time by this worker.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import orjson
+from redis import Redis
+
+from web import cache_codec
+from web.celery import redis_client
+from web.logger import logger
+
+# distinct maps (ward/campus x layout x inputs) kept in memory
+ELEMENTS_MAXSIZE = 64
+# beds kept across all maps
+BED_ELEMENTS_MAXSIZE = 10_000
+# how long element lists are shared between workers via redis
+ELEMENTS_EXPIRES = 10 * 60
+
+
+def elements_key(*parts: Any) -> str:
+    """
+    Key for the element list built from parts: the map (ward/campus), any
+    layout flags and the data from each input store, which acts as its version
+    """
+    payload = orjson.dumps(parts, option=orjson.OPT_NON_STR_KEYS)
+    return hashlib.sha1(payload).hexdigest()
+
+
+class ElementsCache:
+    def __init__(
+        self,
+        maxsize: int = ELEMENTS_MAXSIZE,
+        bed_maxsize: int = BED_ELEMENTS_MAXSIZE,
+        redis: Optional[Redis] = None,
+        expires: int = ELEMENTS_EXPIRES,
+    ) -> None:
+        self._maxsize = maxsize
+        self._bed_maxsize = bed_maxsize
+        self._redis = redis
+        self._expires = expires
+        self._elements: OrderedDict[str, list[dict]] = OrderedDict()
+        self._beds: OrderedDict[Hashable, tuple[tuple, dict]] = OrderedDict()
+
+    def get_or_build(self, key: str, build: Callable[[], list[dict]]) -> list[dict]:
+        """
+        The element list for key, built by build() if it is not cached
+
+        The same list is returned to every caller so must not be modified
+        """
+        elements = self._elements.get(key)
+        if elements is not None:
+            self._elements.move_to_end(key)
+            logger.info(f"Reusing cytoscape elements {key[:8]}")
+            return elements
+
+        redis_key = f"cytoscape_elements_{key}"
+        cached = self._redis.get(redis_key) if self._redis is not None else None
+        if cached is not None:
+            logger.info(f"Reusing cytoscape elements {key[:8]} from another worker")
+            elements = cache_codec.loads(cached)
+        else:
+            elements = build()
+            if self._redis is not None:
+                self._redis.set(
+                    redis_key, cache_codec.dumps(elements), ex=self._expires
+                )
+
+        self._elements[key] = elements
+        if len(self._elements) > self._maxsize:
+            self._elements.popitem(last=False)
+        return elements
+
+    def bed(self, key: Hashable, inputs: tuple, build: Callable[..., dict]) -> dict:
+        """
+        The element for a bed, rebuilt with build(*inputs) only if its
+        inputs differ from those it was last built from
+        """
+        cached = self._beds.get(key)
+        if cached is not None and cached[0] == inputs:
+            self._beds.move_to_end(key)
+            return cached[1]
+
+        element = build(*inputs)
+        self._beds[key] = (inputs, element)
+        self._beds.move_to_end(key)
+        if len(self._beds) > self._bed_maxsize:
+            self._beds.popitem(last=False)
+        return element
+
+
+_elements_cache = ElementsCache(redis=redis_client)
+
+
+def get_elements_cache() -> ElementsCache:
+    return _elements_cache
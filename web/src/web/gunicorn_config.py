@@ -1,4 +1,5 @@
 from gevent import monkey
+from multiprocessing import cpu_count
 from os import getenv
 from web.logger import logger
 
@@ -17,6 +18,18 @@ else:
 
 bind = "0.0.0.0:8000"
 reload = True if debug else False
-timeout = 60 * 60  # 1 hour
-workers = 1
+# Workers share nothing but redis (see web.elements_cache) so scale with the
+# cores available
+workers = int(getenv("WEB_WORKERS", cpu_count()))
 worker_class = "gevent"
+# gevent workers keep answering heartbeats while a callback waits on the API
+# or redis so this only catches callbacks stuck on the CPU; slow pandas work
+# belongs in a background callback (see web.config.Settings)
+timeout = 5 * 60
+
+
+def when_ready(server) -> None:
+    """Runs once in the master as gunicorn starts, before any worker boots"""
+    from web.celery_startup import run_startup_tasks
+
+    run_startup_tasks()
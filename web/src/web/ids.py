@@ -3,9 +3,6 @@ from web.utils import gen_id
 STORE_TIMER_15M = gen_id("15m timer", __name__)
 STORE_TIMER_1H = gen_id("1h timer", __name__)
 STORE_TIMER_6H = gen_id("6h timer", __name__)
-DEPT_STORE = gen_id("dept all store", __name__)
-ROOM_STORE = gen_id("rooms all store", __name__)
-BEDS_STORE = gen_id("beds all store", __name__)
-ELECTIVES_STORE = gen_id("electives all store", __name__)
+STORE_HYDRATION_TIMER = gen_id("store hydration timer", __name__)
 SITREP_STORE = gen_id("sitrep all store", __name__)
 HYMIND_ICU_DC_STORE = gen_id("hymind icu dc store", __name__)
@@ -1,10 +1,9 @@
 import dash
 import dash_mantine_components as dmc
-import orjson
 import requests
 from dash import Input, Output
 
-from web import API_URLS
+from web import API_URLS, cache_codec
 from web.celery import redis_client
 from web.celery_tasks import get_response
 from web.pages.demo import fast_url, slow_url
@@ -39,7 +38,7 @@ def ping_slow(n_clicks: int) -> str:
         fetch_data_task = get_response.delay(slow_url, cache_key)
         data = fetch_data_task.get()
     else:
-        data = orjson.loads(cached_data)
+        data = cache_codec.loads(cached_data)
 
     return f"Click: {n_clicks} Timestamp: {data}"
 
@@ -56,7 +55,7 @@ def ping_campus(n_clicks: int) -> str:
         fetch_data_task = get_response.delay(campus_url, cache_key)
         data = fetch_data_task.get()
     else:
-        data = orjson.loads(cached_data)
+        data = cache_codec.loads(cached_data)
 
     result = len(data)
     return f"Click: {n_clicks} Rows of data: {result}"
@@ -16,3 +16,9 @@ CAMPUSES = [
     },
     {"value": "QUEEN SQUARE CAMPUS", "label": "NHNN", "default_dept": "NHNN C1 NCCU"},
 ]
+
+# the date picker's initial range is today and this many days after
+DEFAULT_DAYS = 3
+# the latest date the picker offers, in days after today; the API holds the
+# electives up to the same date (its electives_days_ahead setting)
+MAX_DAYS = 10
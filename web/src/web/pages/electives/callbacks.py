@@ -1,6 +1,9 @@
 from dash import Input, Output, callback
 
-from web.pages.electives import ids, CAMPUSES
+from web.cached_requests import electives_request
+from web.celery_tasks import requests_try_cache
+from web.config import get_settings
+from web.pages.electives import ids
 from web.stores import ids as store_ids
 
 import textwrap
@@ -11,32 +14,22 @@ from datetime import datetime
     Output(ids.ELECTIVES_TABLE, "data"),
     Output(ids.ELECTIVES_TABLE, "filter_query"),
     Input(ids.CAMPUS_SELECTOR, "value"),
-    Input(store_ids.ELECTIVES_STORE, "data"),
     Input("date_selector", "value"),
     Input("pacu_selector", "value"),
+    Input(store_ids.STORE_TIMER_15M, "n_intervals"),
+    background=get_settings().background_callbacks,
 )
 def _store_electives(
-    campus: str, electives: list[dict], date: str, pacu_selection: bool
+    campus: str, date: list[str], pacu_selection: bool, _: int
 ) -> tuple[list[dict], str]:
     icu_cut_off = 0.5
     preassess_date_cut_off = 90
 
-    campus_dict = {i.get("value"): i.get("label") for i in CAMPUSES}
-
-    # filter by campus
-    electives = [
-        row
-        for row in electives
-        if campus_dict.get(campus, "") in row["department_name"]
-    ]
-
-    # filter by surgical date
-    if date is not None:
-        electives = [
-            row
-            for row in electives
-            if row["surgery_date"] >= date[0] and row["surgery_date"] <= date[1]
-        ]
+    # just this campus and the selected surgery dates (all if none)
+    request = electives_request(campus, date)
+    electives = requests_try_cache(
+        request.url, params=request.params, expires=request.expires
+    )
 
     # add row_ids after these filters
     i = 0
@@ -82,11 +75,8 @@ def _store_electives(
     Output("patient_info_box", "children"),
     Input(ids.ELECTIVES_TABLE, "data"),
     Input(ids.ELECTIVES_TABLE, "active_cell"),
-    Input(store_ids.ELECTIVES_STORE, "data"),
 )
-def _make_info_box(
-    current_table: list[dict], active_cell: dict, electives: list[dict]
-) -> str:
+def _make_info_box(current_table: list[dict], active_cell: dict) -> str:
     """
     Outputs text for the patient_info_box.
     If no cell is selected, automatically first patient.
@@ -94,11 +84,11 @@ def _make_info_box(
     """
     info_box_width = 65
 
+    # the table rows carry every field of the electives
     if active_cell is None:
-        patient_mrn = current_table[0]["primary_mrn"]
+        pt = current_table[0]
     else:
-        patient_mrn = current_table[active_cell["row_id"]]["primary_mrn"]
-    pt = [row for row in electives if row["primary_mrn"] == patient_mrn][0]
+        pt = current_table[active_cell["row_id"]]
 
     string = """FURTHER INFORMATION
     Name: {first_name} {last_name}, {age_in_years}{sex[0]}
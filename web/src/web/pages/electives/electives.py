@@ -6,7 +6,7 @@ from pathlib import Path
 from datetime import date, timedelta
 
 import web.pages.electives.callbacks  # noqa
-from web.pages.electives import CAMPUSES, ids
+from web.pages.electives import CAMPUSES, DEFAULT_DAYS, MAX_DAYS, ids
 from web.style import replace_colors_in_stylesheet
 
 
@@ -79,10 +79,10 @@ date_selector = html.Div(
     dmc.DateRangePicker(
         id="date_selector",
         minDate=date.today(),
-        maxDate=date.today() + timedelta(days=10),
+        maxDate=date.today() + timedelta(days=MAX_DAYS),
         allowSingleDateInRange=True,
         fullWidth=True,
-        value=[date.today(), (date.today() + timedelta(days=3))],
+        value=[date.today(), (date.today() + timedelta(days=DEFAULT_DAYS))],
     ),
     # ],
     # )
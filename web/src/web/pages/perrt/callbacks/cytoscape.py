@@ -4,29 +4,36 @@ from dash import Input, Output, callback
 from datetime import datetime
 from typing import Tuple
 
-from models.census import CensusRow
+from web.cached_requests import perrt_census_request, perrt_layout_request
+from web.convert import columns_to_records
+from web.elements_cache import elements_key, get_elements_cache
 from web.config import get_settings
 from web.pages.perrt import CAMPUSES, ids
 from web.stores import ids as store_ids
-from web.celery_tasks import requests_try_cache
+from web.celery_tasks import requests_try_cache, requests_try_cache_many
 
 DEBUG = True
 
 
 @callback(
     Output(ids.DEPTS_OPEN_STORE, "data"),
+    Output(ids.ROOMS_OPEN_STORE, "data"),
+    Output(ids.BEDS_STORE, "data"),
     Input(ids.CAMPUS_SELECTOR, "value"),
-    Input(store_ids.DEPT_STORE, "data"),
+    Input(store_ids.STORE_TIMER_15M, "n_intervals"),
 )
-def _store_depts(campus: str, depts: list[dict]) -> list[dict]:
-    """Need a list of departments for this building"""
-    try:
-        these_depts = [dept for dept in depts if dept.get("location_name") == campus]
-    except TypeError as e:
-        print(e)
+def _store_layout(campus: str, _: int) -> tuple[list, list, list]:
+    """
+    Open departments, rooms and open beds (with their map positions) for
+    this building; the layout is built by the API
+    """
+    request = perrt_layout_request(campus)
+    layout = requests_try_cache(
+        request.url, params=request.params, expires=request.expires
+    )
+    if not layout.get("departments"):
         warnings.warn(f"No departments found at {campus} campus")
-        these_depts = []
-    return these_depts
+    return layout["departments"], layout["rooms"], layout["beds"]
 
 
 @callback(
@@ -37,95 +44,6 @@ def _dept_open_store_names(depts_open: list[dict]) -> list[str]:
     return [i.get("department", {}) for i in depts_open]
 
 
-@callback(
-    Output(ids.ROOMS_OPEN_STORE, "data"),
-    Input(ids.DEPTS_OPEN_STORE, "data"),
-    Input(store_ids.ROOM_STORE, "data"),
-)
-def _store_rooms(
-    depts: list[dict],
-    rooms: list[dict],
-) -> list[dict]:
-    """Need a list of rooms for this building"""
-    dfdepts = pd.DataFrame.from_records(depts)
-    dfdepts = dfdepts[["department", "hl7_department"]]
-    dfrooms = pd.DataFrame.from_records(rooms)
-    # default inner join drops rooms not in the selected departments
-    dfrooms = dfrooms.merge(dfdepts, on="department")
-    # drop closed rooms
-    dfrooms = dfrooms.loc[~dfrooms["closed"], :]
-
-    return dfrooms.to_dict(orient="records")  # type: ignore
-
-
-@callback(
-    Output(ids.BEDS_STORE, "data"),
-    Input(ids.DEPTS_OPEN_STORE, "data"),
-    Input(ids.ROOMS_OPEN_STORE, "data"),
-    Input(store_ids.BEDS_STORE, "data"),
-)
-def _store_beds(
-    depts: list[dict],
-    rooms: list[dict],
-    beds: list[dict],
-) -> list[dict]:
-    """
-    Return a list of beds using the local filtered versions of depts/rooms
-    - generate the floor_index from the bed_number to permit appropriate sorting
-    """
-
-    bedsdf = pd.DataFrame.from_records(beds)
-    dfdepts = pd.DataFrame.from_records(depts)
-    dfrooms = pd.DataFrame.from_records(rooms)
-
-    dfdepts = dfdepts[["department", "floor_order"]]
-
-    # drop beds where rooms are closed
-    # look for bays where all beds are closed
-    dft = bedsdf.groupby("hl7_room")["closed"].all()
-    dft = pd.DataFrame(dft).reset_index()
-    dft.rename(columns={"closed": "closed_all_beds"}, inplace=True)
-    dfrooms = dfrooms.merge(dft, on="hl7_room")
-
-    # now close a room if any of the following are true
-    dfrooms["closed"] = dfrooms["closed"] | dfrooms["closed_all_beds"]
-    dfrooms.drop(columns=["closed_all_beds"], inplace=True)
-    # drop closed rooms
-    dfrooms = dfrooms.loc[~dfrooms["closed"], :]
-    dfrooms = dfrooms[["hl7_room", "is_sideroom"]]
-
-    # inner join to drop rooms without beds
-    bedsdf = bedsdf.merge(dfrooms, on="hl7_room", how="inner")
-    # inner join to drop closed_perm_01
-    bedsdf = bedsdf.merge(dfdepts, on="department", how="inner")
-
-    bedsdf = bedsdf[bedsdf["bed_number"] != -1]
-    bedsdf = bedsdf[~bedsdf["closed"]]
-
-    def _gen_floor_indices(df: pd.DataFrame) -> pd.DataFrame:
-        # now generate floor_y_index
-        df.sort_values(
-            ["floor", "floor_order", "department", "bed_number"], inplace=True
-        )
-        floor_depts = df[["floor", "floor_order", "department"]].drop_duplicates()
-        floor_depts.sort_values(["floor", "floor_order"], inplace=True)
-        floor_depts["floor_y_index"] = floor_depts.reset_index().index + 1
-        df = df.merge(floor_depts, how="left")
-
-        # create a floor x_index by sorting and ranking within floor_y_index
-        df.sort_values(["floor_y_index", "bed_number"], inplace=True)
-        df["floor_x_index"] = df.groupby("floor_y_index")["bed_number"].rank(
-            method="first", na_option="keep"
-        )
-        df.sort_values(["location_string"], inplace=True)
-        return df
-
-    bedsdf = _gen_floor_indices(bedsdf)
-
-    res: list[dict] = bedsdf.to_dict(orient="records")
-    return res
-
-
 @callback(
     Output(ids.CENSUS_STORE, "data"),
     Input(ids.CAMPUS_SELECTOR, "value"),
@@ -146,20 +64,11 @@ def _store_census(
         Filtered list of CensusRow dictionaries
 
     """
-    campus_short_name = next(
-        i.get("label") for i in CAMPUSES if i.get("value") == campus
-    )
-
     # Drop in replacement for requests.get that uses the redis cache
-    # response = requests.get(
-    #     f"{get_settings().api_url}/census/campus/",
-    #     params={"campuses": campus_short_name},
-    # )
-    url = f"{get_settings().api_url}/census/campus/"
-    params = {"campuses": campus_short_name}
-    data = requests_try_cache(url, params=params)
-
-    res = [CensusRow.parse_obj(row).dict() for row in data]
+    request = perrt_census_request(campus)
+    data = requests_try_cache(request.url, params=request.params)
+
+    res = columns_to_records(data)
     res = [row for row in res if row.get("department") in depts_open_names]
     return res
 
@@ -180,9 +89,18 @@ def _store_news(census: list[dict]) -> list[dict]:
     """
     csn_list = [i.get("encounter") for i in census if i.get("occupied")]  # type: ignore
 
+    def _rows_by_encounter(rows: list[dict], encounters: list[str]) -> dict:
+        res: dict[str, list[dict]] = {i: [] for i in encounters}
+        for row in rows:
+            res.setdefault(str(row.get("encounter")), []).append(row)
+        return res
+
+    # Cached per encounter so only newly admitted patients are queried
     url = f"{get_settings().api_url}/perrt/vitals/wide"
-    params = {"encounter_ids": csn_list}
-    data = requests_try_cache(url, params=params)
+    news_by_encounter = requests_try_cache_many(
+        url, "encounter_ids", csn_list, split=_rows_by_encounter
+    )
+    data = [row for rows in news_by_encounter.values() for row in rows]
 
     newsdf = pd.DataFrame.from_records(data)
     # TODO: simpplify: you just want the most recent and highest NEWS score
@@ -208,10 +126,15 @@ def _store_predictions(census: list[dict]) -> dict:
     """
     hv_id_list = [i.get("ovl_hv_id") for i in census if i.get("occupied")]
     url = f"{get_settings().api_url}/perrt/icu_admission_prediction"
-    params = {"hospital_visit_ids": hv_id_list}  # type: ignore
-    predictions = requests_try_cache(url, params=params)
+    # Cached per hospital visit so only newly admitted patients are queried
+    predictions = requests_try_cache_many(
+        url,
+        "hospital_visit_ids",
+        hv_id_list,
+        split=lambda data, hv_ids: {i: data.get(i) for i in hv_ids},
+    )
 
-    return predictions  # type: ignore
+    return predictions
 
 
 @callback(
@@ -230,6 +153,55 @@ def _dept_select_control(depts: list[str], campus: str) -> Tuple[list[str], str]
     return depts, default
 
 
+def _max_news_wide(row: dict) -> int:
+    if not row:
+        return -1
+    scale_1_max = row.get("news_scale_1_max", -1)
+    scale_2_max = row.get("news_scale_2_max", -1)
+    max_news: int = max(i for i in [-1, scale_1_max, scale_2_max] if i is not None)
+
+    return max_news
+
+
+def _bed_element(
+    bed: dict,
+    census_row: dict,
+    news_wide: dict,
+    admission_prediction: float | None,
+    y_index_max: int,
+) -> dict:
+    """Cytoscape element for a single bed (see _make_elements)"""
+    data = dict(
+        id=bed.get("location_string"),
+        bed_number=bed.get("bed_number"),
+        bed_index=bed.get("bed_index"),
+        department=bed.get("department"),
+        floor=bed.get("floor"),
+        entity="bed",
+        parent=bed.get("department"),
+        bed=bed,
+        census=census_row,
+        closed=bed.get("closed"),
+        blocked=bed.get("blocked"),
+        occupied=census_row.get("occupied", False),
+        encounter=census_row.get("encounter", ""),
+        news=news_wide,
+        news_max=_max_news_wide(news_wide),
+        admission_prediction=admission_prediction,
+    )
+    position = dict(
+        x=bed.get("floor_x_index", -1) * 40,
+        y=(y_index_max - bed.get("floor_y_index", -1)) * 60,
+    )
+    return dict(
+        data=data,
+        position=position,
+        grabbable=True,
+        selectable=True,
+        locked=False,
+    )
+
+
 def _make_elements(  # noqa: C901
     census: list[dict],
     depts: list[dict],
@@ -257,17 +229,15 @@ def _make_elements(  # noqa: C901
     census_lookup = {i.get("location_string"): i for i in census}
     news_lookup = {i.get("encounter"): i for i in news}
 
+    cache = get_elements_cache()
+
     # create beds
     for bed in beds:
-        department = bed.get("department")
         location_string = bed.get("location_string")
-
-        occupied = census_lookup.get(location_string, {}).get("occupied", False)
-        encounter = census_lookup.get(location_string, {}).get("encounter", "")
-        hospital_visit_id = census_lookup.get(location_string, {}).get(
-            "ovl_hv_id", None
-        )
-        news_wide: dict = news_lookup.get(encounter, {})  # type: ignore
+        census_row = census_lookup.get(location_string, {})
+        occupied = census_row.get("occupied", False)
+        encounter = census_row.get("encounter", "")
+        hospital_visit_id = census_row.get("ovl_hv_id", None)
 
         # Hospital_visit_ids are integers, but the dictionary uses strings for keys.
         # Lookup using a string to be safe
@@ -275,49 +245,14 @@ def _make_elements(  # noqa: C901
         admission_prediction = (
             predictions.get(str(hospital_visit_id), None) if occupied else None
         )
-
-        def _max_news_wide(row: dict) -> int:
-            if not row:
-                return -1
-            scale_1_max = row.get("news_scale_1_max", -1)
-            scale_2_max = row.get("news_scale_2_max", -1)
-            max_news: int = max(
-                i for i in [-1, scale_1_max, scale_2_max] if i is not None
-            )
-
-            return max_news
-
-        data = dict(
-            id=location_string,
-            bed_number=bed.get("bed_number"),
-            bed_index=bed.get("bed_index"),
-            department=department,
-            floor=bed.get("floor"),
-            entity="bed",
-            parent=bed.get("department"),
-            bed=bed,
-            census=census_lookup.get(location_string, {}),
-            closed=bed.get("closed"),
-            blocked=bed.get("blocked"),
-            occupied=occupied,
-            encounter=encounter,
-            news=news_wide,
-            news_max=_max_news_wide(news_wide),
-            admission_prediction=admission_prediction,
-        )
-        position = dict(
-            x=bed.get("floor_x_index", -1) * 40,
-            y=(y_index_max - bed.get("floor_y_index", -1)) * 60,
-        )
-        elements.append(
-            dict(
-                data=data,
-                position=position,
-                grabbable=True,
-                selectable=True,
-                locked=False,
-            )
+        inputs = (
+            bed,
+            census_row,
+            news_lookup.get(encounter, {}),
+            admission_prediction,
+            y_index_max,
         )
+        elements.append(cache.bed((__name__, location_string), inputs, _bed_element))
 
     for dept in depts:
         dept_name = dept.get("department")
@@ -359,6 +294,7 @@ def _make_elements(  # noqa: C901
     Input(ids.NEWS_STORE, "data"),
     Input(ids.PREDICTIONS_STORE, "data"),
     prevent_initial_call=True,
+    background=get_settings().background_callbacks,
 )
 def _prepare_cyto_elements_campus(
     census: list[dict],
@@ -370,7 +306,11 @@ def _prepare_cyto_elements_campus(
     """
     Build the element list from pts/beds/rooms/depts for the map
     """
-    elements = _make_elements(census, depts, beds, news, predictions)
+    # viewers of the same campus share one element list (see elements_cache)
+    key = elements_key(__name__, census, depts, beds, news, predictions)
+    elements = get_elements_cache().get_or_build(
+        key, lambda: _make_elements(census, depts, beds, news, predictions)
+    )
     return elements
 
 
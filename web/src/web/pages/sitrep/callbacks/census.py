@@ -3,11 +3,10 @@ from datetime import datetime
 from dash import Input, Output, callback
 from web.celery_tasks import requests_try_cache
 
-from models.census import CensusRow
-from web import SITREP_DEPT2WARD_MAPPING
-from web.config import get_settings
+from web.cached_requests import sitrep_census_request
+from web.convert import columns_to_records
 from web.logger import logger_timeit
-from web.pages.sitrep import CAMPUSES, ids
+from web.pages.sitrep import ids
 
 
 @callback(
@@ -31,19 +30,10 @@ def _store_census(
         Filtered list of CensusRow dictionaries
 
     """
-    if dept_grouper == "ALL_ICUS":
-        url = f"{get_settings().api_url}/census/"
-        params = {"departments": SITREP_DEPT2WARD_MAPPING.keys()}
-        data = requests_try_cache(url, params=params)
-    else:
-        campus_short_name = next(
-            i.get("label") for i in CAMPUSES if i.get("value") == dept_grouper
-        )
-        url = f"{get_settings().api_url}/census/campus/"
-        params = {"campuses": campus_short_name}  # type: ignore
-        data = requests_try_cache(url, params=params)
+    request = sitrep_census_request(dept_grouper)
+    data = requests_try_cache(request.url, params=request.params)
 
-    res = [CensusRow.parse_obj(row).dict() for row in data]
+    res = columns_to_records(data)
     # filter out closed departments
     res = [row for row in res if row.get("department") in depts_open_names]
     return res
@@ -4,6 +4,8 @@ from typing import Tuple, Any
 
 from web.pages.sitrep import CAMPUSES, ids
 from web import SITREP_DEPT2WARD_MAPPING
+from web.config import get_settings
+from web.elements_cache import elements_key, get_elements_cache
 
 from web.logger import logger, logger_timeit
 
@@ -34,6 +36,56 @@ def _dept_select_control(depts: list[Any], dept_grouper: str) -> Tuple[list[str]
     return depts, default
 
 
+def _bed_element(
+    bed: dict,
+    census_row: dict,
+    discharge_status: str,
+    sitrep_row: dict,
+    yhat_dc: float,
+    bed_parent: str,
+    preset_map_positions: bool,
+    y_index_max: int,
+) -> dict:
+    """Cytoscape element for a single bed (see _make_elements)"""
+    location_string = bed.get("location_string")
+    data = dict(
+        id=location_string,
+        bed_number=bed.get("bed_number"),
+        bed_index=bed.get("bed_index"),
+        department=bed.get("department"),
+        floor=bed.get("floor"),
+        entity="bed",
+        parent=bed.get(bed_parent),
+        bed=bed,
+        census=census_row,
+        closed=bed.get("closed"),
+        blocked=bed.get("blocked"),
+        occupied=census_row.get("occupied", False),
+        encounter=census_row.get("encounter", ""),
+        dc_status=discharge_status,
+        wim=sitrep_row.get("wim_1", -1),
+        sitrep=sitrep_row,
+        yhat_dc=yhat_dc,
+    )
+    if preset_map_positions:
+        position = dict(
+            x=bed.get("xpos", 1) * 9,
+            y=bed.get("ypos", 1) * 9,
+        )
+    else:
+        position = dict(
+            x=bed.get("floor_x_index", -1) * 40,
+            y=(y_index_max - bed.get("floor_y_index", -1)) * 60,
+        )
+    return dict(
+        data=data,
+        position=position,
+        grabbable=False,
+        selectable=True,
+        locked=False,
+    )
+
+
 def _make_elements(  # noqa: C901
     census: list[dict],
     depts: list[dict],
@@ -105,6 +157,8 @@ def _make_elements(  # noqa: C901
         else preset_map_positions
     )
 
+    cache = get_elements_cache()
+
     # create beds
     for bed in beds:
         department = bed.get("department")
@@ -113,51 +167,21 @@ def _make_elements(  # noqa: C901
             continue
         location_string = bed.get("location_string")
 
-        occupied = census_lookup.get(location_string, {}).get("occupied", False)
-        encounter = census_lookup.get(location_string, {}).get("encounter", "")
-        discharge_status = discharge_lookup.get(encounter, {}).get("status", "")
-        wim = sitrep_lookup.get(encounter, {}).get("wim_1", -1)
-        episode_slice_id = sitrep_lookup.get(encounter, {}).get("episode_slice_id", -1)
-        yhat_dc = hymind_lookup.get(episode_slice_id, {}).get("prediction_as_real", -1)
-
-        data = dict(
-            id=location_string,
-            bed_number=bed.get("bed_number"),
-            bed_index=bed.get("bed_index"),
-            department=department,
-            floor=bed.get("floor"),
-            entity="bed",
-            parent=bed.get(bed_parent),
-            bed=bed,
-            census=census_lookup.get(location_string, {}),
-            closed=bed.get("closed"),
-            blocked=bed.get("blocked"),
-            occupied=occupied,
-            encounter=encounter,
-            dc_status=discharge_status,
-            wim=wim,
-            sitrep=sitrep_lookup.get(encounter, {}),
-            yhat_dc=yhat_dc,
-        )
-        if preset_map_positions:
-            position = dict(
-                x=bed.get("xpos", 1) * 9,
-                y=bed.get("ypos", 1) * 9,
-            )
-        else:
-            position = dict(
-                x=bed.get("floor_x_index", -1) * 40,
-                y=(y_index_max - bed.get("floor_y_index", -1)) * 60,
-            )
-        elements.append(
-            dict(
-                data=data,
-                position=position,
-                grabbable=False,
-                selectable=True,
-                locked=False,
-            )
+        census_row = census_lookup.get(location_string, {})
+        encounter = census_row.get("encounter", "")
+        sitrep_row = sitrep_lookup.get(encounter, {})
+        episode_slice_id = sitrep_row.get("episode_slice_id", -1)
+        inputs = (
+            bed,
+            census_row,
+            discharge_lookup.get(encounter, {}).get("status", ""),
+            sitrep_row,
+            hymind_lookup.get(episode_slice_id, {}).get("prediction_as_real", -1),
+            bed_parent,
+            preset_map_positions,
+            y_index_max,
         )
+        elements.append(cache.bed((__name__, location_string), inputs, _bed_element))
 
     if show_rooms:
         for room in rooms:
@@ -222,6 +246,7 @@ def _make_elements(  # noqa: C901
     Input(ids.ROOMS_OPEN_STORE, "data"),
     Input(ids.BEDS_STORE, "data"),
     prevent_initial_call=True,
+    background=get_settings().background_callbacks,
 )
 @logger_timeit()
 def _prepare_cyto_elements_campus(
@@ -233,16 +258,20 @@ def _prepare_cyto_elements_campus(
     """
     Build the element list from pts/beds/rooms/depts for the map
     """
-    elements = _make_elements(
-        census,
-        depts,
-        rooms,
-        beds,
-        sitrep=[{}],
-        hymind=[{}],
-        discharges=[{}],
-        selected_dept=None,
-        ward_only=False,
+    key = elements_key(__name__, "campus", census, depts, rooms, beds)
+    elements = get_elements_cache().get_or_build(
+        key,
+        lambda: _make_elements(
+            census,
+            depts,
+            rooms,
+            beds,
+            sitrep=[{}],
+            hymind=[{}],
+            discharges=[{}],
+            selected_dept=None,
+            ward_only=False,
+        ),
     )
     return elements
 
@@ -285,7 +314,11 @@ def _prepare_cyto_elements_ward(
     """
     if callback_context.triggered_id != ids.ACC_BED_SUBMIT_STORE:
         preset_map_positions = True if dept_grouper == "ALL_ICUS" else False
-        elements = _make_elements(
+        # viewers of the same ward share one element list (see elements_cache)
+        key = elements_key(
+            __name__,
+            dept,
+            preset_map_positions,
             census,
             depts,
             rooms,
@@ -293,9 +326,21 @@ def _prepare_cyto_elements_ward(
             sitrep,
             hymind,
             discharges,
-            selected_dept=dept,
-            ward_only=True,
-            preset_map_positions=preset_map_positions,
+        )
+        elements = get_elements_cache().get_or_build(
+            key,
+            lambda: _make_elements(
+                census,
+                depts,
+                rooms,
+                beds,
+                sitrep,
+                hymind,
+                discharges,
+                selected_dept=dept,
+                ward_only=True,
+                preset_map_positions=preset_map_positions,
+            ),
         )
     elif callback_context.triggered_id == ids.ACC_BED_SUBMIT_STORE:
         node_id = bed_submit_store.get("id")
@@ -3,167 +3,179 @@ Use for slowly updating API calls that can be shared between pages and
 applications
 """
 
-import orjson
-from dash import Input, Output, callback, dcc, html
-from typing import Optional
-
-from models.beds import Bed, Department, Room
-from models.electives import MergedData
-from models.sitrep import SitrepRow
-from models.hymind import IcuDischarge
-from web import ids, SITREP_DEPT2WARD_MAPPING
+import hashlib
+
+from dash import Input, Output, State, callback, dcc, html, no_update
+from typing import Any, Optional
+
+from web import cache_codec, ids, SITREP_DEPT2WARD_MAPPING
 from web.logger import logger, logger_timeit
 
 from web.celery import redis_client
-from web.celery_tasks import get_response
-from web.celery_config import beat_schedule  # single source of truth for tasks
+from web.celery_tasks import queue_refresh, version_key
+from web.celery_config import store_tasks  # single source of truth for tasks
 
 # TODO: add a refresh button as an input to the store functions pulling from
 #  baserow so that changes from baserow edits can be brought through (
 #  although a page refresh may do the same thing?)
 
+# While any store is still incomplete the browser checks back this often (see
+# _stop_hydration_timer), up to HYDRATION_MAX_CHECKS times (5 minutes) so an
+# API that is down is not polled for ever; the hourly timer takes over after
+HYDRATION_INTERVAL_SECONDS = 3
+HYDRATION_MAX_CHECKS = 100
+
+
+def _version_store(store_id: str) -> str:
+    """Id of the dcc.Store holding the version of store_id's data"""
+    return f"{store_id}-version"
+
 
 def _get_or_refresh_cache(
-    task: str, url: Optional[str] = None, expires: Optional[int] = None
-) -> list[dict]:
+    tasks: list[str], version: Optional[str] = None
+) -> tuple[Optional[dict[str, list[dict]]], Optional[str]]:
     """
-    Get or refresh a store using the task defined in beat_schedule
+    Get or refresh the data for the tasks defined in store_tasks
+
+    Never waits on the API: on a cache miss a celery task is queued (once per
+    key) to fetch the data and the task is left out meanwhile. The store
+    callbacks leave the browser's copy as it is until a later tick (see
+    STORE_HYDRATION_TIMER) finds the data cached.
+
+    The data is only read (and so only re-sent to the browser) if it has
+    changed: the celery task writes a content hash alongside each key and
+    version is the browser's copy of those hashes.
 
     Parameters
     ----------
-    task : str - as defined in beat_schedule
-    url : str - if you wish to override
-    (i.e. when need to build for a specific endpoint)
-    expires : int
+    tasks : list[str] - as defined in store_tasks
+    version : str - the version the browser already holds
 
     Returns
     -------
-    list[dict]
+    (dict of task -> list[dict], version), or (None, ...) if nothing has
+    changed or nothing is cached yet
 
     """
-    if not url:
-        url, cache_key = beat_schedule[task]["args"]  # tuple unpacking
-    else:
-        _, cache_key = beat_schedule[task]["args"]  # tuple unpacking
-
-    if not expires:
-        expires = beat_schedule.get(task).get("kwargs").get("expires")  # type: ignore
-
-    cached_data = redis_client.get(cache_key)
+    cache_keys = [store_tasks[task]["args"][1] for task in tasks]
+
+    hashes = redis_client.mget([version_key(key) for key in cache_keys])
+    for task, cache_key, content_hash in zip(tasks, cache_keys, hashes):
+        if content_hash is None:
+            url = store_tasks[task]["args"][0]
+            if queue_refresh(url, cache_key, **store_tasks[task]["kwargs"]):
+                logger.info(f"Queued fetch of {task} from API")
+
+    current = hashlib.sha1(b"|".join(h or b"" for h in hashes)).hexdigest()
+    if current == version:
+        logger.info(f"Browser already holds the current {', '.join(tasks)}")
+        return None, version
+
+    data = {
+        task: cache_codec.loads(cached_data)
+        for task, cached_data in zip(tasks, redis_client.mget(cache_keys))
+        if cached_data is not None
+    }
+    if not data:
+        return None, version
+    logger.info(f"Fetching {', '.join(data)} from cached data")
+    return data, current
+
+
+def _icus(prefix: str) -> set[str]:
+    """The icus with a store_tasks task starting with prefix"""
+    return {
+        store_tasks[task]["args"][1].split("-")[-1]  # type: ignore
+        for task in store_tasks
+        if task.startswith(prefix)
+    }
+
+
+def _by_icu(prefix: str, version: Optional[str]) -> tuple:
+    """
+    Data for every store_tasks task starting with prefix keyed by icu
+    """
+    tasks = [task for task in store_tasks if task.startswith(prefix)]
+    data, version = _get_or_refresh_cache(tasks, version)
+    if data is None:
+        return no_update, no_update
 
-    if cached_data is None:
-        logger.info(f"Fetching {task} from API")
-        fetch_data_task = get_response.delay(url, cache_key, expires)
-        data = fetch_data_task.get()  # type: list[dict]
-    else:
-        logger.info(f"Fetching {task} from cached data")
-        data = orjson.loads(cached_data)  # type: ignore
+    res = {}
+    for task, rows in data.items():
+        # FIXME: hacky way to get sitrep ICU b/c we know the 2nd arg (the key)
+        # is the icu url and the last component is the icu
+        # kkey = f"{web_ids.SITREP_STORE}-{icu}"
+        icu = store_tasks[task]["args"][1].split("-")[-1]  # type: ignore
+        assert icu in SITREP_DEPT2WARD_MAPPING.values()
+        res[icu] = rows
 
-    return data
+    return res, version
 
 
 @callback(
-    Output(ids.DEPT_STORE, "data"),
+    Output(ids.SITREP_STORE, "data"),
+    Output(_version_store(ids.SITREP_STORE), "data"),
     Input(ids.STORE_TIMER_1H, "n_intervals"),
+    Input(ids.STORE_HYDRATION_TIMER, "n_intervals"),
+    State(_version_store(ids.SITREP_STORE), "data"),
 )
 @logger_timeit()
-def _store_departments(_: int) -> list[dict]:
-    """Store all open departments"""
-    task = ids.DEPT_STORE
-    data = _get_or_refresh_cache(task)
-    depts = [Department.parse_obj(row).dict() for row in data]
-    return [d for d in depts if not d.get("closed_perm_01")]
+def _store_all_sitreps(_: int, __: int, version: Optional[str]) -> tuple:
+    """
+    Return sitrep status for all critical care areas
+    Uses the store_tasks defined in web.celery_config to hold urls
+    """
+    # validated as SitrepRow by the celery task
+    return _by_icu(ids.SITREP_STORE, version)
 
 
 @callback(
-    Output(ids.ROOM_STORE, "data"),
+    Output(ids.HYMIND_ICU_DC_STORE, "data"),
+    Output(_version_store(ids.HYMIND_ICU_DC_STORE), "data"),
     Input(ids.STORE_TIMER_1H, "n_intervals"),
+    Input(ids.STORE_HYDRATION_TIMER, "n_intervals"),
+    State(_version_store(ids.HYMIND_ICU_DC_STORE), "data"),
 )
-@logger_timeit()
-def _store_rooms(_: int) -> list[dict]:
-    """Store all rooms with beds"""
-    task = ids.ROOM_STORE
-    data = _get_or_refresh_cache(task)
-    rooms = [Room.parse_obj(row).dict() for row in data]
-    return [r for r in rooms if r.get("has_beds")]
+def _store_all_hymind_dc_predictions(_: int, __: int, version: Optional[str]) -> tuple:
+    """Return hymind predictions for all areas"""
+    # validated as IcuDischarge by the celery task
+    return _by_icu(ids.HYMIND_ICU_DC_STORE, version)
 
 
-@callback(
-    Output(ids.BEDS_STORE, "data"),
-    Input(ids.STORE_TIMER_1H, "n_intervals"),
-)
-@logger_timeit()
-def _store_beds(_: int) -> list[dict]:
-    task = ids.BEDS_STORE
-    data = _get_or_refresh_cache(task)
-    return [Bed.parse_obj(row).dict() for row in data]
+_HYDRATED_STORES = [
+    ids.SITREP_STORE,
+    ids.HYMIND_ICU_DC_STORE,
+]
 
 
 @callback(
-    Output(ids.ELECTIVES_STORE, "data"),
-    Input(ids.STORE_TIMER_6H, "n_intervals"),
+    Output(ids.STORE_HYDRATION_TIMER, "disabled"),
+    [Input(store_id, "data") for store_id in _HYDRATED_STORES],
 )
-@logger_timeit()
-def _store_electives(_: int) -> list[dict]:
-    task = ids.ELECTIVES_STORE
-    data = _get_or_refresh_cache(task)
-    return [MergedData.parse_obj(row).dict() for row in data]
+def _stop_hydration_timer(*stores: Any) -> bool:
+    """Stop checking back once every store holds data for every icu"""
+    return all(
+        _hydrated(store_id, store) for store_id, store in zip(_HYDRATED_STORES, stores)
+    )
 
 
-@callback(
-    Output(ids.SITREP_STORE, "data"),
-    Input(ids.STORE_TIMER_1H, "n_intervals"),
-)
-@logger_timeit()
-def _store_all_sitreps(_: int) -> dict:
+def _hydrated(store_id: str, store: Optional[dict]) -> bool:
     """
-    Return sitrep status for all critical care areas
-    Uses the beat_schedule defined in web.celery_config to hold urls
+    Whether a per icu store (see _by_icu) holds data for every icu; the
+    tasks for some icus may still be queued when the first are cached
     """
-    sitreps = {}
-    for task, conf in beat_schedule.items():
-        if not task.startswith(ids.SITREP_STORE):
-            continue
-        data = _get_or_refresh_cache(task)
-        # FIXME: hacky way to get sitrep ICU b/c we know the 2nd arg (the key)
-        # is the icu url and the last component is the icu
-        # kkey = f"{web_ids.SITREP_STORE}-{icu}"
-        icu = conf.get("args")[1].split("-")[-1]  # type: ignore
-        assert icu in SITREP_DEPT2WARD_MAPPING.values()
-        sitreps[icu] = [SitrepRow.parse_obj(row).dict() for row in data]
-
-    return sitreps
-
-
-@callback(
-    Output(ids.HYMIND_ICU_DC_STORE, "data"),
-    Input(ids.STORE_TIMER_1H, "n_intervals"),
-)
-def _store_all_hymind_dc_predictions(_: int) -> dict:
-    """Return hymind predictions for all areas"""
-    yhats = {}
-
-    for task, conf in beat_schedule.items():
-        if not task.startswith(ids.HYMIND_ICU_DC_STORE):
-            continue
-        data = _get_or_refresh_cache(task)
-        # FIXME: hacky way to get sitrep ICU b/c we know the 2nd arg (the key)
-        # is the icu url and the last component is the icu
-        # kkey = f"{web_ids.SITREP_STORE}-{icu}"
-        icu = conf.get("args")[1].split("-")[-1]  # type: ignore
-        assert icu in SITREP_DEPT2WARD_MAPPING.values()
-        yhats[icu] = [IcuDischarge.parse_obj(row).dict() for row in data]
-
-    return yhats
+    return store is not None and _icus(store_id) <= set(store)
 
 
 web_stores = html.Div(
     [
-        dcc.Store(id=ids.DEPT_STORE),
-        dcc.Store(id=ids.ROOM_STORE),
-        dcc.Store(id=ids.BEDS_STORE),
-        dcc.Store(id=ids.ELECTIVES_STORE),
-        dcc.Store(id=ids.SITREP_STORE),
-        dcc.Store(id=ids.HYMIND_ICU_DC_STORE),
+        dcc.Interval(
+            id=ids.STORE_HYDRATION_TIMER,
+            n_intervals=0,
+            interval=HYDRATION_INTERVAL_SECONDS * 1000,
+            max_intervals=HYDRATION_MAX_CHECKS,
+        ),
+        *(dcc.Store(id=store_id) for store_id in _HYDRATED_STORES),
+        *(dcc.Store(id=_version_store(store_id)) for store_id in _HYDRATED_STORES),
     ]
 )
@@ -0,0 +1,95 @@
+import threading
+from typing import Any, Optional
+
+import pytest
+
+from web import celery_tasks, stores
+
+
+def _to_bytes(value: Any) -> bytes:
+    """As redis stores (and returns) values"""
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class _Pipeline:
+    """Queues the calls made on it and runs them on the client on execute"""
+
+    def __init__(self, redis: "_Redis") -> None:
+        self._redis = redis
+        self._calls: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def queue(*args: Any, **kwargs: Any) -> None:
+            self._calls.append((name, args, kwargs))
+
+        return queue
+
+    def execute(self) -> list[Any]:
+        self._redis.executed.append([name for name, _, _ in self._calls])
+        results = [
+            getattr(self._redis, name)(*args, **kwargs)
+            for name, args, kwargs in self._calls
+        ]
+        self._calls = []
+        return results
+
+    def __enter__(self) -> "_Pipeline":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        pass
+
+
+class _Redis:
+    """Just the redis client calls the celery_tasks and stores helpers make"""
+
+    def __init__(self) -> None:
+        self.values: dict[str, bytes] = {}
+        self.ttls: dict[str, Optional[int]] = {}
+        # the calls made by each pipeline executed
+        self.executed: list[list[str]] = []
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None, nx: bool = False):
+        with self._lock:
+            if nx and key in self.values:
+                return None
+            self.values[key] = _to_bytes(value)
+            self.ttls[key] = ex
+            return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+    def mget(self, *keys: Any) -> list[Optional[bytes]]:
+        if len(keys) == 1 and isinstance(keys[0], list):
+            keys = tuple(keys[0])
+        return [self.values.get(key) for key in keys]
+
+    def hincrby(self, key: str, field: str, amount: int) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+
+    def eval(self, script: str, numkeys: int, key: str, token: str) -> int:
+        # only the compare-and-delete used to release locks
+        with self._lock:
+            if self.values.get(key) != _to_bytes(token):
+                return 0
+            del self.values[key]
+            return 1
+
+    def pipeline(self) -> _Pipeline:
+        return _Pipeline(self)
+
+
+@pytest.fixture
+def redis(monkeypatch) -> _Redis:
+    """A fake redis client in place of the real one"""
+    redis = _Redis()
+    monkeypatch.setattr(celery_tasks, "redis_client", redis)
+    monkeypatch.setattr(stores, "redis_client", redis)
+    return redis
@@ -0,0 +1,27 @@
+import orjson
+
+from web import cache_codec
+
+
+def test_small_values_are_not_compressed() -> None:
+    data = [{"location_string": "T03^BY01-01", "occupied": True}]
+    value = cache_codec.dumps(data)
+
+    assert value[:1] == cache_codec.ORJSON
+    assert cache_codec.loads(value) == data
+
+
+def test_large_values_are_compressed() -> None:
+    data = [{"department": "UCH T03 INTENSIVE CARE", "bed": i} for i in range(2000)]
+    payload = orjson.dumps(data)
+    value = cache_codec.pack(payload)
+
+    assert len(payload) > cache_codec.COMPRESS_THRESHOLD
+    assert value[:1] == cache_codec.ORJSON_ZLIB
+    assert len(value) < len(payload)
+    assert cache_codec.unpack(value) == payload
+
+
+def test_values_written_without_a_header_are_read() -> None:
+    data = {"a": [1, 2, 3]}
+    assert cache_codec.loads(orjson.dumps(data)) == data
@@ -0,0 +1,51 @@
+from web import SITREP_DEPT2WARD_MAPPING
+from web.cached_requests import (
+    electives_request,
+    sitrep_census_request,
+    warm_up_plan,
+)
+from web.celery_tasks import _json_params, request_cache_key
+from web.pages.sitrep import CAMPUSES
+
+
+def test_warm_up_plan_covers_every_page_selector() -> None:
+    plan = warm_up_plan()
+    keys = [request_cache_key(r.url, r.params) for r in plan]
+
+    assert len(set(keys)) == len(keys)
+    for grouper in ["ALL_ICUS", *(i["value"] for i in CAMPUSES)]:
+        request = sitrep_census_request(grouper)
+        assert request_cache_key(request.url, request.params) in keys
+
+
+def test_request_cache_key_normalises_params() -> None:
+    url = "http://api:8000/census/"
+    departments = SITREP_DEPT2WARD_MAPPING.keys()
+
+    assert request_cache_key(url, {"departments": departments}) == request_cache_key(
+        url, {"departments": list(departments)}
+    )
+
+
+def test_electives_request_normalises_picker_dates() -> None:
+    campus = "UNIVERSITY COLLEGE HOSPITAL CAMPUS"
+    request = electives_request(campus, ["2023-03-03T00:00:00", "2023-03-06"])
+
+    assert request.url.endswith("/electives/by_date/")
+    assert request.params == {
+        "campus": "UCH",
+        "start_date": "2023-03-03",
+        "end_date": "2023-03-06",
+    }
+    assert electives_request(campus).params == {"campus": "UCH"}
+
+
+def test_json_params_keeps_scalars() -> None:
+    params = {"a": None, "b": True, "c": 1.5, "d": "x", "e": ("y", "z")}
+    assert _json_params(params) == {
+        "a": None,
+        "b": True,
+        "c": 1.5,
+        "d": "x",
+        "e": ["y", "z"],
+    }
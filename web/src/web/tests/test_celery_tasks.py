@@ -0,0 +1,194 @@
+import threading
+from typing import Any
+
+import pytest
+import requests
+
+from web import cache_codec, celery_tasks
+from web.celery_config import _jittered_minutes
+from web.celery_tasks import MISS_EXPIRES, requests_try_cache_many
+
+
+class _Response:
+    def __init__(self, data: Any, status_code: int = 200) -> None:
+        self._data = data
+        self.status_code = status_code
+
+    def json(self) -> Any:
+        return self._data
+
+
+class _Session:
+    """Stands in for the pooled requests.Session; get calls fetch()"""
+
+    def __init__(self, fetch) -> None:
+        self.fetch = fetch
+        self.calls = 0
+
+    def get(self, url: str, params=None, timeout=None) -> _Response:
+        self.calls += 1
+        return _Response(self.fetch())
+
+
+def _locks(redis) -> list[str]:
+    return [key for key in redis.values if key.endswith(":lock")]
+
+
+def test_requests_try_cache_many_keeps_misses_briefly(monkeypatch, redis) -> None:
+    requested = []
+
+    def fetch_json(url: str, params: dict) -> tuple[int, dict]:
+        requested.append(params["hospital_visit_ids"])
+        return 200, {"1": 0.5}
+
+    monkeypatch.setattr(celery_tasks, "_fetch_json", fetch_json)
+
+    def _predictions() -> dict:
+        return requests_try_cache_many(
+            "http://api/perrt/icu_admission_prediction",
+            "hospital_visit_ids",
+            [1, 2],
+            split=lambda data, hv_ids: {i: data.get(i) for i in hv_ids},
+            expires=3600,
+        )
+
+    assert _predictions() == {"1": 0.5, "2": None}
+    ttls = {key[-1]: ttl for key, ttl in redis.ttls.items() if "_ID_" in key}
+    assert ttls == {"1": 3600, "2": MISS_EXPIRES}
+    # the refresh lock is released
+    assert not _locks(redis)
+
+    assert _predictions() == {"1": 0.5, "2": None}
+    assert requested == [["1", "2"]]
+
+
+def test_lock_release_leaves_a_lock_taken_since(redis) -> None:
+    token = celery_tasks._acquire_lock("key")
+    assert token is not None
+    assert celery_tasks._acquire_lock("key") is None
+
+    # the lock expires mid-fetch and another caller takes it
+    redis.delete("key:lock")
+    other = celery_tasks._acquire_lock("key")
+    celery_tasks._release_lock("key", token)
+    assert _locks(redis) == ["key:lock"]
+
+    celery_tasks._release_lock("key", other)
+    assert not _locks(redis)
+
+
+def test_stale_hit_returns_cached_value_and_queues_one_refresh(
+    monkeypatch, redis
+) -> None:
+    queued = []
+
+    class _RefreshResponse:
+        @staticmethod
+        def delay(url: str, cache_key: str, **kwargs: Any) -> None:
+            queued.append(cache_key)
+
+    monkeypatch.setattr(celery_tasks, "refresh_response", _RefreshResponse)
+    url = "http://api/census/"
+    cache_key = celery_tasks.request_cache_key(url)
+    celery_tasks._set_cache(cache_key, [1, 2], expires=60, stale_for=60)
+
+    # fresh: served from the cache without a refresh
+    assert celery_tasks.requests_try_cache(url, expires=60) == [1, 2]
+    assert queued == []
+
+    # the soft TTL passes; stale values are still served
+    redis.delete(celery_tasks._fresh_key(cache_key))
+    assert celery_tasks.requests_try_cache(url, expires=60) == [1, 2]
+    assert celery_tasks.requests_try_cache(url, expires=60) == [1, 2]
+    assert queued == [cache_key]
+
+
+def test_miss_is_fetched_once_across_concurrent_callers(monkeypatch, redis) -> None:
+    release = threading.Event()
+
+    def fetch() -> list:
+        release.wait(5)
+        return [1, 2]
+
+    session = _Session(fetch)
+    monkeypatch.setattr(celery_tasks, "_http_session", lambda: session)
+    monkeypatch.setattr(celery_tasks, "LOCK_POLL_INTERVAL", 0.01)
+
+    url = "http://api/census/"
+    results = []
+    callers = [
+        threading.Thread(
+            target=lambda: results.append(celery_tasks.requests_try_cache(url))
+        )
+        for _ in range(4)
+    ]
+    for caller in callers:
+        caller.start()
+    # let the others find the lock held then finish the fetch
+    while session.calls == 0:
+        release.wait(0.01)
+    release.wait(0.05)
+    release.set()
+    for caller in callers:
+        caller.join(5)
+
+    assert results == [[1, 2]] * 4
+    assert session.calls == 1
+    assert not _locks(redis)
+
+
+def test_lock_is_released_when_the_fetch_raises(monkeypatch, redis) -> None:
+    def fetch() -> list:
+        raise requests.ConnectionError("api down")
+
+    monkeypatch.setattr(celery_tasks, "_http_session", lambda: _Session(fetch))
+
+    with pytest.raises(requests.ConnectionError):
+        celery_tasks.requests_try_cache("http://api/census/")
+    assert not _locks(redis)
+
+    # and by a queued background refresh
+    token = celery_tasks._acquire_lock("census")
+    with pytest.raises(requests.ConnectionError):
+        celery_tasks.refresh_response("http://api/census/", "census", lock_token=token)
+    assert not _locks(redis)
+
+
+def test_refresh_many_keeps_failed_keys_and_writes_in_one_pipeline(
+    monkeypatch, redis
+) -> None:
+    celery_tasks._set_cache("T03", ["old T03"], expires=60)
+    celery_tasks._set_cache("GWB", ["old GWB"], expires=60)
+    redis.executed.clear()
+
+    def fetch_json(url: str) -> tuple:
+        if url.endswith("GWB"):
+            return 500, None
+        return 200, [f"new {url[-3:]}"]
+
+    monkeypatch.setattr(celery_tasks, "_fetch_json", fetch_json)
+    statuses = celery_tasks.refresh_many(
+        [
+            ("http://api/T03", "T03"),
+            ("http://api/GWB", "GWB"),
+            ("http://api/WMS", "WMS"),
+        ],
+        expires=60,
+    )
+
+    assert statuses == {"T03": 200, "GWB": 500, "WMS": 200}
+    assert len(redis.executed) == 1
+    assert cache_codec.loads(redis.get("T03")) == ["new T03"]
+    assert cache_codec.loads(redis.get("WMS")) == ["new WMS"]
+    # the failed url leaves the previous value in place
+    assert cache_codec.loads(redis.get("GWB")) == ["old GWB"]
+
+
+def test_jittered_minutes_spread_tasks_within_their_interval() -> None:
+    minutes = {_jittered_minutes(f"task-{i}", 30) for i in range(20)}
+    assert len(minutes) > 1
+    for entry in minutes:
+        offset, every = entry.split("-59/")
+        assert every == "30"
+        assert 0 <= int(offset) < 30
+    assert _jittered_minutes("task-1", 30) == _jittered_minutes("task-1", 30)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 
-from web.convert import to_data_frame, parse_to_data_frame
+from web.convert import columns_to_records, to_data_frame, parse_to_data_frame
 
 
 class MyModel(BaseModel):
@@ -30,3 +30,12 @@ def test_parse_to_data_frame() -> None:
     assert df.iloc[0].b == "1"
     assert df.iloc[1].a == 2
     assert df.iloc[1].b == "2"
+
+
+def test_columns_to_records() -> None:
+    records = columns_to_records({"a": [1, 2], "b": ["1", None]})
+    assert records == [{"a": 1, "b": "1"}, {"a": 2, "b": None}]
+
+
+def test_columns_to_records_empty() -> None:
+    assert columns_to_records({"a": [], "b": []}) == []
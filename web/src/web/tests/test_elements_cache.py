@@ -0,0 +1,55 @@
+from web.elements_cache import ElementsCache, elements_key
+
+
+def test_elements_key_changes_with_inputs() -> None:
+    census = [{"location_string": "T03^BY01-01", "occupied": True}]
+    key = elements_key("ward", "T03", census)
+
+    assert key == elements_key("ward", "T03", [dict(census[0])])
+    assert key != elements_key("ward", "T06", census)
+    assert key != elements_key("ward", "T03", [{**census[0], "occupied": False}])
+
+
+def test_get_or_build_reuses_elements() -> None:
+    cache = ElementsCache()
+    builds = []
+
+    def _build() -> list[dict]:
+        builds.append(1)
+        return [{"data": {"id": "bed"}}]
+
+    first = cache.get_or_build("key", _build)
+    second = cache.get_or_build("key", _build)
+
+    assert first is second
+    assert len(builds) == 1
+
+
+def test_bed_rebuilt_only_when_inputs_change() -> None:
+    cache = ElementsCache()
+
+    def _build(bed: dict, census_row: dict) -> dict:
+        return {"data": {"id": bed["location_string"], "census": census_row}}
+
+    bed = {"location_string": "T03^BY01-01"}
+    first = cache.bed("T03^BY01-01", (bed, {"occupied": False}), _build)
+    unchanged = cache.bed("T03^BY01-01", (dict(bed), {"occupied": False}), _build)
+    changed = cache.bed("T03^BY01-01", (bed, {"occupied": True}), _build)
+
+    assert unchanged is first
+    assert changed is not first
+    assert changed["data"]["census"] == {"occupied": True}
+
+
+def test_maxsize_evicts_least_recently_used() -> None:
+    cache = ElementsCache(maxsize=2)
+    cache.get_or_build("a", lambda: [])
+    cache.get_or_build("b", lambda: [])
+    cache.get_or_build("a", lambda: [])
+    cache.get_or_build("c", lambda: [])
+
+    rebuilt = []
+    cache.get_or_build("a", lambda: rebuilt.append("a") or [])
+    cache.get_or_build("b", lambda: rebuilt.append("b") or [])
+
+    assert rebuilt == ["b"]
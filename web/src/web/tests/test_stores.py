@@ -0,0 +1,36 @@
+from dash import no_update
+
+from web import SITREP_DEPT2WARD_MAPPING, ids
+from web.celery_config import store_tasks
+from web.celery_tasks import _set_cache
+from web.stores import _by_icu, _hydrated
+
+
+def test_hydrated_needs_every_icu() -> None:
+    icus = list(SITREP_DEPT2WARD_MAPPING.values())
+
+    assert not _hydrated(ids.SITREP_STORE, None)
+    assert not _hydrated(ids.SITREP_STORE, {icu: [] for icu in icus[1:]})
+    assert _hydrated(ids.SITREP_STORE, {icu: [] for icu in icus})
+
+
+def test_store_is_resent_only_when_its_data_changes(redis) -> None:
+    cache_keys = [
+        conf["args"][1]
+        for task, conf in store_tasks.items()
+        if task.startswith(ids.SITREP_STORE)
+    ]
+    for cache_key in cache_keys:
+        _set_cache(cache_key, [{"bed": 1}], expires=60)
+
+    data, version = _by_icu(ids.SITREP_STORE, None)
+    assert set(data) == set(SITREP_DEPT2WARD_MAPPING.values())
+    assert version is not None
+
+    # the browser already holds this version so nothing is read or sent
+    assert _by_icu(ids.SITREP_STORE, version) == (no_update, no_update)
+
+    _set_cache(cache_keys[0], [{"bed": 2}], expires=60)
+    data, new_version = _by_icu(ids.SITREP_STORE, version)
+    assert new_version != version
+    assert data[cache_keys[0].split("-")[-1]] == [{"bed": 2}]